@@ -1,3 +1,7 @@
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
 
 class RuleConfig:
     """Configuration parameters for transaction monitoring rules."""
@@ -18,4 +22,102 @@ class RuleConfig:
     min_user_history: int = 3  # Minimum transactions needed for user profiling
 
 
-config = RuleConfig()
\ No newline at end of file
+def snapshot_config(rule_config: RuleConfig) -> RuleConfig:
+    """
+    Args:
+        rule_config: RuleConfig, typically the module-level config
+    Returns:
+        RuleConfig: a copy of its thresholds, not changed by later reloads
+    """
+    snapshot = RuleConfig()
+    for name in RuleConfig.__annotations__:
+        setattr(snapshot, name, getattr(rule_config, name))
+    return snapshot
+
+
+_pinned_config: ContextVar[Optional[RuleConfig]] = ContextVar("pinned_rule_config", default=None)
+
+
+def active_config() -> RuleConfig:
+    """
+    Returns:
+        RuleConfig: the config the rules read their thresholds from, the one pinned by
+            pinned_config in the current context or else the module-level config, which a
+            rule set reload changes in place
+    """
+    pinned = _pinned_config.get()
+    return config if pinned is None else pinned
+
+
+@contextmanager
+def pinned_config(rule_config: RuleConfig) -> Iterator[RuleConfig]:
+    """
+    Make active_config return rule_config in the current context while the block runs, so a
+    reload in the meantime does not change the thresholds it scores with halfway through,
+    e.g. in a report job. Other threads and requests keep reading the module-level config.
+    Args:
+        rule_config: RuleConfig, typically from snapshot_config
+    """
+    token = _pinned_config.set(rule_config)
+    try:
+        yield rule_config
+    finally:
+        _pinned_config.reset(token)
+
+
+class ServiceConfig:
+    """Configuration parameters for the fraud monitoring service."""
+    # Profile parameters
+    incremental_profiles: bool = False  # Fold new and scored transactions into the existing profiles
+    profile_snapshot_path: Optional[str] = None  # Profile snapshot written by analyze_data and loaded at startup
+    profile_cache_max_bytes: Optional[int] = None  # Serve profiles from an LRU cache of this size in front of the
+                                                   # snapshot or the transaction store, instead of all in memory
+    profile_cache_top_merchants: Optional[int] = None  # Merchants kept exactly per cached user, the rest are counted
+                                                       # approximately in a count-min sketch
+    profile_cache_sketch_width: int = 64  # Counters per row of each cached user's merchant sketch
+    profile_cache_sketch_depth: int = 2  # Rows of each cached user's merchant sketch
+
+    # Transaction store parameters
+    transaction_store_url: Optional[str] = None  # e.g. "sqlite:///./app/data/transactions.db", reports then read from it
+    transaction_store_pool_size: int = 5  # Connections kept open to the transaction store
+
+    # Report parameters
+    analysis_mode: str = "memory"  # "memory" loads the whole CSV, "streaming" processes it in partitions,
+                                   # "parallel" shards it by userId across worker processes, "point_in_time"
+                                   # scores each transaction against the user's earlier transactions only
+    workers: int = os.cpu_count() or 1  # Worker processes in parallel mode
+    stream_chunksize: int = 1_000_000  # Rows read per chunk in streaming mode
+    stream_partitions: int = 16  # Number of userId hash partitions in streaming mode
+    spill_dir: Optional[str] = None  # Directory for partition spill files, defaults to the system temp dir
+    input_cache_dir: Optional[str] = None  # Keep parsed CSV input here as Arrow IPC, keyed by path, size and mtime
+    output_format: str = "csv"  # Format of the report output: "csv", "parquet" or "arrow" (Arrow IPC)
+    output_flagged_only: bool = False  # Only write the suspicious transactions to the report output
+    report_workers: int = 1  # Report jobs that may run at the same time
+    max_report_jobs: int = 100  # Finished report jobs kept for the status and result endpoints
+
+    # Online velocity parameters
+    recent_activity_capacity: int = 32  # Timestamps kept per user, at least velocity_threshold_count
+    recent_activity_ttl_minutes: int = 60  # Idle users are evicted after this long, at least velocity_window_minutes
+    recent_activity_max_users: int = 100_000  # Maximum number of users tracked at once
+
+    # Rule set parameters
+    rule_set_path: Optional[str] = None  # JSON or YAML rule set loaded at startup and by POST /rules/reload
+
+    # Online replay parameters
+    replay_ttl_minutes: int = 60  # How far back, in transaction time, replays and resubmissions are detected
+    replay_max_entries: int = 100_000  # Maximum number of transaction fingerprints kept
+
+    # Instrumentation parameters
+    request_profiling_sample_rate: float = 0.0  # Share of /fraud-check requests run under cProfile, see /debug/profile
+
+    # Batch scoring parameters
+    max_batch_size: int = 1000  # Maximum number of transactions accepted by /fraud-check/batch
+
+    # NDJSON feed parameters
+    feed_max_batch_size: int = 500  # Most transactions scored together by the feed processor
+    feed_max_batch_latency_ms: float = 50  # Longest a transaction waits for its micro-batch to fill up
+    feed_queue_size: int = 10_000  # Lines read ahead of the scorer before the reader waits
+
+
+config = RuleConfig()
+service_config = ServiceConfig()
\ No newline at end of file
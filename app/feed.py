@@ -0,0 +1,61 @@
+"""
+Score a continuous NDJSON feed of transactions and write the results as NDJSON.
+
+    python app/feed.py --input transactions.ndjson --output results.ndjson
+    tail -f transactions.ndjson | python app/feed.py
+    python app/feed.py --unix-socket /tmp/fraud-feed.sock
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from app.config import service_config
+from app.getters import get_fraud_detection_service, get_runtime_rules
+from app.sevices.feed import TransactionFeedProcessor, file_lines, file_writer
+
+
+async def run(args: argparse.Namespace) -> None:
+    service = get_fraud_detection_service()
+    if args.profiles:
+        service.load_data(args.profiles)
+        service.build_user_profiles()
+    processor = TransactionFeedProcessor(service, get_runtime_rules(),
+                                         max_batch_size=args.max_batch_size,
+                                         max_batch_latency_ms=args.max_batch_latency_ms,
+                                         queue_size=args.queue_size)
+    try:
+        if args.unix_socket:
+            await processor.serve_unix(args.unix_socket)
+            return
+        source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+        sink = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+        try:
+            stats = await processor.process(file_lines(source), file_writer(sink))
+        finally:
+            for f in (source, sink):
+                if f not in (sys.stdin.buffer, sys.stdout.buffer):
+                    f.close()
+        print(json.dumps(stats), file=sys.stderr)
+    finally:
+        processor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--input', default='-', help='NDJSON file to read, stdin by default')
+    parser.add_argument('--output', default='-', help='NDJSON file to write, stdout by default')
+    parser.add_argument('--unix-socket', help='serve feeds on this Unix socket instead of reading --input')
+    parser.add_argument('--profiles', help='CSV to build the profiles from, instead of the profile snapshot')
+    parser.add_argument('--max-batch-size', type=int, default=service_config.feed_max_batch_size)
+    parser.add_argument('--max-batch-latency-ms', type=float, default=service_config.feed_max_batch_latency_ms)
+    parser.add_argument('--queue-size', type=int, default=service_config.feed_queue_size)
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,103 @@
-from app.config import config
+from datetime import timedelta
+from app.config import config, service_config
+from app.sevices.jobs import ReportJobManager
+from app.sevices.metrics import (PROFILE_CACHE_BYTES, PROFILE_CACHE_USERS, PROFILE_STORE_BYTES, PROFILE_STORE_USERS,
+                                 RECENT_ACTIVITY_BYTES, RECENT_ACTIVITY_USERS, REPLAY_INDEX_ENTRIES, RequestProfiler)
+from app.sevices.profile_cache import ProfileCache, TransactionStoreProfileSource
 from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
-from app.sevices.rules.rules import VelocityCheckRule, TimeAnomalyRule, MerchantAnomalyRule, AmountDeviationRule, UnusualMerchantActivityRule
+from app.sevices.rules.declarative import RuleSetRegistry, load_rule_set
+from app.sevices.rules.recent_activity import RecentActivityIndex
+from app.sevices.rules.replay import ReplayIndex
+from app.sevices.store import TransactionStore
+from app.sevices.rules.rules import VelocityCheckRule, TimeAnomalyRule, MerchantAnomalyRule, AmountDeviationRule, UnusualMerchantActivityRule, ReplayCheckRule
 from app.protocol import FraudDetectionService, Rule
-from typing import List
+from typing import List, Optional
 
 rules = [
         VelocityCheckRule(),
         TimeAnomalyRule(),
         MerchantAnomalyRule(),
         AmountDeviationRule(),
-        UnusualMerchantActivityRule()
+        UnusualMerchantActivityRule(),
+        ReplayCheckRule()
     ]
 
+recent_activity = RecentActivityIndex(capacity=service_config.recent_activity_capacity,
+                                     ttl=timedelta(minutes=service_config.recent_activity_ttl_minutes),
+                                     max_users=service_config.recent_activity_max_users)
+replays = ReplayIndex(ttl=timedelta(minutes=service_config.replay_ttl_minutes),
+                      max_entries=service_config.replay_max_entries)
+
+request_profiler = RequestProfiler(sample_rate=service_config.request_profiling_sample_rate)
+RECENT_ACTIVITY_USERS.callback = lambda: {(): len(recent_activity)}
+RECENT_ACTIVITY_BYTES.callback = lambda: {(): recent_activity.nbytes()}
+REPLAY_INDEX_ENTRIES.callback = lambda: {(): len(replays)}
+
+rule_sets = RuleSetRegistry(batch_rules=rules, runtime_rules=[
+        VelocityCheckRule(recent_activity=recent_activity),
+        AmountDeviationRule(),
+        MerchantAnomalyRule(),
+        TimeAnomalyRule(),
+        UnusualMerchantActivityRule(),
+        ReplayCheckRule(replays=replays)
+    ], rule_config=config)
+if service_config.rule_set_path:
+    rule_sets.reload(load_rule_set(service_config.rule_set_path))
+
 fraud_detection_service = None
+report_jobs = None
+transaction_store = None
 
 def get_fraud_detection_service() -> FraudDetectionService:
     """Get the fraud detection service."""
     global fraud_detection_service
     if fraud_detection_service is None:
-        fraud_detection_service = RuleBasedFraudMonitoringService(config=config, rules=rules)
+        fraud_detection_service = RuleBasedFraudMonitoringService(config=config, rules=rule_sets.batch,
+                                                                  service_config=service_config)
+        fraud_detection_service.result_caches = [rule for rule in rule_sets.builtin_runtime
+                                                 if hasattr(rule, 'clear_cached_results')]
+        if (not fraud_detection_service.load_profile_snapshot()
+                and service_config.profile_cache_max_bytes is not None and get_transaction_store() is not None):
+            fraud_detection_service.swap_profiles(fraud_detection_service.profile_cache(
+                TransactionStoreProfileSource(get_transaction_store(), config.min_user_history)))
+        PROFILE_STORE_USERS.callback = lambda: {(): len(fraud_detection_service.user_profiles)}
+        PROFILE_STORE_BYTES.callback = lambda: {(): fraud_detection_service.user_profiles.nbytes()}
+        PROFILE_CACHE_USERS.callback = lambda: _profile_cache_stat("resident_users")
+        PROFILE_CACHE_BYTES.callback = lambda: _profile_cache_stat("resident_bytes")
     return fraud_detection_service
 
+def _profile_cache_stat(name: str) -> dict:
+    profiles = fraud_detection_service.user_profiles
+    return {(): profiles.stats()[name]} if isinstance(profiles, ProfileCache) else {}
+
+def get_report_jobs() -> ReportJobManager:
+    """Get the background report job manager."""
+    global report_jobs
+    if report_jobs is None:
+        report_jobs = ReportJobManager(get_fraud_detection_service(), workers=service_config.report_workers,
+                                       max_jobs=service_config.max_report_jobs)
+    return report_jobs
+
+def get_transaction_store() -> Optional[TransactionStore]:
+    """Get the transaction store, None unless ServiceConfig.transaction_store_url is set."""
+    global transaction_store
+    if transaction_store is None and service_config.transaction_store_url:
+        transaction_store = TransactionStore(service_config.transaction_store_url,
+                                             pool_size=service_config.transaction_store_pool_size)
+    return transaction_store
+
+def get_request_profiler() -> RequestProfiler:
+    """Get the per-request profiler."""
+    return request_profiler
+
 def get_runtime_rules() -> List[Rule]:
     """Get the runtime rules."""
-    return [
-        AmountDeviationRule(),
-        MerchantAnomalyRule(),
-        TimeAnomalyRule(),
-        UnusualMerchantActivityRule()
-    ]
+    return rule_sets.runtime
 
 def get_all_rules() -> List[Rule]:
     """Get all rules."""
-    return rules
+    return rule_sets.batch
+
+def get_rule_sets() -> RuleSetRegistry:
+    """Get the registry of the active rule set."""
+    return rule_sets
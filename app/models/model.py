@@ -1,4 +1,5 @@
-from pydantic import BaseModel
+from typing import Dict, List, Optional, Union
+from pydantic import BaseModel, TypeAdapter
 
 class Transaction(BaseModel):
     """
@@ -19,3 +20,69 @@ class FraudDetectionResult(BaseModel):
     """
     is_fraud: bool
     rule_stats: dict[str, int]
+
+
+class ReportJobStatus(BaseModel):
+    """
+    Represents the state of a background report job.
+    - status: "queued", "running", "completed" or "failed"
+    - stage: step of the analysis the job is in
+    - progress: fraction of the analysis done, from 0 to 1
+    - rule_stats: number of transactions flagged by each rule, once the rules have run
+    """
+    job_id: str
+    status: str
+    stage: str
+    progress: float
+    rule_stats: dict[str, int]
+    submitted_at: str
+    finished_at: Optional[str] = None
+    error: Optional[str] = None
+
+
+class RuleSpec(BaseModel):
+    """
+    Represents a rule defined declaratively instead of in code.
+    - name: unique name of the rule, used as its key in rule_stats
+    - label: name of the rule in reports, defaults to name
+    - condition: expression over transaction and profile fields that flags a transaction when true,
+      e.g. "merchant_count == 0 and amount > factor * amount_mean"
+    - params: constants the condition refers to by name
+    - reason: flag reason template, formatted with the transaction fields, defaults to label
+    """
+    name: str
+    label: Optional[str] = None
+    condition: str
+    params: Dict[str, Union[int, float, str, List[Union[int, float, str]]]] = {}
+    reason: Optional[str] = None
+
+
+class RuleSetSpec(BaseModel):
+    """
+    Represents a complete set of rules and thresholds to score with.
+    - thresholds: RuleConfig fields to override, the others keep their startup values
+    - builtin: class names of the built-in rules to keep, all of them if not given
+    - rules: declarative rules, applied after the built-in ones
+    """
+    thresholds: Dict[str, float] = {}
+    builtin: Optional[List[str]] = None
+    rules: List[RuleSpec] = []
+
+
+TransactionList = TypeAdapter(List[Transaction])
+
+
+def parse_transactions(body: bytes, content_type: str = "application/json") -> List[Transaction]:
+    """
+    Parse a batch of transactions, either a JSON array or NDJSON with one transaction per line.
+    Args:
+        body: raw request body
+        content_type: content type of the body
+    Returns:
+        List[Transaction]: transactions in input order
+    Raises:
+        pydantic.ValidationError: if an item is not a valid transaction
+    """
+    if "ndjson" in content_type:
+        return [Transaction.model_validate_json(line) for line in body.splitlines() if line.strip()]
+    return TransactionList.validate_json(body)
@@ -1,4 +1,4 @@
-from typing import Protocol, List
+from typing import Protocol, List, Optional
 import pandas as pd
 from app.models.model import Transaction, FraudDetectionResult
 
@@ -6,6 +6,28 @@ class Rule(Protocol):
     def apply(self, transactions: pd.DataFrame, user_profile: dict = None) -> int:
         pass
 
+class BatchRule(Rule, Protocol):
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        pass
+
+class ScalarRule(Rule, Protocol):
+    def evaluate(self, transaction: Transaction, profile) -> bool:
+        pass
+
+class RecordingRule(Rule, Protocol):
+    def record(self, transaction: Transaction) -> None:
+        pass
+
+class CachingRule(Rule, Protocol):
+    def cached_result(self, transaction: Transaction) -> Optional[FraudDetectionResult]:
+        pass
+
+    def cache_result(self, transaction: Transaction, result: FraudDetectionResult) -> None:
+        pass
+
 class FraudDetectionService(Protocol):
     def detect_fraud(self, transaction: Transaction, rules: List[Rule]) -> FraudDetectionResult:
         pass
+
+    def detect_fraud_batch(self, transactions: List[Transaction], rules: List[Rule]) -> List[FraudDetectionResult]:
+        pass
@@ -1,35 +1,154 @@
-from fastapi import APIRouter, Depends
-from app.models.model import Transaction
+import json
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import ValidationError
+from app.config import service_config
+from app.models.model import Transaction, FraudDetectionResult, ReportJobStatus, parse_transactions
 from app.protocol import FraudDetectionService, Rule
-from app.getters import get_runtime_rules, get_fraud_detection_service
-from typing import List
+from app.getters import (get_runtime_rules, get_fraud_detection_service, get_report_jobs, get_request_profiler,
+                         get_rule_sets, get_transaction_store)
+from app.sevices.jobs import ReportJobManager
+from app.sevices.metrics import FRAUD_CHECK_DURATION, RequestProfiler, registry
+from app.sevices.profile_cache import ProfileCache
+from app.sevices.rules.declarative import RuleSetRegistry, load_rule_set, parse_rule_set
+from app.sevices.store import TransactionStore
+from typing import List, Optional
 router = APIRouter()
 
+CSV_PATH = "./app/data/user_transactions.csv"
+OUTPUT_FILE = f"./app/data/output.{service_config.output_format}"
+REPORT_FILE = "./app/data/report.json"
+
 @router.get("/")
 async def test_route():
     return "Hello World"
 
-@router.post("/generate-report")
-async def generate_report(
-    fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service),
-    runtime_rules: List[Rule] = Depends(get_runtime_rules)
-):
-
-    csv_path = "./app/data/user_transactions.csv"
-    output_file = "./app/data/output.csv"
-    report_file = "./app/data/report.json"
-    fraud_detection_service.analyze_data(csv_path, output_file, report_file)
-    suspicious = fraud_detection_service.get_suspicious_transactions()
-    if len(suspicious) > 0:
-        print("\nSample of flagged transactions:")
-        print(suspicious[['userId', 'timestamp', 'merchantName', 'amount', 'flag_reasons']].head(10))
-    else:
-        print("No suspicious transactions detected.")
-    
-    return "Report generated successfully."
+@router.post("/generate-report", status_code=202, response_model=ReportJobStatus)
+async def generate_report(report_jobs: ReportJobManager = Depends(get_report_jobs),
+                          transaction_store: Optional[TransactionStore] = Depends(get_transaction_store)):
+    """Start a report job in the background and return its id straight away."""
+    return report_jobs.submit(transaction_store or CSV_PATH, OUTPUT_FILE, REPORT_FILE).to_status()
+
+@router.get("/generate-report/{job_id}", response_model=ReportJobStatus)
+async def report_status(job_id: str, report_jobs: ReportJobManager = Depends(get_report_jobs)):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report job {job_id}")
+    return job.to_status()
+
+@router.get("/generate-report/{job_id}/result")
+async def report_result(job_id: str, report_jobs: ReportJobManager = Depends(get_report_jobs)):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown report job {job_id}")
+    if job.status == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"Report job {job_id} is {job.status}")
+    return job.to_result()
+
+@router.post("/transactions")
+async def ingest_transactions(request: Request,
+                              transaction_store: Optional[TransactionStore] = Depends(get_transaction_store),
+                              fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service)):
+    """Add a JSON array or an NDJSON stream of transactions to the transaction store."""
+    if transaction_store is None:
+        raise HTTPException(status_code=404, detail="No transaction store configured")
+    try:
+        transactions = parse_transactions(await request.body(), request.headers.get("content-type", ""))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    ingested = transaction_store.ingest(transactions)
+    if isinstance(fraud_detection_service.user_profiles, ProfileCache):
+        # Cached profiles of these users are stale, they are reloaded with the new transactions.
+        fraud_detection_service.user_profiles.invalidate({transaction.user_id for transaction in transactions})
+    return {"ingested": ingested}
+
+@router.post("/profiles/reload")
+async def reload_profiles(fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service)):
+    """Swap in the latest profile snapshot without interrupting scoring."""
+    if not fraud_detection_service.load_profile_snapshot():
+        if not isinstance(fraud_detection_service.user_profiles, ProfileCache):
+            raise HTTPException(status_code=404, detail="No profile snapshot available")
+        # Cached users are reloaded from the transaction store as they are next seen.
+        fraud_detection_service.user_profiles.clear()
+        fraud_detection_service.clear_cached_results()
+    return {"users": len(fraud_detection_service.user_profiles)}
+
+@router.get("/profiles/cache")
+async def profile_cache_stats(fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service)):
+    """Hit rate and memory use of the profile cache."""
+    if not isinstance(fraud_detection_service.user_profiles, ProfileCache):
+        raise HTTPException(status_code=404, detail="The profile cache is not enabled")
+    return fraud_detection_service.user_profiles.stats()
+
+@router.get("/rules")
+async def active_rules(rule_sets: RuleSetRegistry = Depends(get_rule_sets)):
+    """The active thresholds, built-in rules and declarative rules."""
+    return rule_sets.describe()
+
+@router.post("/rules/reload")
+async def reload_rules(request: Request,
+                       rule_sets: RuleSetRegistry = Depends(get_rule_sets),
+                       fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service)):
+    """
+    Swap in a new rule set without interrupting scoring. The body is a JSON or YAML rule set;
+    without a body the rule set is read again from ServiceConfig.rule_set_path.
+    """
+    body = await request.body()
+    try:
+        if body.strip():
+            spec = parse_rule_set(body, request.headers.get("content-type", ""))
+        elif service_config.rule_set_path:
+            spec = load_rule_set(service_config.rule_set_path)
+        else:
+            raise HTTPException(status_code=400, detail="No rule set given and no rule_set_path configured")
+        rule_sets.reload(spec)
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ImportError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    fraud_detection_service.rules = rule_sets.batch
+    return rule_sets.describe()
 
 @router.post("/fraud-check")
 async def fraud_check(transaction: Transaction,
+                       request: Request,
                        fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service),
-                       runtime_rules: List[Rule] = Depends(get_runtime_rules)):
-    return fraud_detection_service.detect_fraud(transaction, runtime_rules)
+                       runtime_rules: List[Rule] = Depends(get_runtime_rules),
+                       profiler: RequestProfiler = Depends(get_request_profiler)):
+    """Score one transaction. Send the X-Profile header to run the request under the profiler."""
+    with FRAUD_CHECK_DURATION.labels("/fraud-check").time():
+        if profiler.wanted("x-profile" in request.headers):
+            return profiler.run(fraud_detection_service.detect_fraud, transaction, runtime_rules)
+        return fraud_detection_service.detect_fraud(transaction, runtime_rules)
+
+
+@router.post("/fraud-check/batch", response_model=List[FraudDetectionResult])
+async def fraud_check_batch(request: Request,
+                            fraud_detection_service: FraudDetectionService = Depends(get_fraud_detection_service),
+                            runtime_rules: List[Rule] = Depends(get_runtime_rules)):
+    """Score a JSON array or an NDJSON stream of transactions, one result per transaction in input order."""
+    try:
+        transactions = parse_transactions(await request.body(), request.headers.get("content-type", ""))
+    except ValidationError as e:
+        raise HTTPException(status_code=422, detail=json.loads(e.json()))
+    if len(transactions) > service_config.max_batch_size:
+        raise HTTPException(status_code=413,
+                            detail=f"Batch of {len(transactions)} transactions exceeds the limit of {service_config.max_batch_size}")
+    with FRAUD_CHECK_DURATION.labels("/fraud-check/batch").time():
+        return fraud_detection_service.detect_fraud_batch(transactions, runtime_rules)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/debug/profile", response_class=PlainTextResponse)
+async def request_profile(profiler: RequestProfiler = Depends(get_request_profiler)):
+    """Cumulative cProfile statistics of the profiled requests since the last call."""
+    return profiler.report()
@@ -0,0 +1,133 @@
+import glob
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:  # Optional, installed with the "columnar" extra.
+    pa = None
+    feather = None
+
+PARQUET_EXTENSIONS = ('.parquet', '.pq')
+ARROW_EXTENSIONS = ('.arrow', '.feather', '.ipc')
+
+
+def file_format(path: str) -> str:
+    """
+    Args:
+        path: file path
+    Returns:
+        str: "parquet", "arrow" or "csv", from the file extension
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in ARROW_EXTENSIONS:
+        return "arrow"
+    return "csv"
+
+
+def _require_pyarrow(what: str) -> None:
+    if pa is None:
+        raise ImportError(f"{what} needs pyarrow, install it with `poetry install --extras columnar`")
+
+
+def read_transactions(path: str, cache_dir: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read transactions from CSV, Parquet or Arrow IPC, with parsed timestamps.
+    Parquet and Arrow files carry typed columns and need no parsing. A CSV is parsed once and,
+    with a cache_dir, kept there as an Arrow IPC file keyed by the CSV's path, size and
+    modification time, which later reads of the unchanged file memory-map instead.
+    Args:
+        path: transactions file, the format is taken from its extension
+        cache_dir: directory for parsed CSV files, no caching if not given
+    Returns:
+        pd.DataFrame: the transactions, merchantName as plain strings
+    """
+    fmt = file_format(path)
+    if fmt == "parquet":
+        _require_pyarrow("Reading Parquet")
+        transactions = pd.read_parquet(path)
+    elif fmt == "arrow":
+        _require_pyarrow("Reading Arrow IPC")
+        transactions = feather.read_table(path, memory_map=True).to_pandas()
+    elif cache_dir is not None:
+        transactions = _read_cached_csv(path, cache_dir)
+    else:
+        transactions = _parse_csv(path)
+    if not pd.api.types.is_datetime64_any_dtype(transactions['timestamp']):
+        transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    # The rules group and compare merchant names as strings; categories are a storage format.
+    if isinstance(transactions['merchantName'].dtype, pd.CategoricalDtype):
+        transactions['merchantName'] = transactions['merchantName'].astype(object)
+    return transactions
+
+
+def _parse_csv(path: str) -> pd.DataFrame:
+    transactions = pd.read_csv(path)
+    transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    return transactions
+
+
+def _read_cached_csv(path: str, cache_dir: str) -> pd.DataFrame:
+    _require_pyarrow("The parsed input cache")
+    stat = os.stat(path)
+    prefix = os.path.join(cache_dir, hashlib.sha1(os.path.realpath(path).encode()).hexdigest())
+    cached = f"{prefix}-{stat.st_size}-{stat.st_mtime_ns}.arrow"
+    if os.path.exists(cached):
+        return feather.read_table(cached, memory_map=True).to_pandas()
+
+    transactions = _parse_csv(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    for stale in glob.glob(f"{glob.escape(prefix)}-*.arrow"):
+        os.remove(stale)
+    _write_atomically(_to_table(transactions), cached)
+    return transactions
+
+
+def _to_table(frame: pd.DataFrame) -> "pa.Table":
+    """Arrow table of a frame, with merchantName dictionary-encoded."""
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    if 'merchantName' in table.column_names:
+        i = table.column_names.index('merchantName')
+        table = table.set_column(i, 'merchantName', table.column(i).dictionary_encode())
+    return table
+
+
+def _write_atomically(table: "pa.Table", path: str) -> None:
+    # Uncompressed, so readers can memory-map the columns without decoding them.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        feather.write_feather(table, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def write_results(frame: pd.DataFrame, path: str) -> None:
+    """
+    Write result rows as CSV, Parquet or Arrow IPC, the format taken from the extension.
+    Columnar files keep the timestamp typed and merchantName dictionary-encoded; Arrow IPC
+    files are uncompressed so downstream tools can memory-map them.
+    Args:
+        frame: rows to write
+        path: destination
+    """
+    fmt = file_format(path)
+    if fmt == "csv":
+        frame.to_csv(path, index=False)
+        return
+    _require_pyarrow(f"Writing {fmt}")
+    table = _to_table(frame)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        _write_atomically(table, path)
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Dict, List, Optional
+
+from pydantic import ValidationError
+
+from app.models.model import Transaction
+from app.protocol import FraudDetectionService, Rule
+from app.sevices.metrics import FRAUD_CHECK_DURATION
+
+# Marks the end of the input in the line queue.
+_END = None
+
+
+class TransactionFeedProcessor:
+    """
+    Scores a continuous NDJSON feed of transactions in micro-batches.
+
+    A reader task puts raw lines on a bounded queue, so a slow scorer makes the reader wait
+    instead of buffering the whole feed. Lines are taken off the queue into a batch until it
+    holds max_batch_size transactions or max_batch_latency has passed since its first line,
+    whichever comes first: larger batches amortize the per-batch cost of detect_fraud_batch,
+    a shorter latency gets each result out sooner. Batches are parsed and scored one at a time
+    on a single scoring thread, which keeps the event loop free for reading and writing and
+    keeps the order of the velocity checks. Results go through a second bounded queue to a
+    writer task, one NDJSON line per input line, in input order. Invalid lines, and every line
+    of a batch that fails to score, get an error line instead of a result, and the feed goes on.
+    """
+
+    def __init__(self, service: FraudDetectionService, rules: List[Rule], max_batch_size: int = 500,
+                 max_batch_latency_ms: float = 50, queue_size: int = 10_000):
+        """
+        Args:
+            service: service the batches are scored with
+            rules: rules the batches are scored against
+            max_batch_size: most transactions scored in one detect_fraud_batch call
+            max_batch_latency_ms: longest a line waits for its batch to fill up
+            queue_size: most lines read ahead of the scorer
+        """
+        self.service = service
+        self.rules = rules
+        self.max_batch_size = max_batch_size
+        self.max_batch_latency = max_batch_latency_ms / 1000
+        self.queue_size = queue_size
+        # Shared by every feed of this processor, so batches from concurrent connections
+        # are never scored at the same time.
+        self.scorer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feed-scorer")
+        self.stats: Dict[str, int] = {"transactions": 0, "errors": 0, "flagged": 0, "batches": 0}
+
+    async def process(self, lines: AsyncIterator[bytes], write: Callable[[bytes], Awaitable[None]]) -> Dict[str, int]:
+        """
+        Score every line of a feed and write the results.
+        Args:
+            lines: NDJSON lines, one transaction each
+            write: coroutine function that writes a chunk of NDJSON results
+        Returns:
+            Dict[str, int]: transactions scored, invalid lines, flagged transactions and batches
+                of this feed
+        """
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        results: asyncio.Queue = asyncio.Queue(maxsize=max(1, self.queue_size // self.max_batch_size))
+        stats = {"transactions": 0, "errors": 0, "flagged": 0, "batches": 0}
+        loop = asyncio.get_running_loop()
+
+        async def read() -> None:
+            try:
+                async for line in lines:
+                    if line.strip():
+                        await pending.put(line)
+            finally:
+                await pending.put(_END)
+
+        async def score() -> None:
+            try:
+                async for batch in self._batches(pending):
+                    chunk, batch_stats = await loop.run_in_executor(self.scorer, self._score, batch)
+                    for key, value in batch_stats.items():
+                        stats[key] += value
+                        self.stats[key] += value
+                    await results.put(chunk)
+            finally:
+                await results.put(_END)
+
+        async def drain() -> None:
+            while (chunk := await results.get()) is not _END:
+                await write(chunk)
+
+        tasks = [asyncio.create_task(read()), asyncio.create_task(score()), asyncio.create_task(drain())]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return stats
+
+    async def _batches(self, pending: asyncio.Queue) -> AsyncIterator[List[bytes]]:
+        loop = asyncio.get_running_loop()
+        while (line := await pending.get()) is not _END:
+            batch = [line]
+            deadline = loop.time() + self.max_batch_latency
+            while len(batch) < self.max_batch_size:
+                if pending.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        line = await asyncio.wait_for(pending.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    line = pending.get_nowait()
+                if line is _END:
+                    yield batch
+                    return
+                batch.append(line)
+            yield batch
+
+    def _score(self, batch: List[bytes]):
+        """
+        Parse and score one batch, on the scoring thread.
+        Args:
+            batch: raw NDJSON lines
+        Returns:
+            the NDJSON results of the batch and its counts
+        """
+        transactions: List[Transaction] = []
+        parsed: List[Optional[Transaction]] = []
+        errors: Dict[int, str] = {}
+        for i, line in enumerate(batch):
+            try:
+                transaction = Transaction.model_validate_json(line)
+            except ValidationError as e:
+                errors[i] = json.dumps({"error": json.loads(e.json(include_url=False)),
+                                        "line": line.decode(errors="replace").strip()})
+                transaction = None
+            else:
+                transactions.append(transaction)
+            parsed.append(transaction)
+
+        try:
+            with FRAUD_CHECK_DURATION.labels("feed").time():
+                scored = iter(self.service.detect_fraud_batch(transactions, self.rules))
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            out = [errors[i] if transaction is None else json.dumps({"error": error, **transaction.model_dump()})
+                   for i, transaction in enumerate(parsed)]
+            chunk = ("\n".join(out) + "\n").encode()
+            return chunk, {"transactions": 0, "errors": len(batch), "flagged": 0, "batches": 1}
+        out = []
+        flagged = 0
+        for i, transaction in enumerate(parsed):
+            if transaction is None:
+                out.append(errors[i])
+                continue
+            result = next(scored)
+            flagged += result.is_fraud
+            out.append(json.dumps({**transaction.model_dump(), **result.model_dump()}))
+        chunk = ("\n".join(out) + "\n").encode()
+        return chunk, {"transactions": len(transactions), "errors": len(errors), "flagged": flagged, "batches": 1}
+
+    async def serve_unix(self, path: str) -> None:
+        """
+        Accept feeds on a Unix socket until cancelled. Each connection sends NDJSON transactions
+        and receives its results on the same connection.
+        Args:
+            path: socket path, replaced if it exists
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            async def write(chunk: bytes) -> None:
+                writer.write(chunk)
+                await writer.drain()
+
+            try:
+                await self.process(stream_lines(reader), write)
+            finally:
+                writer.close()
+
+        server = await asyncio.start_unix_server(handle, path=path, limit=1 << 20)
+        async with server:
+            await server.serve_forever()
+
+    def close(self) -> None:
+        self.scorer.shutdown(wait=True)
+
+
+async def stream_lines(reader: asyncio.StreamReader) -> AsyncIterator[bytes]:
+    """Lines of an asyncio stream, until EOF."""
+    while line := await reader.readline():
+        yield line
+
+
+async def file_lines(f: BinaryIO, chunk_bytes: int = 1 << 16) -> AsyncIterator[bytes]:
+    """
+    Lines of a file or of stdin.
+    Pipes, terminals and FIFOs are read by the event loop as lines arrive. Regular files cannot
+    be watched by the loop, so they are read in chunks on a thread.
+    Args:
+        f: binary file object
+        chunk_bytes: bytes read per call for regular files
+    """
+    loop = asyncio.get_running_loop()
+    if stat.S_ISREG(os.fstat(f.fileno()).st_mode):
+        while lines := await loop.run_in_executor(None, f.readlines, chunk_bytes):
+            for line in lines:
+                yield line
+        return
+    reader = asyncio.StreamReader(limit=1 << 20)
+    await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), f)
+    async for line in stream_lines(reader):
+        yield line
+
+
+def file_writer(f: BinaryIO) -> Callable[[bytes], Awaitable[None]]:
+    """
+    Args:
+        f: binary file object, e.g. sys.stdout.buffer
+    Returns:
+        coroutine function writing and flushing each chunk on a thread, so results show up
+        downstream batch by batch
+    """
+    def write_and_flush(chunk: bytes) -> None:
+        f.write(chunk)
+        f.flush()
+
+    async def write(chunk: bytes) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, write_and_flush, chunk)
+
+    return write
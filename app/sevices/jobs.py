@@ -0,0 +1,155 @@
+import copy
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Union
+
+from app.config import config, pinned_config, snapshot_config
+from app.models.model import ReportJobStatus
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.store import TransactionStore
+
+
+def job_path(path: str, job_id: str) -> str:
+    """
+    Args:
+        path: file name shared by all jobs, e.g. ./app/data/report.json
+        job_id: id of the job
+    Returns:
+        str: the file name of this job, e.g. ./app/data/report-<job_id>.json
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}-{job_id}{extension}"
+
+
+class ReportJob:
+    """State of one background report run, writing to its own output and report files."""
+
+    def __init__(self, source: Union[str, TransactionStore], output_file: str, report_file: str):
+        self.job_id = uuid.uuid4().hex
+        self.source = source
+        self.output_file = job_path(output_file, self.job_id)
+        self.report_file = job_path(report_file, self.job_id)
+        self.status = "queued"
+        self.stage = "queued"
+        self.progress = 0.0
+        self.rule_stats: Dict[str, int] = {}
+        self.report: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.submitted_at = datetime.now().isoformat()
+        self.finished_at: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def set_progress(self, stage: str, progress: float) -> None:
+        self.stage = stage
+        self.progress = progress
+
+    def to_status(self) -> ReportJobStatus:
+        return ReportJobStatus(
+            job_id=self.job_id,
+            status=self.status,
+            stage=self.stage,
+            progress=self.progress,
+            rule_stats=self.rule_stats,
+            submitted_at=self.submitted_at,
+            finished_at=self.finished_at,
+            error=self.error
+        )
+
+    def to_result(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "rule_stats": self.rule_stats,
+            "report": self.report,
+            "output_file": self.output_file,
+            "report_file": self.report_file,
+        }
+
+
+class ReportJobManager:
+    """
+    Runs report generation in background threads, off the event loop.
+    Every job analyzes the data with its own service instance, so the profiles being served are
+    never touched while a report runs. When a job completes, its profiles are swapped into the
+    serving service in one assignment. With incremental profiles the serving profiles already
+    hold every transaction scored since they were built, and usually the job's input too, so
+    they are kept as they are and the job does not write the profile snapshot. A job scores with the rules and thresholds active when it
+    starts: it pins a snapshot of the RuleConfig, so a rule set reload only applies to later
+    jobs. Each job writes to files named after its job id, so jobs
+    running at the same time do not overwrite each other's results; the files are removed when
+    the job is forgotten.
+    """
+
+    def __init__(self, service: RuleBasedFraudMonitoringService, workers: int = 1, max_jobs: int = 100):
+        """
+        Args:
+            service: service that scores requests and receives the profiles of completed jobs
+            workers: number of jobs that may run at the same time
+            max_jobs: number of jobs kept, the oldest finished jobs are forgotten first
+        """
+        self.service = service
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="report-job")
+        self.jobs: "OrderedDict[str, ReportJob]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def submit(self, source: Union[str, TransactionStore], output_file: str, report_file: str) -> ReportJob:
+        """
+        Queue a report run.
+        Args:
+            source: Path to the CSV file containing transaction data, or a TransactionStore
+            output_file: Path to the output file containing the results, the job id is added to the name
+            report_file: Path to the report file containing the summary report, the job id is added to the name
+        Returns:
+            ReportJob: the queued job
+        """
+        job = ReportJob(source, output_file, report_file)
+        with self.lock:
+            self.jobs[job.job_id] = job
+            self._forget_finished_jobs()
+        self.executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[ReportJob]:
+        return self.jobs.get(job_id)
+
+    def _forget_finished_jobs(self) -> None:
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished][:max(len(self.jobs) - self.max_jobs, 0)]:
+            job = self.jobs.pop(job_id)
+            for path in (job.output_file, job.report_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _run(self, job: ReportJob) -> None:
+        job.status = "running"
+        try:
+            rule_config = snapshot_config(config)
+            service_config = self.service.service_config
+            if service_config.incremental_profiles:
+                service_config = copy.copy(service_config)
+                service_config.profile_snapshot_path = None
+            service = RuleBasedFraudMonitoringService(config=rule_config, rules=self.service.rules,
+                                                      service_config=service_config)
+            service.progress_callback = job.set_progress
+            # Raises before writing anything if the source has no transactions.
+            with pinned_config(rule_config):
+                service.analyze_data(job.source, job.output_file, job.report_file)
+            job.rule_stats = service.rule_stats
+            with open(job.report_file) as f:
+                job.report = json.load(f)
+            # The snapshot the job just wrote is memory-mapped rather than kept on the heap.
+            if not service_config.incremental_profiles and not self.service.load_profile_snapshot():
+                self.service.swap_profiles(service.user_profiles)
+            job.status = "completed"
+        except Exception as e:
+            job.error = f"{e.__class__.__name__}: {e}"
+            job.status = "failed"
+        finally:
+            job.finished_at = datetime.now().isoformat()
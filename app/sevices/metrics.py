@@ -0,0 +1,270 @@
+import cProfile
+import io
+import pstats
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 1µs to ~16s in powers of two, covering a single scalar rule evaluation up to a full report stage.
+DEFAULT_BUCKETS = tuple(2.0 ** exponent for exponent in range(-20, 5))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _CounterChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self.lock:
+            self.value += amount
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class _Metric(ABC):
+    """A metric family with one child per combination of label values."""
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children: Dict[Tuple[str, ...], object] = {}
+        self.lock = threading.Lock()
+
+    def labels(self, *values: str):
+        """
+        Args:
+            values: one value per label name
+        Returns:
+            the child for these label values, worth keeping on hot paths
+        """
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self._child())
+        return child
+
+    @abstractmethod
+    def _child(self):
+        """
+        Returns:
+            a new child, holding the value of one combination of label values
+        """
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """
+        Returns:
+            List[str]: the exposition lines of every child
+        """
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in list(self.children.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in list(self.children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A gauge whose values are read from a callback when the metrics are rendered."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None):
+        """
+        Args:
+            callback: returns a value for each combination of label values
+        """
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def _child(self):
+        raise TypeError(f"{self.name} is read from its callback, it has no children to set")
+
+    def samples(self) -> List[str]:
+        if self.callback is None:
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(value)}"
+                for values, value in self.callback().items()]
+
+
+class MetricsRegistry:
+    """Metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class RequestProfiler:
+    """
+    Runs a share of requests, or requests that ask for it, under cProfile and accumulates their
+    statistics until they are read.
+    """
+
+    def __init__(self, sample_rate: float = 0.0):
+        """
+        Args:
+            sample_rate: fraction of requests profiled without asking
+        """
+        self.sample_rate = sample_rate
+        self.stats: Optional[pstats.Stats] = None
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def wanted(self, requested: bool = False) -> bool:
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def run(self, function: Callable, *args):
+        """Call function(*args) under cProfile and keep its statistics."""
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args)
+        finally:
+            with self.lock:
+                self.requests += 1
+                if self.stats is None:
+                    self.stats = pstats.Stats(profile)
+                else:
+                    self.stats.add(profile)
+
+    def report(self, limit: int = 40, reset: bool = True) -> str:
+        """
+        Args:
+            limit: number of functions listed
+            reset: whether to start accumulating afresh
+        Returns:
+            str: functions with the highest cumulative time over the profiled requests
+        """
+        with self.lock:
+            stats, requests = self.stats, self.requests
+            if reset:
+                self.stats, self.requests = None, 0
+        if stats is None:
+            return "No profiled requests\n"
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(limit)
+        return f"{requests} profiled requests\n{out.getvalue()}"
+
+
+registry = MetricsRegistry()
+
+RULE_DURATION = registry.register(Histogram(
+    "fraud_rule_duration_seconds", "Time spent applying a rule, per call.", ("rule", "path")))
+RULE_FLAGS = registry.register(Counter(
+    "fraud_rule_flags_total", "Transactions flagged by a rule.", ("rule", "path")))
+STAGE_DURATION = registry.register(Histogram(
+    "fraud_analysis_stage_duration_seconds", "Time spent in each stage of analyze_data.", ("stage",)))
+FRAUD_CHECK_DURATION = registry.register(Histogram(
+    "fraud_check_duration_seconds", "Time spent scoring fraud-check requests.", ("endpoint",)))
+PROFILE_STORE_USERS = registry.register(Gauge(
+    "fraud_profile_store_users", "Users in the profile store."))
+PROFILE_STORE_BYTES = registry.register(Gauge(
+    "fraud_profile_store_bytes", "Bytes held by the profile store arrays."))
+RECENT_ACTIVITY_USERS = registry.register(Gauge(
+    "fraud_recent_activity_users", "Users tracked for online velocity checks."))
+RECENT_ACTIVITY_BYTES = registry.register(Gauge(
+    "fraud_recent_activity_bytes", "Bytes held by the online velocity buffers."))
+PROFILE_CACHE_REQUESTS = registry.register(Counter(
+    "fraud_profile_cache_requests_total", "Profile cache lookups, by hit or miss.", ("result",)))
+PROFILE_CACHE_EVICTIONS = registry.register(Counter(
+    "fraud_profile_cache_evictions_total", "Users evicted from the profile cache."))
+PROFILE_CACHE_USERS = registry.register(Gauge(
+    "fraud_profile_cache_resident_users", "Users resident in the profile cache."))
+PROFILE_CACHE_BYTES = registry.register(Gauge(
+    "fraud_profile_cache_resident_bytes", "Estimated bytes held by the resident profiles."))
+REPLAY_INDEX_ENTRIES = registry.register(Gauge(
+    "fraud_replay_index_entries", "Transaction fingerprints kept for online replay detection."))
+REPLAY_CACHE_HITS = registry.register(Counter(
+    "fraud_replay_cache_hits_total", "Resubmitted transactions answered with a cached result."))
@@ -0,0 +1,172 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import RuleConfig, active_config
+from app.sevices.profiles import ProfileStore
+
+# (shared memory name, dtype, length) of a column shared between processes.
+SharedColumn = Tuple[str, str, int]
+
+
+def _share(array: np.ndarray) -> Tuple[shared_memory.SharedMemory, SharedColumn]:
+    """Copy an array into a new shared memory block."""
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+    return block, (block.name, array.dtype.str, len(array))
+
+
+def _attach(column: SharedColumn) -> Tuple[shared_memory.SharedMemory, np.ndarray]:
+    """Map a shared column into this process without copying it."""
+    name, dtype, length = column
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray((length,), dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _config_state(rule_config: RuleConfig) -> Dict[str, Any]:
+    return {name: getattr(rule_config, name) for name in dir(RuleConfig) if not name.startswith('_')}
+
+
+def _init_worker(rule_config: Dict[str, Any]) -> None:
+    """Give the worker the parent's active config as its module-level config, which the rules read there."""
+    from app.config import config
+    for name, value in rule_config.items():
+        setattr(config, name, value)
+
+
+def _analyze_shard(columns: Dict[str, SharedColumn], start: int, stop: int, merchant_names: np.ndarray,
+                   rules: list, service_rule_config: Dict[str, Any]
+                   ) -> Tuple[Dict[str, int], Dict[str, Any], ProfileStore]:
+    """
+    Profile and score rows start:stop of the shared columns in a worker process.
+    Returns:
+        Tuple: rule stats, the flags and detail columns the rules produced (numeric columns
+            in new shared memory blocks owned by the caller from here on), and the shard's profiles
+    """
+    from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+    from app.config import ServiceConfig
+
+    blocks = {}
+    arrays = {}
+    for key, column in columns.items():
+        blocks[key], arrays[key] = _attach(column)
+    try:
+        shard = pd.DataFrame({
+            'userId': arrays['userId'][start:stop].copy(),
+            'timestamp': arrays['timestamp'][start:stop].view('datetime64[ns]').copy(),
+            'merchantName': merchant_names[arrays['merchantCode'][start:stop]],
+            'amount': arrays['amount'][start:stop].copy(),
+        })
+    finally:
+        arrays.clear()
+        for block in blocks.values():
+            block.close()
+
+    rule_config = RuleConfig()
+    for name, value in service_rule_config.items():
+        setattr(rule_config, name, value)
+    service = RuleBasedFraudMonitoringService(config=rule_config, rules=rules, service_config=ServiceConfig())
+    service.set_transactions(shard)
+    rule_stats = service.run_all_rules()
+
+    results = {}
+    positions = service.transactions.index.to_numpy()
+    for name in service.transactions.columns:
+        if name in service.input_columns:
+            continue
+        values = np.empty(len(shard), dtype=service.transactions[name].dtype)
+        values[positions] = service.transactions[name].to_numpy()
+        if values.dtype.hasobject:
+            results[name] = values
+            continue
+        block, results[name] = _share(values)
+        block.close()
+    service.user_profiles.compact()
+    return rule_stats, results, service.user_profiles
+
+
+def shard_bounds(user_ids: np.ndarray, shards: int) -> List[Tuple[int, int]]:
+    """
+    Split rows sorted by userId into contiguous ranges of roughly equal size,
+    cutting only between users.
+    Args:
+        user_ids: user id of each row, sorted
+        shards: number of ranges wanted
+    Returns:
+        List[Tuple[int, int]]: non-empty (start, stop) row ranges in order
+    """
+    n = len(user_ids)
+    if n == 0:
+        return []
+    user_starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+    targets = np.linspace(0, n, shards + 1)[1:-1]
+    nearest = np.minimum(np.searchsorted(user_starts, targets), len(user_starts) - 1)
+    cuts = np.unique(np.r_[0, user_starts[nearest], n])
+    return [(int(start), int(stop)) for start, stop in zip(cuts[:-1], cuts[1:]) if stop > start]
+
+
+def analyze_parallel(transactions: pd.DataFrame, rules: list, rule_config: RuleConfig,
+                     workers: int) -> Tuple[Dict[str, int], Dict[str, np.ndarray], ProfileStore]:
+    """
+    Profile and score transactions sorted by (userId, timestamp) in a pool of worker processes.
+    The rows are placed in shared memory once and every worker reads its own user range from
+    there, so no DataFrame is pickled. Rule stats are summed and per-row results are written
+    back by position, so the result does not depend on which worker finishes first.
+    Args:
+        transactions: pd.DataFrame sorted by userId and timestamp
+        rules: rules to apply
+        rule_config: rule config of the calling service
+        workers: number of worker processes
+    Returns:
+        Tuple: rule stats, the flags and detail columns in row order, and the profiles of all users
+    """
+    merchant_codes, merchant_names = pd.factorize(transactions['merchantName'])
+    shared = {
+        'userId': transactions['userId'].to_numpy(np.int64),
+        'timestamp': transactions['timestamp'].to_numpy().astype('datetime64[ns]').view(np.int64),
+        'merchantCode': merchant_codes.astype(np.int32),
+        'amount': transactions['amount'].to_numpy(np.float64),
+    }
+    blocks = []
+    columns = {}
+    try:
+        for key, array in shared.items():
+            block, columns[key] = _share(array)
+            blocks.append(block)
+
+        bounds = shard_bounds(shared['userId'], workers * 4)
+        names = np.asarray(merchant_names, dtype=object)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(_config_state(active_config()),)) as pool:
+            futures = [pool.submit(_analyze_shard, columns, start, stop, names, rules, _config_state(rule_config))
+                       for start, stop in bounds]
+            shard_results = [future.result() for future in futures]
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    rule_stats: Dict[str, int] = {}
+    results: Dict[str, np.ndarray] = {}
+    profiles = ProfileStore.empty(rule_config.min_user_history)
+    for (start, stop), (stats, shard_columns, shard_profiles) in zip(bounds, shard_results):
+        for name, count in stats.items():
+            rule_stats[name] = rule_stats.get(name, 0) + count
+        for name, column in shard_columns.items():
+            block = None
+            values = column
+            if not isinstance(column, np.ndarray):
+                block, values = _attach(column)
+            if name not in results:
+                results[name] = np.zeros(len(transactions), dtype=values.dtype)
+            results[name][start:stop] = values
+            del values
+            if block is not None:
+                block.close()
+                block.unlink()
+        profiles.merge(shard_profiles)
+    return rule_stats, results, profiles
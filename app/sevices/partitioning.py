@@ -0,0 +1,74 @@
+import os
+import pickle
+from typing import Iterator, List
+
+import numpy as np
+import pandas as pd
+
+# Compact dtypes for streamed input; timestamps are parsed per chunk before spilling.
+# Amounts stay float64: float32 keeps only ~7 significant digits and would alter amounts
+# in the output and the rule thresholds.
+STREAM_DTYPES = {'userId': np.int32, 'merchantName': 'category', 'amount': np.float64}
+
+
+def partition_of(user_ids: np.ndarray, n_partitions: int) -> np.ndarray:
+    """
+    Args:
+        user_ids: array of user ids
+        n_partitions: number of partitions
+    Returns:
+        np.ndarray: partition number of each user id
+    """
+    return (pd.util.hash_array(np.asarray(user_ids, dtype=np.int64)) % np.uint64(n_partitions)).astype(np.int64)
+
+
+def partition_csv(csv_path: str, spill_dir: str, n_partitions: int, chunksize: int) -> List[str]:
+    """
+    Read a transaction CSV in chunks and spill its rows into one file per userId hash partition,
+    so every user's transactions end up in exactly one partition.
+    Args:
+        csv_path: Path to the CSV file containing transaction data
+        spill_dir: directory the partition files are written to
+        n_partitions: number of partitions
+        chunksize: number of rows read per chunk
+    Returns:
+        List[str]: paths of the partition files that received rows
+    """
+    paths = [os.path.join(spill_dir, f"partition-{i:04d}.pkl") for i in range(n_partitions)]
+    used = set()
+    files = [open(path, 'wb') for path in paths]
+    try:
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize, dtype=STREAM_DTYPES):
+            chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+            partitions = partition_of(chunk['userId'].to_numpy(), n_partitions)
+            for i, rows in chunk.groupby(partitions, sort=False):
+                pickle.dump(rows, files[i], protocol=pickle.HIGHEST_PROTOCOL)
+                used.add(i)
+    finally:
+        for f in files:
+            f.close()
+    for i, path in enumerate(paths):
+        if i not in used:
+            os.remove(path)
+    return [path for i, path in enumerate(paths) if i in used]
+
+
+def _read_pieces(path: str) -> Iterator[pd.DataFrame]:
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def read_partition(path: str) -> pd.DataFrame:
+    """
+    Args:
+        path: path of a partition file written by partition_csv
+    Returns:
+        pd.DataFrame: all rows of the partition, in input order
+    """
+    rows = pd.concat(_read_pieces(path), ignore_index=True)
+    rows['merchantName'] = rows['merchantName'].astype('category')
+    return rows
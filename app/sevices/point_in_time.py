@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from app.sevices.profiles import _merchant_std, _user_std
+
+
+def _run_starts(keys: list) -> np.ndarray:
+    """
+    Position of the first row of each row's run of equal keys, for rows sorted by those keys.
+    Args:
+        keys: arrays of the same length, compared element-wise
+    Returns:
+        np.ndarray: for every row, the position where its run starts
+    """
+    n = len(keys[0])
+    starts = np.zeros(n, dtype=bool)
+    if n:
+        starts[0] = True
+        for key in keys:
+            starts[1:] |= key[1:] != key[:-1]
+    return np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+
+
+def _earlier_sums(values: np.ndarray, groups: np.ndarray, ties: np.ndarray) -> np.ndarray:
+    """
+    Sums of the values of the strictly earlier rows of each row's group.
+    Args:
+        values: (n, k) array of rows sorted by group and time
+        groups: run starts of the groups, from _run_starts
+        ties: run starts of the rows sharing the group and the timestamp, which all get the
+            sums before the first of them so they never see each other
+    Returns:
+        np.ndarray: (n, k) array of sums
+    """
+    before = np.cumsum(values, axis=0) - values
+    return (before - before[groups])[ties]
+
+
+def point_in_time_features(transactions: pd.DataFrame, min_history: int = 1) -> pd.DataFrame:
+    """
+    Profile columns for every transaction computed from the user's strictly earlier transactions only.
+
+    Where ProfileTable.join scores every transaction against a profile of the user's whole
+    history, future transactions included, this gives each transaction the profile the user
+    had just before it: the profile /fraud-check would have scored it against at the time.
+    Counts, sums and sums of squares of the amounts, hour first-seen bits and per-merchant
+    counts and sums are accumulated within each user (and each user and merchant) with
+    cumulative sums over rows sorted by time, so the cost is one sort plus a few linear passes.
+    Transactions with the same user and timestamp do not see each other.
+
+    Args:
+        transactions: pd.DataFrame with parsed timestamps
+        min_history: minimum number of earlier transactions for a row to have a profile
+    Returns:
+        pd.DataFrame: the same columns as ProfileTable.join, aligned with transactions
+    """
+    n = len(transactions)
+    users = transactions['userId'].to_numpy()
+    ts = transactions['timestamp'].to_numpy().astype('datetime64[ns]').view('int64')
+    amounts = transactions['amount'].to_numpy(np.float64)
+    hours = transactions['timestamp'].dt.hour.to_numpy()
+    merchants = pd.factorize(transactions['merchantName'])[0]
+
+    # Per user: rows in (userId, timestamp) order.
+    order = np.lexsort((ts, users))
+    u, t, a, h = users[order], ts[order], amounts[order], hours[order]
+    groups, ties = _run_starts([u]), _run_starts([u, t])
+    # Amounts are shifted by the user's first amount, which keeps the sums of squares small.
+    shifted = a - a[groups]
+    # The bit of an hour is set on the user's first transaction in that hour.
+    hour_order = np.lexsort((t, h, u))
+    first_in_hour = hour_order[_run_starts([u[hour_order], h[hour_order]]) == np.arange(n)]
+    first_hour = np.zeros(n, dtype=np.int64)
+    first_hour[first_in_hour] = np.left_shift(1, h[first_in_hour].astype(np.int64))
+    # Every hour bit is set once per user, so the running OR of the bits is their running sum.
+    sums = _earlier_sums(np.column_stack([np.ones(n), shifted, shifted ** 2, first_hour]), groups, ties)
+    count, total, total_sq = sums[:, 0].astype(np.int64), sums[:, 1], sums[:, 2]
+    hour_mask = sums[:, 3].astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        m2 = np.maximum(total_sq - total * mean, 0)
+        mean = mean + a[groups]
+    std = _user_std(count, mean, m2)
+    has_profile = count >= min_history
+
+    # Per user and merchant: rows in (userId, merchant, timestamp) order.
+    pair_order = np.lexsort((t, merchants[order], u))
+    pu, pm, pt, pa = u[pair_order], merchants[order][pair_order], t[pair_order], a[pair_order]
+    pair_groups = _run_starts([pu, pm])
+    pair_shifted = pa - pa[pair_groups]
+    pair_sums = _earlier_sums(np.column_stack([np.ones(n), pair_shifted, pair_shifted ** 2]),
+                              pair_groups, _run_starts([pu, pm, pt]))
+    merchant_count = np.empty(n, dtype=np.int64)
+    merchant_count[pair_order] = pair_sums[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pair_mean = pair_sums[:, 1] / pair_sums[:, 0]
+        pair_m2 = np.maximum(pair_sums[:, 2] - pair_sums[:, 1] * pair_mean, 0)
+    merchant_mean, merchant_m2 = np.empty(n), np.empty(n)
+    merchant_mean[pair_order] = pair_mean + pa[pair_groups]
+    merchant_m2[pair_order] = pair_m2
+    merchant_std = _merchant_std(merchant_count, merchant_m2)
+
+    # Rows without a profile look like users ProfileTable.join does not know.
+    columns = {
+        'amount_mean': np.where(has_profile, mean, np.nan),
+        'amount_std': np.where(has_profile, std, np.nan),
+        'hour_mask': np.where(has_profile, hour_mask, 0),
+        'transaction_count': np.where(has_profile, count, np.nan),
+        'has_profile': has_profile,
+        'merchant_count': np.where(has_profile, merchant_count, 0),
+        'merchant_amount_mean': np.where(has_profile & (merchant_count > 0), merchant_mean, np.nan),
+        'merchant_amount_std': np.where(has_profile, merchant_std, np.nan),
+    }
+    features = pd.DataFrame(index=transactions.index)
+    for name, sorted_values in columns.items():
+        values = np.empty_like(sorted_values)
+        values[order] = sorted_values
+        features[name] = values
+    return features
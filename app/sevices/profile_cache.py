@@ -0,0 +1,338 @@
+import sys
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.sevices.metrics import PROFILE_CACHE_EVICTIONS, PROFILE_CACHE_REQUESTS
+from app.sevices.profiles import ProfileStore
+from app.sevices.store import TransactionStore
+
+# Rough size of a resident user without merchants, and of a cached "no profile" answer.
+_ENTRY_BYTES = 400
+_MISSING_BYTES = 100
+
+
+class MerchantSketch:
+    """
+    Count-min sketch of one user's merchant counts.
+    A count is never underestimated; hash collisions can only make it larger.
+    """
+    __slots__ = ('counts',)
+
+    def __init__(self, width: int, depth: int):
+        self.counts = np.zeros((depth, width), dtype=np.uint32)
+
+    def _columns(self, merchant: str) -> List[int]:
+        width = self.counts.shape[1]
+        return [hash((row, merchant)) % width for row in range(self.counts.shape[0])]
+
+    def add(self, merchant: str, count: int) -> None:
+        self.counts[np.arange(self.counts.shape[0]), self._columns(merchant)] += count
+
+    def count(self, merchant: str) -> int:
+        return int(self.counts[np.arange(self.counts.shape[0]), self._columns(merchant)].min())
+
+    def nbytes(self) -> int:
+        return self.counts.nbytes + sys.getsizeof(self.counts)
+
+
+class CachedProfile:
+    """
+    Self-contained copy of one user's profile, with the attributes UserProfile has for the
+    scalar rule path. In compact mode only the top_merchants most used merchants keep exact
+    statistics; the counts of the others go into a MerchantSketch and their amount mean and
+    std are dropped, so UnusualMerchantActivityRule does not fire on them.
+    """
+    __slots__ = ('transaction_count', 'amount_mean', 'amount_std', 'hour_mask', 'merchants', 'sketch', 'nbytes')
+
+    def __init__(self, transaction_count: int, amount_mean: float, amount_std: float, hour_mask: int,
+                 merchants: Dict[str, Tuple[int, float, float]], sketch: Optional[MerchantSketch] = None):
+        self.transaction_count = transaction_count
+        self.amount_mean = amount_mean
+        self.amount_std = amount_std
+        self.hour_mask = hour_mask
+        self.merchants = merchants
+        self.sketch = sketch
+        self.nbytes = (_ENTRY_BYTES + sys.getsizeof(merchants)
+                       + sum(sys.getsizeof(stats) + sum(map(sys.getsizeof, stats)) for stats in merchants.values())
+                       + (sketch.nbytes() if sketch is not None else 0))
+
+    @classmethod
+    def from_store(cls, store: ProfileStore, i: int, top_merchants: Optional[int] = None,
+                   sketch_width: int = 64, sketch_depth: int = 2) -> "CachedProfile":
+        """
+        Args:
+            store: ProfileStore holding the user
+            i: dense index of the user in store
+            top_merchants: merchants kept exactly, all of them if not given
+            sketch_width, sketch_depth: shape of the sketch the other merchants are counted in
+        Returns:
+            CachedProfile: CachedProfile
+        """
+        merchants = store.merchants(i)
+        sketch = None
+        if top_merchants is not None and len(merchants) > top_merchants:
+            # Most used first, ties by name, so the same merchants are kept whatever the source.
+            merchants.sort(key=lambda stats: (-stats[1], stats[0]))
+            sketch = MerchantSketch(sketch_width, sketch_depth)
+            for name, count, _, _ in merchants[top_merchants:]:
+                sketch.add(name, count)
+            merchants = merchants[:top_merchants]
+        return cls(
+            transaction_count=int(store.transaction_count[i]),
+            amount_mean=float(store.amount_mean[i]),
+            amount_std=float(store.amount_std[i]),
+            hour_mask=int(store.hour_mask[i]),
+            merchants={name: (count, mean, std) for name, count, mean, std in merchants},
+            sketch=sketch,
+        )
+
+    def merchant(self, merchant: str) -> Optional[Tuple[int, float, float]]:
+        """
+        Args:
+            merchant: merchant name
+        Returns:
+            Optional[Tuple[int, float, float]]: count, amount mean and amount std at the merchant,
+                with an estimated count and NaN mean and std for merchants in the sketch
+        """
+        stats = self.merchants.get(merchant)
+        if stats is not None or self.sketch is None:
+            return stats
+        count = self.sketch.count(merchant)
+        return (count, np.nan, np.nan) if count else None
+
+
+class ProfileSource(ABC):
+    """Persisted profiles the cache reloads users from."""
+
+    @abstractmethod
+    def load(self, user_ids: Sequence[int]) -> ProfileStore:
+        """
+        Args:
+            user_ids: users to load
+        Returns:
+            ProfileStore: a store holding at least the requested users that have a profile
+        """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """
+        Returns:
+            int: number of users with a visible profile, read without changing the source
+        """
+
+
+class SnapshotProfileSource(ProfileSource):
+    """
+    Profiles in a ProfileStore, typically memory-mapped from a snapshot, whose pages the
+    operating system reads in when a user is loaded and may drop again under memory pressure.
+    """
+
+    def __init__(self, store: ProfileStore):
+        self.store = store
+
+    def load(self, user_ids: Sequence[int]) -> ProfileStore:
+        return self.store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+
+class TransactionStoreProfileSource(ProfileSource):
+    """Profiles built from the aggregate tables of a TransactionStore, only for the requested users."""
+
+    def __init__(self, store: TransactionStore, min_history: int = 1):
+        self.store = store
+        self.min_history = min_history
+
+    def load(self, user_ids: Sequence[int]) -> ProfileStore:
+        return self.store.load_profiles(self.min_history, user_ids=user_ids)
+
+    def __len__(self) -> int:
+        # Read-only, so users ingested since the last refresh are not counted yet.
+        return self.store.profile_count(self.min_history, refresh=False)
+
+
+class ProfileCache:
+    """
+    Memory-bounded cache of user profiles in front of a ProfileSource, used in place of a
+    ProfileStore for scoring.
+
+    Resident users are kept in LRU order and the least recently used are evicted once their
+    estimated size exceeds max_bytes; a miss reloads the user from the source. Users without a
+    profile are cached too, so unknown users do not hit the source on every request. The cache
+    only serves reads: profiles change by loading a new source, or by invalidating the users
+    whose transactions changed in the source.
+    """
+
+    def __init__(self, source: ProfileSource, max_bytes: int, top_merchants: Optional[int] = None,
+                 sketch_width: int = 64, sketch_depth: int = 2):
+        """
+        Args:
+            source: where missed users are loaded from
+            max_bytes: memory budget of the resident profiles
+            top_merchants: keep only this many merchants per user exactly and count the rest in a
+                count-min sketch, all merchants are kept exactly if not given
+            sketch_width, sketch_depth: shape of each user's sketch
+        """
+        self.source = source
+        self.max_bytes = max_bytes
+        self.top_merchants = top_merchants
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.entries: "OrderedDict[int, Optional[CachedProfile]]" = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self._hit_counter = PROFILE_CACHE_REQUESTS.labels("hit")
+        self._miss_counter = PROFILE_CACHE_REQUESTS.labels("miss")
+        self._eviction_counter = PROFILE_CACHE_EVICTIONS.labels()
+
+    def profile(self, userId) -> Optional[CachedProfile]:
+        """
+        Args:
+            userId: id of the user
+        Returns:
+            Optional[CachedProfile]: the user's profile, None if the user has no visible profile
+        """
+        return self.profiles([int(userId)])[int(userId)]
+
+    def profiles(self, user_ids: Iterable[int]) -> Dict[int, Optional[CachedProfile]]:
+        """
+        Look up several users, loading all the missed ones from the source at once.
+        Args:
+            user_ids: ids of the users
+        Returns:
+            Dict[int, Optional[CachedProfile]]: profile of each user, None for users without one
+        """
+        found: Dict[int, Optional[CachedProfile]] = {}
+        missed: List[int] = []
+        with self.lock:
+            for user_id in user_ids:
+                if user_id in found:
+                    continue
+                if user_id in self.entries:
+                    self.entries.move_to_end(user_id)
+                    found[user_id] = self.entries[user_id]
+                    self.hits += 1
+                    self._hit_counter.inc()
+                else:
+                    found[user_id] = None
+                    missed.append(user_id)
+        if not missed:
+            return found
+
+        store = self.source.load(missed)
+        loaded = {}
+        for user_id in missed:
+            profile = store.profile(user_id)
+            loaded[user_id] = None if profile is None else CachedProfile.from_store(
+                store, profile.index, self.top_merchants, self.sketch_width, self.sketch_depth)
+        with self.lock:
+            self.misses += len(missed)
+            self._miss_counter.inc(len(missed))
+            for user_id, entry in loaded.items():
+                if user_id not in self.entries:
+                    self.entries[user_id] = entry
+                    self.resident_bytes += _MISSING_BYTES if entry is None else entry.nbytes
+            self._evict()
+        found.update(loaded)
+        return found
+
+    def _evict(self) -> None:
+        while self.resident_bytes > self.max_bytes and len(self.entries) > 1:
+            _, entry = self.entries.popitem(last=False)
+            self.resident_bytes -= _MISSING_BYTES if entry is None else entry.nbytes
+            self.evictions += 1
+            self._eviction_counter.inc()
+
+    def join(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Gather the profile columns of a batch of transactions from the cached profiles.
+        Args:
+            transactions: pd.DataFrame
+        Returns:
+            pd.DataFrame: the same columns as ProfileTable.join, aligned with transactions
+        """
+        user_ids = [int(user_id) for user_id in transactions['userId']]
+        profiles = self.profiles(user_ids)
+        rows = [profiles[user_id] for user_id in user_ids]
+        stats = [None if profile is None else profile.merchant(merchant)
+                 for profile, merchant in zip(rows, transactions['merchantName'])]
+        return pd.DataFrame({
+            'amount_mean': np.array([np.nan if p is None else p.amount_mean for p in rows], dtype=np.float64),
+            'amount_std': np.array([np.nan if p is None else p.amount_std for p in rows], dtype=np.float64),
+            'hour_mask': np.array([0 if p is None else p.hour_mask for p in rows], dtype=np.int64),
+            'transaction_count': np.array([0 if p is None else p.transaction_count for p in rows], dtype=np.int64),
+            'has_profile': np.array([p is not None for p in rows], dtype=bool),
+            'merchant_count': np.array([0 if stat is None else stat[0] for stat in stats], dtype=np.int64),
+            'merchant_amount_mean': np.array([np.nan if stat is None else stat[1] for stat in stats], dtype=np.float64),
+            'merchant_amount_std': np.array([np.nan if stat is None else stat[2] for stat in stats], dtype=np.float64),
+        }, index=transactions.index)
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        """
+        Drop users from the cache, so they are reloaded from the source when they are next seen.
+        Args:
+            user_ids: ids of the users whose profiles changed in the source
+        """
+        with self.lock:
+            for user_id in user_ids:
+                if int(user_id) in self.entries:
+                    entry = self.entries.pop(int(user_id))
+                    self.resident_bytes -= _MISSING_BYTES if entry is None else entry.nbytes
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.resident_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns:
+            Dict[str, float]: resident users and bytes, hits, misses, hit rate and evictions
+        """
+        requests = self.hits + self.misses
+        return {
+            "resident_users": len(self.entries),
+            "resident_bytes": self.resident_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def nbytes(self) -> int:
+        return self.resident_bytes
+
+    def __getitem__(self, userId) -> dict:
+        """
+        Profile dict of a user, in the shape ProfileStore returns for rules that read the profiles
+        by userId. The dict is built from the source and not cached, scoring goes through
+        profile() and join().
+        """
+        if userId not in self:
+            raise KeyError(userId)
+        return self.source.load([int(userId)])[int(userId)]
+
+    def get(self, userId, default=None):
+        try:
+            return self[userId]
+        except KeyError:
+            return default
+
+    def __contains__(self, userId) -> bool:
+        try:
+            return self.profile(userId) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __len__(self) -> int:
+        return len(self.source)
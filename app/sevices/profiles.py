@@ -0,0 +1,722 @@
+import numpy as np
+import pandas as pd
+from collections.abc import Mapping
+from bisect import bisect_left
+from typing import Iterator, List, Optional, Tuple
+
+
+class ProfileTable:
+    """
+    Columnar form of the user profiles used by the batch execution path of the rules.
+
+    users is indexed by userId with one row per profiled user, merchants has one row
+    per (userId, merchantName) pair the user has transacted with.
+    """
+
+    USER_COLUMNS = ['amount_mean', 'amount_std', 'hour_mask', 'transaction_count']
+    MERCHANT_COLUMNS = ['merchant_count', 'merchant_amount_mean', 'merchant_amount_std']
+
+    def __init__(self, users: pd.DataFrame, merchants: pd.DataFrame):
+        self.users = users
+        self.merchants = merchants
+
+    @classmethod
+    def from_profiles(cls, user_profiles: dict, user_ids: Optional[np.ndarray] = None) -> "ProfileTable":
+        """
+        Build the table from profile dicts as produced by build_user_profiles.
+        Args:
+            user_profiles: dict
+            user_ids: only include these users, e.g. the users of the transactions to join
+        Returns:
+            ProfileTable: ProfileTable
+        """
+        if isinstance(user_profiles, ProfileStore):
+            return user_profiles.to_table(user_ids)
+        if user_ids is not None:
+            user_profiles = {userId: user_profiles[userId] for userId in user_ids if userId in user_profiles}
+        user_ids = list(user_profiles.keys())
+        profiles = list(user_profiles.values())
+        users = pd.DataFrame({
+            'amount_mean': np.array([p['amount_mean'] for p in profiles], dtype=np.float64),
+            'amount_std': np.array([p['amount_std'] for p in profiles], dtype=np.float64),
+            'hour_mask': np.array([sum(1 << int(hour) for hour in p['active_hours']) for p in profiles],
+                                  dtype=np.int64),
+            'transaction_count': np.array([p['transaction_count'] for p in profiles], dtype=np.int64),
+        }, index=pd.Index(user_ids, name='userId', dtype=np.int64))
+
+        rows = [
+            (userId, merchant, profile['common_merchants'].get(merchant, 1), mean,
+             profile['merchant_wise_amount_std'].get(merchant, np.nan))
+            for userId, profile in user_profiles.items()
+            for merchant, mean in profile['merchant_wise_amount_mean'].items()
+        ]
+        merchants = pd.DataFrame(rows, columns=['userId', 'merchantName'] + cls.MERCHANT_COLUMNS).astype({
+            'userId': np.int64, 'merchantName': object, 'merchant_count': np.int64,
+            'merchant_amount_mean': np.float64, 'merchant_amount_std': np.float64,
+        })
+        return cls(users, merchants)
+
+    def join(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Join the profile columns onto transactions by userId and (userId, merchantName).
+        Args:
+            transactions: pd.DataFrame
+        Returns:
+            pd.DataFrame: one row per transaction, aligned with its index. has_profile marks
+                rows whose user has a profile, merchant_count is 0 for merchants the user
+                has never used.
+        """
+        keys = transactions[['userId', 'merchantName']].reset_index(drop=True)
+        features = keys.join(self.users, on='userId')
+        features['has_profile'] = keys['userId'].isin(self.users.index).to_numpy()
+        features = features.merge(self.merchants, how='left', on=['userId', 'merchantName'])
+        features['hour_mask'] = features['hour_mask'].fillna(0).astype(np.int64)
+        features['merchant_count'] = features['merchant_count'].fillna(0).astype(np.int64)
+        features.index = transactions.index
+        return features.drop(columns=['userId', 'merchantName'])
+
+
+def _user_std(count: np.ndarray, mean: np.ndarray, m2: np.ndarray) -> np.ndarray:
+    """Sample std of a user's amounts, or half the mean for a single transaction."""
+    count, m2 = np.asarray(count), np.asarray(m2, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 1, np.sqrt(m2 / (count - 1)), mean / 2)
+
+
+def _is_sorted(user_ids: np.ndarray) -> bool:
+    return len(user_ids) < 2 or bool(np.all(user_ids[1:] > user_ids[:-1]))
+
+
+def _merchant_std(count: np.ndarray, m2: np.ndarray) -> np.ndarray:
+    """Sample std of a user's amounts at a merchant, NaN for a single transaction."""
+    count, m2 = np.asarray(count), np.asarray(m2, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 1, np.sqrt(m2 / (count - 1)), np.nan)
+
+
+class ProfileStore(Mapping):
+    """
+    Array-backed user profiles.
+
+    Users are addressed by a dense index into flat NumPy arrays. Hour activity is a
+    (users, 24) histogram and per-merchant statistics are stored CSR-style: the merchants
+    of user i are rows merchant_indptr[i]:merchant_indptr[i + 1] of the merchant arrays,
+    sorted by merchant code. Reading store[userId] returns a profile dict in the shape
+    the rules expect; only users with at least min_history transactions are visible.
+
+    Amount statistics are kept as running moments (count, mean and M2, the sum of squared
+    deviations from the mean), so new transactions can be folded in with update() or merge()
+    without revisiting the history.
+
+    While user_ids is sorted, as built and as loaded from a snapshot, users are found by
+    binary search; the userId to index dict is only built once users are appended out of order.
+    """
+
+    USER_ARRAYS = ('user_ids', 'transaction_count', 'amount_mean', 'amount_m2', 'amount_std',
+                   'min_amount', 'max_amount', 'hour_counts', 'hour_mask')
+    MERCHANT_ARRAYS = ('merchant_codes', 'merchant_count', 'merchant_amount_mean', 'merchant_amount_m2',
+                       'merchant_amount_std')
+
+    def __init__(self, user_ids: np.ndarray, transaction_count: np.ndarray, amount_mean: np.ndarray,
+                 amount_m2: np.ndarray, amount_std: np.ndarray, min_amount: np.ndarray, max_amount: np.ndarray,
+                 hour_counts: np.ndarray, merchant_names: np.ndarray, merchant_indptr: np.ndarray,
+                 merchant_codes: np.ndarray, merchant_count: np.ndarray, merchant_amount_mean: np.ndarray,
+                 merchant_amount_m2: np.ndarray, merchant_amount_std: np.ndarray, min_history: int = 1,
+                 hour_mask: Optional[np.ndarray] = None):
+        self.user_ids = user_ids
+        self.transaction_count = transaction_count
+        self.amount_mean = amount_mean
+        self.amount_m2 = amount_m2
+        self.amount_std = amount_std
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.hour_counts = hour_counts
+        # 24-bit mask of the hours each user has been active in, kept in step with hour_counts.
+        if hour_mask is None:
+            hour_mask = ((hour_counts > 0).astype(np.int64) << np.arange(24, dtype=np.int64)).sum(axis=1)
+        self.hour_mask = hour_mask
+        self.merchant_names = merchant_names
+        self.merchant_indptr = merchant_indptr
+        self.merchant_codes = merchant_codes
+        self.merchant_count = merchant_count
+        self.merchant_amount_mean = merchant_amount_mean
+        self.merchant_amount_m2 = merchant_amount_m2
+        self.merchant_amount_std = merchant_amount_std
+        self.min_history = min_history
+        self._user_index = None if _is_sorted(user_ids) else self._build_user_index()
+        self._merchant_index = None
+        # Per-user buffers behind the user arrays, grown geometrically as users are added.
+        self._user_buffers = {name: getattr(self, name) for name in self.USER_ARRAYS + ('merchant_indptr',)}
+        # Merchant pairs first seen by update(), keyed by user index then merchant code,
+        # holding [count, mean, m2]. compact() moves them into the CSR arrays.
+        self.pending_merchants = {}
+
+    @classmethod
+    def empty(cls, min_history: int = 1) -> "ProfileStore":
+        """
+        Args:
+            min_history: minimum number of transactions for a user's profile to be visible
+        Returns:
+            ProfileStore: a store without users
+        """
+        floats = np.zeros(0, dtype=np.float64)
+        return cls(user_ids=np.zeros(0, dtype=np.int64), transaction_count=np.zeros(0, dtype=np.int64),
+                   amount_mean=floats, amount_m2=floats.copy(), amount_std=floats.copy(),
+                   min_amount=floats.copy(), max_amount=floats.copy(), hour_counts=np.zeros((0, 24), dtype=np.int32),
+                   merchant_names=np.zeros(0, dtype=object), merchant_indptr=np.zeros(1, dtype=np.int64),
+                   merchant_codes=np.zeros(0, dtype=np.int32), merchant_count=np.zeros(0, dtype=np.int64),
+                   merchant_amount_mean=floats.copy(), merchant_amount_m2=floats.copy(),
+                   merchant_amount_std=floats.copy(), min_history=min_history)
+
+    @classmethod
+    def build(cls, transactions: pd.DataFrame, min_history: int = 1) -> "ProfileStore":
+        """
+        Build the profiles of every user with grouped aggregations over (userId),
+        (userId, hour) and (userId, merchantName).
+        Args:
+            transactions: pd.DataFrame
+            min_history: minimum number of transactions for a user's profile to be visible
+        Returns:
+            ProfileStore: ProfileStore
+        """
+        user_ids, users = np.unique(transactions['userId'].to_numpy(), return_inverse=True)
+        merchants, merchant_names = pd.factorize(transactions['merchantName'], sort=True)
+        amounts = pd.Series(transactions['amount'].to_numpy(np.float64))
+        hours = transactions['timestamp'].dt.hour.to_numpy()
+        n_users = len(user_ids)
+
+        by_user = amounts.groupby(users).agg(['count', 'mean', 'std', 'var', 'min', 'max'])
+        transaction_count = by_user['count'].to_numpy(np.int64)
+        amount_mean = by_user['mean'].to_numpy()
+        amount_std = np.where(transaction_count > 1, by_user['std'].to_numpy(), amount_mean / 2)
+
+        hour_counts = np.bincount(users * 24 + hours, minlength=n_users * 24).reshape(n_users, 24).astype(np.int32)
+
+        by_merchant = amounts.groupby([users, merchants]).agg(['count', 'mean', 'std', 'var'])
+        merchant_count = by_merchant['count'].to_numpy(np.int64)
+        pair_users = by_merchant.index.get_level_values(0).to_numpy()
+        merchant_indptr = np.zeros(n_users + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_users, minlength=n_users), out=merchant_indptr[1:])
+
+        return cls(
+            user_ids=user_ids.astype(np.int64),
+            transaction_count=transaction_count,
+            amount_mean=amount_mean,
+            amount_m2=np.nan_to_num(by_user['var'].to_numpy() * (transaction_count - 1)),
+            amount_std=amount_std,
+            min_amount=by_user['min'].to_numpy(),
+            max_amount=by_user['max'].to_numpy(),
+            hour_counts=hour_counts,
+            merchant_names=np.asarray(merchant_names, dtype=object),
+            merchant_indptr=merchant_indptr,
+            merchant_codes=by_merchant.index.get_level_values(1).to_numpy().astype(np.int32),
+            merchant_count=merchant_count,
+            merchant_amount_mean=by_merchant['mean'].to_numpy(),
+            merchant_amount_m2=np.nan_to_num(by_merchant['var'].to_numpy() * (merchant_count - 1)),
+            merchant_amount_std=by_merchant['std'].to_numpy(),
+            min_history=min_history,
+        )
+
+    @classmethod
+    def from_sums(cls, user_ids: np.ndarray, count: np.ndarray, total: np.ndarray, total_sq: np.ndarray,
+                  min_amount: np.ndarray, max_amount: np.ndarray, hour_counts: np.ndarray,
+                  pair_users: np.ndarray, pair_merchants: np.ndarray, pair_count: np.ndarray,
+                  pair_total: np.ndarray, pair_total_sq: np.ndarray, min_history: int = 1) -> "ProfileStore":
+        """
+        Build the profiles from per-user and per-(user, merchant) count, sum and sum of squares
+        of the amounts, as aggregated outside of pandas.
+        Args:
+            user_ids: user ids, sorted
+            count, total, total_sq, min_amount, max_amount: amount aggregates of each user
+            hour_counts: (users, 24) histogram of transaction hours
+            pair_users: dense user index of each (user, merchant) pair
+            pair_merchants: merchant name of each pair
+            pair_count, pair_total, pair_total_sq: amount aggregates of each pair
+            min_history: minimum number of transactions for a user's profile to be visible
+        Returns:
+            ProfileStore: ProfileStore
+        """
+        merchant_names, pair_codes = np.unique(np.asarray(pair_merchants, dtype=object), return_inverse=True)
+        order = np.lexsort((pair_codes, pair_users))
+        pair_users, pair_codes = pair_users[order], pair_codes[order]
+        pair_count, pair_total, pair_total_sq = pair_count[order], pair_total[order], pair_total_sq[order]
+
+        count = np.asarray(count, dtype=np.int64)
+        amount_mean = total / count
+        amount_m2 = np.maximum(total_sq - total * amount_mean, 0.0)
+        merchant_count = np.asarray(pair_count, dtype=np.int64)
+        merchant_amount_mean = pair_total / merchant_count
+        merchant_amount_m2 = np.maximum(pair_total_sq - pair_total * merchant_amount_mean, 0.0)
+        merchant_indptr = np.zeros(len(user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pair_users, minlength=len(user_ids)), out=merchant_indptr[1:])
+
+        return cls(
+            user_ids=np.asarray(user_ids, dtype=np.int64),
+            transaction_count=count,
+            amount_mean=amount_mean,
+            amount_m2=amount_m2,
+            amount_std=_user_std(count, amount_mean, amount_m2),
+            min_amount=np.asarray(min_amount, dtype=np.float64),
+            max_amount=np.asarray(max_amount, dtype=np.float64),
+            hour_counts=np.asarray(hour_counts, dtype=np.int32),
+            merchant_names=merchant_names.astype(object),
+            merchant_indptr=merchant_indptr,
+            merchant_codes=pair_codes.astype(np.int32),
+            merchant_count=merchant_count,
+            merchant_amount_mean=merchant_amount_mean,
+            merchant_amount_m2=merchant_amount_m2,
+            merchant_amount_std=_merchant_std(merchant_count, merchant_amount_m2),
+            min_history=min_history,
+        )
+
+    def _build_user_index(self) -> dict:
+        return {int(userId): i for i, userId in enumerate(self.user_ids)}
+
+    @property
+    def merchant_index(self) -> dict:
+        """Merchant name to code, built on first use."""
+        if self._merchant_index is None:
+            self._merchant_index = {name: code for code, name in enumerate(self.merchant_names)}
+        return self._merchant_index
+
+    def _find(self, userId) -> Optional[int]:
+        """Dense index of a user, None if the user is not in the store."""
+        userId = int(userId)
+        if self._user_index is not None:
+            return self._user_index.get(userId)
+        i = int(np.searchsorted(self.user_ids, userId))
+        if i < len(self.user_ids) and self.user_ids[i] == userId:
+            return i
+        return None
+
+    def _find_users(self, user_ids: np.ndarray) -> np.ndarray:
+        """Dense indices of many users, -1 for users not in the store."""
+        if self._user_index is not None:
+            return np.array([self._user_index.get(int(userId), -1) for userId in user_ids], dtype=np.int64)
+        positions = np.searchsorted(self.user_ids, user_ids)
+        found = np.zeros(len(positions), dtype=bool)
+        if len(self.user_ids):
+            positions = np.minimum(positions, len(self.user_ids) - 1)
+            found = self.user_ids[positions] == user_ids
+        return np.where(found, positions, -1).astype(np.int64)
+
+    def _add_users(self, user_ids: np.ndarray) -> np.ndarray:
+        """
+        Append users that are not in the store yet.
+        Args:
+            user_ids: ids of the new users
+        Returns:
+            np.ndarray: dense indices of the new users
+        """
+        start = len(self.user_ids)
+        size = start + len(user_ids)
+        appended_in_order = _is_sorted(user_ids) and (start == 0 or len(user_ids) == 0
+                                                      or user_ids[0] > self.user_ids[start - 1])
+        if self._user_index is None and not appended_in_order:
+            self._user_index = self._build_user_index()
+        if size > len(self._user_buffers['user_ids']):
+            capacity = max(size, 2 * len(self._user_buffers['user_ids']), 16)
+            for name, buffer in self._user_buffers.items():
+                grown = np.empty((capacity + (name == 'merchant_indptr'),) + buffer.shape[1:], dtype=buffer.dtype)
+                grown[:len(getattr(self, name))] = getattr(self, name)
+                self._user_buffers[name] = grown
+        for name, buffer in self._user_buffers.items():
+            setattr(self, name, buffer[:size + (name == 'merchant_indptr')])
+
+        new = slice(start, size)
+        self.user_ids[new] = user_ids
+        self.transaction_count[new] = 0
+        self.amount_mean[new] = 0.0
+        self.amount_m2[new] = 0.0
+        self.amount_std[new] = np.nan
+        self.min_amount[new] = np.inf
+        self.max_amount[new] = -np.inf
+        self.hour_counts[new] = 0
+        self.hour_mask[new] = 0
+        self.merchant_indptr[start + 1:size + 1] = self.merchant_indptr[start]
+        if self._user_index is not None:
+            for i, userId in enumerate(user_ids, start):
+                self._user_index[int(userId)] = i
+        return np.arange(start, size)
+
+    def _merchant_code(self, merchant: str) -> int:
+        code = self.merchant_index.get(merchant)
+        if code is None:
+            code = len(self.merchant_names)
+            self.merchant_names = np.append(self.merchant_names, np.array([merchant], dtype=object))
+            self.merchant_index[merchant] = code
+        return code
+
+    def _merchant_row(self, i: int, code: int) -> Optional[int]:
+        start, end = int(self.merchant_indptr[i]), int(self.merchant_indptr[i + 1])
+        row = bisect_left(self.merchant_codes, code, start, end)
+        if row < end and self.merchant_codes[row] == code:
+            return row
+        return None
+
+    def merchant_stats(self, i: int, merchant: str) -> Optional[Tuple[int, float, float]]:
+        """
+        Args:
+            i: dense index of the user
+            merchant: merchant name
+        Returns:
+            Optional[Tuple[int, float, float]]: count, amount mean and amount std of the user
+                at the merchant, None if the user has never used it
+        """
+        code = self.merchant_index.get(merchant)
+        if code is None:
+            return None
+        row = self._merchant_row(i, code)
+        if row is not None:
+            return int(self.merchant_count[row]), float(self.merchant_amount_mean[row]), float(self.merchant_amount_std[row])
+        stats = self.pending_merchants.get(i, {}).get(code)
+        if stats is None:
+            return None
+        return stats[0], stats[1], float(_merchant_std(stats[0], stats[2]))
+
+    def merchants(self, i: int) -> List[Tuple[str, int, float, float]]:
+        """
+        Args:
+            i: dense index of the user
+        Returns:
+            List[Tuple[str, int, float, float]]: name, count, amount mean and amount std of
+                every merchant the user has used
+        """
+        rows = slice(self.merchant_indptr[i], self.merchant_indptr[i + 1])
+        merchants = list(zip(self.merchant_names[self.merchant_codes[rows]].tolist(),
+                             self.merchant_count[rows].tolist(), self.merchant_amount_mean[rows].tolist(),
+                             self.merchant_amount_std[rows].tolist()))
+        for code, (count, mean, m2) in self.pending_merchants.get(i, {}).items():
+            merchants.append((self.merchant_names[code], count, mean, float(_merchant_std(count, m2))))
+        return merchants
+
+    def profile(self, userId) -> Optional["UserProfile"]:
+        """
+        Args:
+            userId: id of the user
+        Returns:
+            Optional[UserProfile]: view of the user's profile for scalar rule evaluation,
+                None if the user has no visible profile
+        """
+        i = self._position(userId)
+        return None if i is None else UserProfile(self, i)
+
+    def update(self, userId: int, hour: int, merchant: str, amount: float) -> None:
+        """
+        Fold a single transaction into its user's profile in O(1), using Welford's update
+        for the amount mean and std.
+        Args:
+            userId: id of the user
+            hour: hour of day of the transaction
+            merchant: merchant name
+            amount: transaction amount
+        """
+        i = self._find(userId)
+        if i is None:
+            i = int(self._add_users(np.array([userId], dtype=np.int64))[0])
+
+        count = self.transaction_count[i] + 1
+        delta = amount - self.amount_mean[i]
+        mean = self.amount_mean[i] + delta / count
+        m2 = self.amount_m2[i] + delta * (amount - mean)
+        self.transaction_count[i] = count
+        self.amount_mean[i] = mean
+        self.amount_m2[i] = m2
+        self.amount_std[i] = _user_std(count, mean, m2)
+        self.min_amount[i] = min(self.min_amount[i], amount)
+        self.max_amount[i] = max(self.max_amount[i], amount)
+        self.hour_counts[i, hour] += 1
+        self.hour_mask[i] |= 1 << hour
+
+        code = self._merchant_code(merchant)
+        row = self._merchant_row(i, code)
+        if row is None:
+            stats = self.pending_merchants.setdefault(i, {}).setdefault(code, [0, 0.0, 0.0])
+            stats[0] += 1
+            delta = amount - stats[1]
+            stats[1] += delta / stats[0]
+            stats[2] += delta * (amount - stats[1])
+            return
+        count = self.merchant_count[row] + 1
+        delta = amount - self.merchant_amount_mean[row]
+        mean = self.merchant_amount_mean[row] + delta / count
+        m2 = self.merchant_amount_m2[row] + delta * (amount - mean)
+        self.merchant_count[row] = count
+        self.merchant_amount_mean[row] = mean
+        self.merchant_amount_m2[row] = m2
+        self.merchant_amount_std[row] = _merchant_std(count, m2)
+
+    def merge(self, other: "ProfileStore") -> None:
+        """
+        Fold the profiles of a new batch of transactions into this store, combining the
+        running moments of both sides per user and per (user, merchant) pair.
+        Args:
+            other: profiles built from the new transactions only
+        """
+        if len(other.user_ids) == 0:
+            return
+        self.compact()
+        other.compact()
+
+        users = self._find_users(other.user_ids)
+        missing = users < 0
+        if missing.any():
+            users[missing] = self._add_users(other.user_ids[missing])
+
+        count_a, count_b = self.transaction_count[users], other.transaction_count
+        count = count_a + count_b
+        delta = other.amount_mean - self.amount_mean[users]
+        mean = self.amount_mean[users] + delta * count_b / count
+        m2 = self.amount_m2[users] + other.amount_m2 + delta ** 2 * count_a * count_b / count
+        # Users new to the store take the other side's statistics as they are.
+        added = count_a == 0
+        self.amount_mean[users] = np.where(added, other.amount_mean, mean)
+        self.amount_m2[users] = np.where(added, other.amount_m2, m2)
+        self.amount_std[users] = np.where(added, other.amount_std, _user_std(count, mean, m2))
+        self.transaction_count[users] = count
+        self.min_amount[users] = np.minimum(self.min_amount[users], other.min_amount)
+        self.max_amount[users] = np.maximum(self.max_amount[users], other.max_amount)
+        self.hour_counts[users] += other.hour_counts
+        self.hour_mask[users] |= other.hour_mask
+
+        codes = np.array([self._merchant_code(name) for name in other.merchant_names], dtype=np.int64)
+        pair_users = users[np.repeat(np.arange(len(other.user_ids)), np.diff(other.merchant_indptr))]
+        pair_codes = codes[other.merchant_codes]
+        width = len(self.merchant_names)
+        keys = self._pair_keys(width)
+        new_keys = pair_users * width + pair_codes
+        rows = np.searchsorted(keys, new_keys)
+        found = np.zeros(len(new_keys), dtype=bool)
+        if len(keys):
+            rows = np.minimum(rows, len(keys) - 1)
+            found = keys[rows] == new_keys
+
+        rows = rows[found]
+        count_a, count_b = self.merchant_count[rows], other.merchant_count[found]
+        count = count_a + count_b
+        delta = other.merchant_amount_mean[found] - self.merchant_amount_mean[rows]
+        self.merchant_amount_mean[rows] = self.merchant_amount_mean[rows] + delta * count_b / count
+        self.merchant_amount_m2[rows] = (self.merchant_amount_m2[rows] + other.merchant_amount_m2[found]
+                                         + delta ** 2 * count_a * count_b / count)
+        self.merchant_count[rows] = count
+        self.merchant_amount_std[rows] = _merchant_std(count, self.merchant_amount_m2[rows])
+
+        new = ~found
+        self._insert_merchants(pair_users[new], pair_codes[new], other.merchant_count[new],
+                               other.merchant_amount_mean[new], other.merchant_amount_m2[new],
+                               other.merchant_amount_std[new])
+
+    def _pair_keys(self, width: int) -> np.ndarray:
+        """Sorted user * width + code keys of the CSR merchant rows."""
+        owners = np.repeat(np.arange(len(self.user_ids), dtype=np.int64), np.diff(self.merchant_indptr))
+        return owners * width + self.merchant_codes
+
+    def _insert_merchants(self, users: np.ndarray, codes: np.ndarray, count: np.ndarray,
+                          mean: np.ndarray, m2: np.ndarray, std: Optional[np.ndarray] = None) -> None:
+        """Insert (user, merchant) pairs that are not in the CSR arrays yet, keeping them sorted."""
+        if len(users) == 0:
+            return
+        width = len(self.merchant_names)
+        new_keys = users * width + codes
+        order = np.argsort(new_keys, kind='stable')
+        positions = np.searchsorted(self._pair_keys(width), new_keys[order])
+        inserted = {
+            'merchant_codes': codes.astype(np.int32), 'merchant_count': count.astype(np.int64),
+            'merchant_amount_mean': mean, 'merchant_amount_m2': m2,
+            'merchant_amount_std': _merchant_std(count, m2) if std is None else std,
+        }
+        for name in self.MERCHANT_ARRAYS:
+            setattr(self, name, np.insert(getattr(self, name), positions, inserted[name][order]))
+        per_user = np.bincount(users, minlength=len(self.user_ids))
+        self.merchant_indptr[1:] += np.cumsum(per_user)
+
+    def compact(self) -> None:
+        """Move the merchant pairs first seen by update() into the CSR arrays."""
+        if not self.pending_merchants:
+            return
+        rows = [(i, code, stats[0], stats[1], stats[2])
+                for i, merchants in self.pending_merchants.items() for code, stats in merchants.items()]
+        users, codes, count, mean, m2 = (np.array(column) for column in zip(*rows))
+        self.pending_merchants = {}
+        self._insert_merchants(users.astype(np.int64), codes.astype(np.int64), count.astype(np.int64),
+                               mean.astype(np.float64), m2.astype(np.float64))
+
+    def sorted_by_user(self) -> "ProfileStore":
+        """
+        Returns:
+            ProfileStore: this store if its users are sorted by id, otherwise a copy with the
+                users and their merchant rows in id order
+        """
+        self.compact()
+        if self._user_index is None or _is_sorted(self.user_ids):
+            return self
+        order = np.argsort(self.user_ids, kind='stable')
+        counts = np.diff(self.merchant_indptr)[order]
+        merchant_indptr = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(counts, out=merchant_indptr[1:])
+        rows = np.repeat(self.merchant_indptr[:-1][order] - merchant_indptr[:-1], counts) \
+            + np.arange(merchant_indptr[-1])
+        users = {name: getattr(self, name)[order] for name in self.USER_ARRAYS}
+        merchants = {name: getattr(self, name)[rows] for name in self.MERCHANT_ARRAYS}
+        return ProfileStore(merchant_names=self.merchant_names, merchant_indptr=merchant_indptr,
+                            min_history=self.min_history, **users, **merchants)
+
+    def _visible(self) -> np.ndarray:
+        return self.transaction_count >= self.min_history
+
+    def _position(self, userId) -> Optional[int]:
+        i = self._find(userId)
+        if i is None or self.transaction_count[i] < self.min_history:
+            return None
+        return i
+
+    def __getitem__(self, userId) -> dict:
+        i = self._position(userId)
+        if i is None:
+            raise KeyError(userId)
+        rows = slice(self.merchant_indptr[i], self.merchant_indptr[i + 1])
+        names = list(self.merchant_names[self.merchant_codes[rows]])
+        counts = list(self.merchant_count[rows])
+        means = list(self.merchant_amount_mean[rows])
+        stds = list(self.merchant_amount_std[rows])
+        for code, (count, mean, m2) in self.pending_merchants.get(i, {}).items():
+            names.append(self.merchant_names[code])
+            counts.append(count)
+            means.append(mean)
+            stds.append(_merchant_std(count, m2)[()])
+        return {
+            'active_hours': {hour: int(count) for hour, count in enumerate(self.hour_counts[i]) if count},
+            'common_merchants': {name: int(count) for name, count in zip(names, counts) if count >= 2},
+            'merchant_wise_amount_mean': dict(zip(names, means)),
+            'merchant_wise_amount_std': dict(zip(names, stds)),
+            'amount_mean': self.amount_mean[i],
+            'amount_std': self.amount_std[i],
+            'min_amount': self.min_amount[i],
+            'max_amount': self.max_amount[i],
+            'transaction_count': int(self.transaction_count[i]),
+        }
+
+    def __contains__(self, userId) -> bool:
+        try:
+            return self._position(userId) is not None
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return (int(userId) for userId in self.user_ids[self._visible()])
+
+    def __len__(self) -> int:
+        return int(self._visible().sum())
+
+    def to_table(self, user_ids: Optional[np.ndarray] = None) -> ProfileTable:
+        """
+        Args:
+            user_ids: only include these users, so joining a part of the transactions does
+                not materialize every profile
+        Returns:
+            ProfileTable: columnar view of the visible profiles
+        """
+        self.compact()
+        if user_ids is None:
+            users = np.flatnonzero(self._visible())
+        else:
+            users = self._find_users(np.unique(np.asarray(user_ids, dtype=np.int64)))
+            users = np.sort(users[users >= 0])
+            users = users[self.transaction_count[users] >= self.min_history]
+        table_users = pd.DataFrame({
+            'amount_mean': self.amount_mean[users],
+            'amount_std': self.amount_std[users],
+            'hour_mask': self.hour_mask[users],
+            'transaction_count': self.transaction_count[users],
+        }, index=pd.Index(self.user_ids[users], name='userId'))
+
+        # Merchant rows of the selected users, from their CSR ranges.
+        starts = self.merchant_indptr[users]
+        lengths = self.merchant_indptr[users + 1] - starts
+        pair_users = np.repeat(users, lengths)
+        pairs = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        merchants = pd.DataFrame({
+            'userId': self.user_ids[pair_users],
+            'merchantName': self.merchant_names[self.merchant_codes[pairs]],
+            'merchant_count': self.merchant_count[pairs],
+            'merchant_amount_mean': self.merchant_amount_mean[pairs],
+            'merchant_amount_std': self.merchant_amount_std[pairs],
+        })
+        return ProfileTable(table_users, merchants)
+
+    def join(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Gather the profile columns of a small batch of transactions straight from the arrays,
+        without materializing the whole ProfileTable.
+        Args:
+            transactions: pd.DataFrame
+        Returns:
+            pd.DataFrame: the same columns as ProfileTable.join, aligned with transactions
+        """
+        positions = np.array([-1 if i is None else i for i in map(self._position, transactions['userId'])],
+                             dtype=np.int64)
+        has_profile = positions >= 0
+        users = positions[has_profile]
+        stats = [self.merchant_stats(i, merchant) if i >= 0 else None
+                 for i, merchant in zip(positions, transactions['merchantName'])]
+
+        def gather(array: np.ndarray, fill) -> np.ndarray:
+            column = np.full(len(positions), fill, dtype=array.dtype)
+            column[has_profile] = array[users]
+            return column
+
+        return pd.DataFrame({
+            'amount_mean': gather(self.amount_mean, np.nan),
+            'amount_std': gather(self.amount_std, np.nan),
+            'hour_mask': gather(self.hour_mask, 0),
+            'transaction_count': gather(self.transaction_count, 0),
+            'has_profile': has_profile,
+            'merchant_count': np.array([0 if stat is None else stat[0] for stat in stats], dtype=np.int64),
+            'merchant_amount_mean': np.array([np.nan if stat is None else stat[1] for stat in stats], dtype=np.float64),
+            'merchant_amount_std': np.array([np.nan if stat is None else stat[2] for stat in stats], dtype=np.float64),
+        }, index=transactions.index)
+
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: bytes held by the profile arrays
+        """
+        arrays = [getattr(self, name) for name in self.USER_ARRAYS + self.MERCHANT_ARRAYS + ('merchant_indptr',)]
+        return sum(array.nbytes for array in arrays)
+
+
+class UserProfile:
+    """
+    Read-only view of one user in a ProfileStore, used by the scalar rule path.
+    Reading an attribute reads the store's arrays directly, nothing is copied.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: ProfileStore, index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def transaction_count(self) -> int:
+        return int(self.store.transaction_count[self.index])
+
+    @property
+    def amount_mean(self) -> float:
+        return float(self.store.amount_mean[self.index])
+
+    @property
+    def amount_std(self) -> float:
+        return float(self.store.amount_std[self.index])
+
+    @property
+    def hour_mask(self) -> int:
+        return int(self.store.hour_mask[self.index])
+
+    def merchant(self, merchant: str) -> Optional[Tuple[int, float, float]]:
+        """
+        Args:
+            merchant: merchant name
+        Returns:
+            Optional[Tuple[int, float, float]]: count, amount mean and amount std at the merchant
+        """
+        return self.store.merchant_stats(self.index, merchant)
@@ -1,100 +1,305 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Callable, Dict, List, Any, Tuple, Optional, Union
 import os
 import json
-from app.config import config
+import logging
+import tempfile
+import time
+from app.config import config, ServiceConfig
 from config import RuleConfig
 from protocol import Rule
 from app.models.model import Transaction, FraudDetectionResult
+from app.sevices.columnar import file_format, read_transactions, write_results
+from app.sevices.metrics import REPLAY_CACHE_HITS, RULE_DURATION, RULE_FLAGS, STAGE_DURATION
+from app.sevices.parallel import analyze_parallel
+from app.sevices.partitioning import partition_csv, read_partition
+from app.sevices.point_in_time import point_in_time_features
+from app.sevices.profile_cache import ProfileCache, SnapshotProfileSource
+from app.sevices.profiles import ProfileStore, ProfileTable
+from app.sevices.snapshots import load_snapshot, write_snapshot
+from app.sevices.store import TransactionStore
+from app.sevices.sweep import SWEEP_RULES, ThresholdSweep
+from app.sevices.rules.rules import (FLAGS_COLUMN, FLAGS_DTYPE, LEGACY_REASONS_COLUMN, LEGACY_SUSPICIOUS_COLUMN,
+                                     add_legacy_columns, flag_counts, parse_timestamp, render_flag_reasons,
+                                     suspicious_mask, to_microseconds)
+
+logger = logging.getLogger(__name__)
+
 
 class RuleBasedFraudMonitoringService:
     """Service layer for monitoring and flagging suspicious transactions."""
     
     def __init__(self, config: Optional[RuleConfig] = None,
-                        rules: Optional[List[Rule]] = None):
+                        rules: Optional[List[Rule]] = None,
+                        service_config: Optional[ServiceConfig] = None):
         """Initialize the monitoring service with configuration."""
         self.config = config or RuleConfig()
-        self.user_profiles = {}
+        self.service_config = service_config or ServiceConfig()
+        self.user_profiles = ProfileStore.empty(self.config.min_user_history)
         self.transactions = None
+        self.input_columns = []
         self.rules = rules
+        self.applied_rules = []
+        self.rule_stats = {}
+        # Called with (stage, fraction done) as analyze_data progresses.
+        self.progress_callback: Optional[Callable[[str, float], None]] = None
+        # Rules with cached results, e.g. the runtime ReplayCheckRule, dropped by swap_profiles.
+        self.result_caches: List[Rule] = []
     
 
-    def analyze_data(self, csv_path: str, output_file: str, report_file: str) -> None:
+    def analyze_data(self, csv_path: Union[str, TransactionStore], output_file: str, report_file: str,
+                     mode: Optional[str] = None) -> None:
         """
         Analyze the data and return a boolean value indicating if the data is valid.
+        Args:
+            csv_path: Path to the CSV file containing transaction data, or a TransactionStore
+            output_file: Path to the output file containing the results
+            report_file: Path to the report file containing the summary report
+            mode: "memory", "streaming", "parallel" or "point_in_time", defaults to ServiceConfig.analysis_mode
+        If ServiceConfig.profile_snapshot_path is set, the resulting profiles are written to it.
+        Raises:
+            ValueError: if no transactions could be loaded, before anything is written
+        """
+        if isinstance(csv_path, TransactionStore):
+            self.analyze_store(csv_path, output_file, report_file)
+            return
+        mode = mode or self.service_config.analysis_mode
+        if mode == "streaming":
+            self.analyze_data_streaming(csv_path, output_file, report_file)
+            return
+        if mode not in ("memory", "parallel", "point_in_time"):
+            raise ValueError(f"Unknown analysis mode: {mode}")
+        self._progress("loading", 0.0)
+        with STAGE_DURATION.labels("load_data").time():
+            loaded = self.load_data(csv_path)
+        if not loaded or self.transactions.empty:
+            raise ValueError(f"Could not load transactions from {csv_path}")
+        self._progress("rules", 0.3)
+        if mode == "parallel":
+            with STAGE_DURATION.labels("run_all_rules_parallel").time():
+                self.rule_stats = self.run_all_rules_parallel()
+        else:
+            self.rule_stats = self.run_all_rules(point_in_time=mode == "point_in_time")
+        self._progress("exporting", 0.8)
+        with STAGE_DURATION.labels("export_results").time():
+            self.export_results(output_file)
+        with STAGE_DURATION.labels("export_summary_report").time():
+            self.export_summary_report(report_file)
+        with STAGE_DURATION.labels("save_profile_snapshot").time():
+            self.save_profile_snapshot()
+        self._progress("done", 1.0)
+
+    def analyze_data_streaming(self, csv_path: str, output_file: str, report_file: str) -> None:
+        """
+        Analyze a CSV too large to hold in memory.
+        The file is read in chunks with compact dtypes and spilled into userId hash partitions.
+        Profiling and the rules then run one partition at a time, and each partition's results
+        are appended to the output file. Peak memory is bounded by the partition size. The output
+        rows are grouped by partition, and sorted by userId and timestamp within each partition.
+        Only the report counts are aggregated across partitions, the flagged transactions are
+        in the output file. Afterwards user_profiles holds the profiles of every user and
+        transactions is an empty frame with the input columns.
         Args:
             csv_path: Path to the CSV file containing transaction data
             output_file: Path to the output file containing the results
             report_file: Path to the report file containing the summary report
         """
-        self.load_data(csv_path)
-        self.run_all_rules()
-        self.export_results(output_file)
-        self.export_summary_report(report_file)
+        if file_format(csv_path) != "csv" or file_format(output_file) != "csv":
+            raise ValueError("Streaming mode reads and writes CSV only, use memory or parallel mode for Parquet or Arrow")
+        profiles = ProfileStore.empty(self.config.min_user_history)
+        counts = None
+        rule_stats: Dict[str, int] = {}
+        with tempfile.TemporaryDirectory(dir=self.service_config.spill_dir) as spill_dir:
+            self._progress("partitioning", 0.0)
+            with STAGE_DURATION.labels("partition_csv").time():
+                paths = partition_csv(csv_path, spill_dir, self.service_config.stream_partitions,
+                                      self.service_config.stream_chunksize)
+            for n, path in enumerate(paths):
+                self._progress("rules", 0.2 + 0.7 * n / len(paths))
+                with STAGE_DURATION.labels("read_partition").time():
+                    self.set_transactions(read_partition(path))
+                if self.service_config.incremental_profiles:
+                    self.user_profiles = profiles
+                for name, count in self.run_all_rules().items():
+                    rule_stats[name] = rule_stats.get(name, 0) + count
+                if not self.service_config.incremental_profiles:
+                    profiles.merge(self.user_profiles)
+                with STAGE_DURATION.labels("export_results").time():
+                    self._with_reasons(self._exported(self.transactions)).to_csv(
+                        output_file, mode='a' if n else 'w', header=not n, index=False)
+                counts = self._merge_report_counts(counts, self._report_counts())
+                self.transactions = self.transactions.iloc[:0]
+        if counts is None:
+            raise ValueError(f"Could not load transactions from {csv_path}")
+        self.user_profiles = profiles
+        self.rule_stats = rule_stats
+        self._progress("exporting", 0.9)
+        with STAGE_DURATION.labels("export_summary_report").time():
+            self._write_summary_report(counts, report_file)
+        with STAGE_DURATION.labels("save_profile_snapshot").time():
+            self.save_profile_snapshot()
+        self._progress("done", 1.0)
+
+    def analyze_store(self, store: TransactionStore, output_file: str, report_file: str) -> None:
+        """
+        Analyze the transactions of a TransactionStore.
+        The profiles come from the store's SQL aggregates, which are only recomputed for users
+        with transactions ingested since the last run.
+        Args:
+            store: TransactionStore
+            output_file: Path to the output file containing the results
+            report_file: Path to the report file containing the summary report
+        """
+        self._progress("loading", 0.0)
+        with STAGE_DURATION.labels("load_data").time():
+            self.set_transactions(store.read_transactions())
+        if self.transactions.empty:
+            raise ValueError("The transaction store has no transactions")
+        self._progress("profiles", 0.2)
+        with STAGE_DURATION.labels("load_profiles").time():
+            profiles = store.load_profiles(self.config.min_user_history)
+        self._progress("rules", 0.3)
+        self.rule_stats = self.run_all_rules(profiles=profiles)
+        self._progress("exporting", 0.8)
+        with STAGE_DURATION.labels("export_results").time():
+            self.export_results(output_file)
+        with STAGE_DURATION.labels("export_summary_report").time():
+            self.export_summary_report(report_file)
+        with STAGE_DURATION.labels("save_profile_snapshot").time():
+            self.save_profile_snapshot()
+        self._progress("done", 1.0)
+
+    def _progress(self, stage: str, fraction: float) -> None:
+        if self.progress_callback is not None:
+            self.progress_callback(stage, fraction)
     
     def load_data(self, csv_path: str) -> bool:
         """
-        Load transaction data from CSV file.
+        Load transaction data from a CSV, Parquet or Arrow IPC file.
         
         Args:
-            csv_path: Path to the CSV file containing transaction data
+            csv_path: Path to the file containing transaction data
             
         Returns:
             bool: True if loading was successful, False otherwise
         """
         try:
-            self.transactions = pd.read_csv(csv_path)
+            self.transactions = read_transactions(csv_path, self.service_config.input_cache_dir)
             required_columns = ['userId', 'timestamp', 'merchantName', 'amount']
-            try:
-                self.transactions['timestamp'] = pd.to_datetime(self.transactions['timestamp'])
-            except Exception as e:
-                self.logger.error(f"Error parsing timestamps: {e}")
-                return False
-            self.transactions = self.transactions.sort_values(['userId', 'timestamp'])
-            self.transactions['is_suspicious'] = False
-            self.transactions['flag_reasons'] = ""
+            self.set_transactions(self.transactions)
             return True
             
         except Exception as e:
+            logger.exception("Could not load transactions from %s", csv_path)
             return False
     
+    def set_transactions(self, transactions: pd.DataFrame) -> None:
+        """
+        Sort parsed transactions by user and time and reset their flags.
+        Args:
+            transactions: pd.DataFrame with parsed timestamps
+        """
+        self.transactions = transactions.sort_values(['userId', 'timestamp'])
+        self.input_columns = list(self.transactions.columns)
+        self.transactions[FLAGS_COLUMN] = np.zeros(len(self.transactions), dtype=FLAGS_DTYPE)
+        self.applied_rules = []
+
     def build_user_profiles(self) -> None:
         """Build profiles for each user based on their transaction history."""
-        self.user_profiles = {}
-        
-        grouped = self.transactions.groupby('userId')
-        
-        for userId, user_txns in grouped:
-            if len(user_txns) < self.config.min_user_history:
-                continue
-                
-            active_hours = user_txns['timestamp'].dt.hour.value_counts().to_dict()
-            common_merchants = {k: v for k, v in user_txns['merchantName'].value_counts().to_dict().items() if v >= 2}
-            amount_mean = user_txns['amount'].mean()
-            amount_std = user_txns['amount'].std() if len(user_txns) > 1 else amount_mean / 2
-            merchant_wise_amount_mean = user_txns.groupby('merchantName')['amount'].mean().to_dict()
-            merchant_wise_amount_std = user_txns.groupby('merchantName')['amount'].std().to_dict()
-            self.user_profiles[userId] = {
-                'active_hours': active_hours,
-                'common_merchants': common_merchants,
-                'merchant_wise_amount_mean': merchant_wise_amount_mean,
-                'merchant_wise_amount_std': merchant_wise_amount_std,
-                'amount_mean': amount_mean,
-                'amount_std': amount_std,
-                'min_amount': user_txns['amount'].min(),
-                'max_amount': user_txns['amount'].max(),
-                'transaction_count': len(user_txns)
-            }
-        
-        print(self.user_profiles.keys())
+        self.user_profiles = ProfileStore.build(self.transactions, self.config.min_user_history)
+
+    def save_profile_snapshot(self, path: Optional[str] = None) -> bool:
+        """
+        Write the current profiles to a snapshot file.
+        Args:
+            path: destination, defaults to ServiceConfig.profile_snapshot_path
+        Returns:
+            bool: True if a snapshot was written, False if no path is configured or the profiles
+                are served from a transaction store
+        """
+        path = path or self.service_config.profile_snapshot_path
+        if not path:
+            return False
+        profiles = self.user_profiles
+        if isinstance(profiles, ProfileCache):
+            if not isinstance(profiles.source, SnapshotProfileSource):
+                return False
+            profiles = profiles.source.store
+        write_snapshot(profiles, path)
+        return True
+
+    def load_profile_snapshot(self, path: Optional[str] = None) -> bool:
+        """
+        Memory-map a profile snapshot and swap it in as the profiles used for scoring.
+        Requests already being scored keep the profiles they started with.
+        Args:
+            path: snapshot to load, defaults to ServiceConfig.profile_snapshot_path
+        Returns:
+            bool: True if a snapshot was loaded, False if there is none
+        """
+        path = path or self.service_config.profile_snapshot_path
+        if not path or not os.path.exists(path):
+            return False
+        self.swap_profiles(load_snapshot(path))
+        return True
+
+    def swap_profiles(self, profiles: Union[ProfileStore, ProfileCache]) -> None:
+        """
+        Replace the profiles used for scoring.
+        A single reference assignment, so every request sees either the old or the new profiles.
+        With ServiceConfig.profile_cache_max_bytes set, a ProfileStore is served through a
+        ProfileCache that reads users from it on demand. Cached results, which were scored
+        against the old profiles, are dropped.
+        Args:
+            profiles: ProfileStore, or a ProfileCache to serve as is
+        """
+        if isinstance(profiles, ProfileStore) and self.service_config.profile_cache_max_bytes is not None:
+            profiles = self.profile_cache(SnapshotProfileSource(profiles))
+        self.user_profiles = profiles
+        self.clear_cached_results()
+
+    def clear_cached_results(self) -> None:
+        """Drop the results cached by the rules in result_caches, e.g. once the profiles change."""
+        for rule in self.result_caches:
+            rule.clear_cached_results()
+
+    def profile_cache(self, source) -> ProfileCache:
+        """
+        Args:
+            source: ProfileSource the cache loads missed users from
+        Returns:
+            ProfileCache: cache sized by the ServiceConfig.profile_cache_* parameters
+        """
+        if self.service_config.incremental_profiles:
+            raise ValueError("The profile cache is read-only and cannot be used with incremental_profiles")
+        return ProfileCache(source, max_bytes=self.service_config.profile_cache_max_bytes,
+                            top_merchants=self.service_config.profile_cache_top_merchants,
+                            sketch_width=self.service_config.profile_cache_sketch_width,
+                            sketch_depth=self.service_config.profile_cache_sketch_depth)
+
+    def update_user_profiles(self) -> None:
+        """
+        Fold the loaded transactions into the existing profiles instead of rebuilding them.
+        The loaded transactions are expected to be new data, not already part of the profiles.
+        """
+        self.user_profiles.merge(ProfileStore.build(self.transactions, self.config.min_user_history))
             
-    def run_all_rules(self, rules: List[Rule] = None) -> Dict[str, int]:
+    def run_all_rules(self, rules: List[Rule] = None, profiles: Optional[ProfileStore] = None,
+                      point_in_time: bool = False) -> Dict[str, int]:
         """
         Apply all fraud detection rules and return statistics.
+        Rules that implement apply_batch run on the columnar profile table,
+        any other rule falls back to apply with the profile dicts. Rules without a flag bit
+        mark transactions in the is_suspicious and flag_reasons columns, as before the flags
+        column, and those marks are kept in the results and the report.
         Args:
             rules: List[Rule]
+            profiles: profiles to use, built from the loaded transactions if not given
+            point_in_time: score every transaction against its user's strictly earlier transactions
+                instead of the whole history, for backtesting without look-ahead. Only apply_batch
+                rules see these features; the profiles are still built and kept for serving.
         Returns:
             Dict[str, int]: Dictionary with rule names as keys and flagged counts as values
         """
@@ -104,19 +309,86 @@ class RuleBasedFraudMonitoringService:
         if self.rules is None:
             raise ValueError("Rules are not set")
             
-        self.build_user_profiles()
+        if profiles is not None:
+            self.user_profiles = profiles
+        else:
+            with STAGE_DURATION.labels("build_user_profiles").time():
+                if self.service_config.incremental_profiles:
+                    self.update_user_profiles()
+                else:
+                    self.build_user_profiles()
         
         rule_stats = {}
-        for rule in rules or self.rules:
-            rule_stats[rule.__class__.__name__] = rule.apply(self.transactions, self.user_profiles)
-        
-        total_flagged = len(self.transactions[self.transactions['is_suspicious']])
-        total_transactions = len(self.transactions)
+        features = None
+        self.applied_rules = list(rules or self.rules)
+        for rule in self.applied_rules:
+            name = rule.__class__.__name__
+            if hasattr(rule, 'apply_batch') and features is None:
+                if point_in_time:
+                    with STAGE_DURATION.labels("point_in_time_features").time():
+                        features = point_in_time_features(self.transactions, self.config.min_user_history)
+                else:
+                    with STAGE_DURATION.labels("join_features").time():
+                        # Only the profiles of the loaded users, which with incremental profiles
+                        # in streaming mode are one partition's share of the store.
+                        table = ProfileTable.from_profiles(self.user_profiles, self.transactions['userId'].unique())
+                        features = table.join(self.transactions)
+            with RULE_DURATION.labels(name, "batch").time():
+                if hasattr(rule, 'apply_batch'):
+                    rule_stats[name] = rule.apply_batch(self.transactions, features)
+                else:
+                    if not getattr(rule, 'flag', 0):
+                        add_legacy_columns(self.transactions)
+                    rule_stats[name] = rule.apply(self.transactions, self.user_profiles)
+            RULE_FLAGS.labels(name, "batch").inc(rule_stats[name])
         return rule_stats
     
+    def run_all_rules_parallel(self, rules: List[Rule] = None, workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        Build the profiles and apply the rules in a pool of worker processes, one userId shard at a time.
+        Produces the same flags, profiles and rule statistics as run_all_rules.
+        Args:
+            rules: List[Rule]
+            workers: number of worker processes, defaults to ServiceConfig.workers
+        Returns:
+            Dict[str, int]: Dictionary with rule names as keys and flagged counts as values
+        """
+        if self.transactions is None:
+            return {}
+
+        if self.rules is None:
+            raise ValueError("Rules are not set")
+
+        self.applied_rules = list(rules or self.rules)
+        rule_stats, columns, profiles = analyze_parallel(self.transactions, self.applied_rules, self.config,
+                                                         workers or self.service_config.workers)
+        for name, values in columns.items():
+            self.transactions[name] = values
+        if self.service_config.incremental_profiles:
+            self.user_profiles.merge(profiles)
+        else:
+            self.user_profiles = profiles
+        return rule_stats
+
+    def sweep_rule_configs(self, configs: List[RuleConfig], point_in_time: bool = False) -> pd.DataFrame:
+        """
+        Count what the batch rules would flag on the loaded transactions under each config,
+        without touching the flags, the profiles or the module-level config.
+        Args:
+            configs: RuleConfigs to evaluate, e.g. from app.sevices.sweep.config_grid
+            point_in_time: score against the user's strictly earlier transactions only
+        Returns:
+            pd.DataFrame: one row per config, see ThresholdSweep.run
+        """
+        if self.transactions is None:
+            return pd.DataFrame()
+        swept = tuple(rule.label for rule in SWEEP_RULES)
+        labels = [rule.label for rule in (self.rules or []) if getattr(rule, 'label', None) in swept]
+        return ThresholdSweep(self.transactions, point_in_time).run(configs, labels or None)
+
     def get_suspicious_transactions(self) -> pd.DataFrame:
         """
-        Return only the suspicious transactions.
+        Return only the suspicious transactions, with their flag reasons rendered.
         
         Returns:
             pd.DataFrame: DataFrame containing only suspicious transactions
@@ -124,14 +396,28 @@ class RuleBasedFraudMonitoringService:
         if self.transactions is None:
             return pd.DataFrame()
             
-        return self.transactions[self.transactions['is_suspicious']]
+        return self._with_reasons(self.transactions[suspicious_mask(self.transactions)])
+
+    def _with_reasons(self, transactions: pd.DataFrame) -> pd.DataFrame:
+        """
+        Turn the flags column back into the is_suspicious and flag_reasons columns.
+        Args:
+            transactions: pd.DataFrame
+        Returns:
+            pd.DataFrame: the input columns followed by is_suspicious and flag_reasons
+        """
+        result = transactions[self.input_columns].copy()
+        result['is_suspicious'] = suspicious_mask(transactions)
+        result['flag_reasons'] = render_flag_reasons(transactions, self.applied_rules)
+        return result
     
-    def export_results(self, output_path: str) -> bool:
+    def export_results(self, output_path: str, flagged_only: Optional[bool] = None) -> bool:
         """
         Export the full dataset with suspicious flags.
         
         Args:
-            output_path: Path where to save the results CSV
+            output_path: Path where to save the results, as CSV, Parquet or Arrow IPC by extension
+            flagged_only: only export the suspicious transactions, defaults to ServiceConfig.output_flagged_only
             
         Returns:
             bool: True if export was successful, False otherwise
@@ -140,11 +426,17 @@ class RuleBasedFraudMonitoringService:
             return False
             
         try:
-            self.transactions.to_csv(output_path, index=False)
+            write_results(self._with_reasons(self._exported(self.transactions, flagged_only)), output_path)
             return True
-        except Exception as e:
+        except Exception:
+            logger.exception("Could not export the results to %s", output_path)
             return False
     
+    def _exported(self, transactions: pd.DataFrame, flagged_only: Optional[bool] = None) -> pd.DataFrame:
+        if flagged_only is None:
+            flagged_only = self.service_config.output_flagged_only
+        return transactions[suspicious_mask(transactions)] if flagged_only else transactions
+
     def export_summary_report(self, output_path: str) -> bool:
         """
         Export a summary report of the analysis in JSON format.
@@ -157,28 +449,58 @@ class RuleBasedFraudMonitoringService:
         """
         if self.transactions is None:
             return False
-            
+        return self._write_summary_report(self._report_counts(), output_path)
+
+    def _report_counts(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: transaction, user and per-rule counts of the loaded transactions
+        """
+        suspicious = suspicious_mask(self.transactions)
+        return {
+            "total_transactions": len(self.transactions),
+            "suspicious_transactions": int(suspicious.sum()),
+            "total_users": self.transactions['userId'].nunique(),
+            "users_with_flags": self.transactions['userId'][suspicious].nunique(),
+            "rule_breakdown": flag_counts(self.transactions, self.applied_rules),
+        }
+
+    @staticmethod
+    def _merge_report_counts(total: Optional[Dict[str, Any]], counts: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Add up the report counts of partitions with disjoint users.
+        Args:
+            total: counts so far, None for the first partition
+            counts: counts of the next partition
+        Returns:
+            Dict[str, Any]: combined counts
+        """
+        if total is None:
+            return counts
+        merged = {key: total[key] + counts[key] for key in counts if key != "rule_breakdown"}
+        merged["rule_breakdown"] = dict(total["rule_breakdown"])
+        for rule, count in counts["rule_breakdown"].items():
+            merged["rule_breakdown"][rule] = merged["rule_breakdown"].get(rule, 0) + count
+        return merged
+
+    def _write_summary_report(self, counts: Dict[str, Any], output_path: str) -> bool:
+        """
+        Write the summary report for the given counts in JSON format.
+        Args:
+            counts: counts as returned by _report_counts
+            output_path: Path where to save the summary report
+        Returns:
+            bool: True if export was successful, False otherwise
+        """
         try:
-            suspicious = self.transactions[self.transactions['is_suspicious']]
-            
-            rule_counts = {}
-            for reason_str in suspicious['flag_reasons'].dropna():
-                reasons = reason_str.split('; ')
-                for reason in reasons:
-                    rule_type = reason.split(':')[0].strip()
-                    rule_counts[rule_type] = rule_counts.get(rule_type, 0) + 1
-            
-            total_users = self.transactions['userId'].nunique()
-            users_with_flags = suspicious['userId'].nunique()
-            
             summary = {
-                "total_transactions": len(self.transactions),
-                "suspicious_transactions": len(suspicious),
-                "suspicious_percentage": (len(suspicious) / len(self.transactions)) * 100,
-                "total_users": total_users,
-                "users_with_flags": users_with_flags,
-                "users_with_flags_percentage": (users_with_flags / total_users) * 100,
-                "rule_breakdown": rule_counts,
+                "total_transactions": counts["total_transactions"],
+                "suspicious_transactions": counts["suspicious_transactions"],
+                "suspicious_percentage": (counts["suspicious_transactions"] / counts["total_transactions"]) * 100,
+                "total_users": counts["total_users"],
+                "users_with_flags": counts["users_with_flags"],
+                "users_with_flags_percentage": (counts["users_with_flags"] / counts["total_users"]) * 100,
+                "rule_breakdown": counts["rule_breakdown"],
                 "config": {
                     "velocity_window_minutes": self.config.velocity_window_minutes,
                     "velocity_threshold_count": self.config.velocity_threshold_count,
@@ -192,41 +514,192 @@ class RuleBasedFraudMonitoringService:
             with open(output_path, 'w') as f:
                 json.dump(summary, f, indent=4)    
             return True
-        except Exception as e:
+        except Exception:
+            logger.exception("Could not export the summary report to %s", output_path)
             return False
     
     def detect_fraud(self, transaction: Transaction, rules: List[Rule]) -> FraudDetectionResult:
         """
         Detect if transaction is fraud.
+        Rules that implement evaluate are checked directly against the user's profile,
+        other rules run on a one-row DataFrame. Afterwards rules that implement record are
+        given the transaction, whether or not the user has a profile. A transaction identical
+        to one scored before gets the cached result of a rule that implements cached_result,
+        without running the rules or recording it again.
         Args:
             transaction: Transaction
             rules: List[Rule]
         Returns:
             FraudDetectionResult: FraudDetectionResult
         """
+        cached = self._cached_result(transaction, rules)
+        if cached is not None:
+            return cached
+        result = self._score(transaction, rules)
+        self._cache_result(transaction, rules, result)
+        return result
 
-        transactions: pd.DataFrame = pd.DataFrame({
-            'userId': [transaction.user_id],
-            'timestamp': [pd.to_datetime(transaction.timestamp)],
-            'merchantName': [transaction.merchant_name],
-            'amount': [transaction.amount],
-            "is_suspicious": [False],
-            "flag_reasons": [""]
-        })
+    def _cached_result(self, transaction: Transaction, rules: List[Rule]) -> Optional[FraudDetectionResult]:
+        for rule in rules:
+            if hasattr(rule, 'cached_result'):
+                result = rule.cached_result(transaction)
+                if result is not None:
+                    REPLAY_CACHE_HITS.labels().inc()
+                    return result
+        return None
 
-        print(self.user_profiles.keys())
-        if transaction.user_id not in self.user_profiles:
-            return FraudDetectionResult(
+    def _cache_result(self, transaction: Transaction, rules: List[Rule], result: FraudDetectionResult) -> None:
+        for rule in rules:
+            if hasattr(rule, 'cache_result'):
+                rule.cache_result(transaction, result)
+
+    def _score(self, transaction: Transaction, rules: List[Rule]) -> FraudDetectionResult:
+        """
+        Run the rules on one transaction and record it, the uncached part of detect_fraud.
+        Args:
+            transaction: Transaction
+            rules: List[Rule]
+        Returns:
+            FraudDetectionResult: FraudDetectionResult
+        """
+        profile = self.user_profiles.profile(transaction.user_id)
+        if profile is None:
+            result = FraudDetectionResult(
                 is_fraud=False,
                 rule_stats={}
             )
-        
-        rule_stats: dict[str, int] = {}
+        else:
+            rule_stats: dict[str, int] = {}
+            transactions = None
+            for rule in rules:
+                name = rule.__class__.__name__
+                start = time.perf_counter()
+                if hasattr(rule, 'evaluate'):
+                    rule_stats[name] = int(rule.evaluate(transaction, profile))
+                else:
+                    if transactions is None:
+                        transactions = self._transaction_frame(transaction)
+                    rule_stats[name] = rule.apply(transactions, self.user_profiles)
+                RULE_DURATION.labels(name, "scalar").observe(time.perf_counter() - start)
+                if rule_stats[name]:
+                    RULE_FLAGS.labels(name, "scalar").inc(rule_stats[name])
+
+            result = FraudDetectionResult(
+                is_fraud=any(rule_stats.values()),
+                rule_stats=rule_stats
+            )
+
         for rule in rules:
-            rule_stats[rule.__class__.__name__] = rule.apply(transactions, self.user_profiles)
-        
-        print(rule_stats)
-        return FraudDetectionResult(
-            is_fraud=any(rule_stats.values()),
-            rule_stats=rule_stats
-        )
\ No newline at end of file
+            if hasattr(rule, 'record'):
+                rule.record(transaction)
+        if self.service_config.incremental_profiles:
+            self.user_profiles.update(transaction.user_id, parse_timestamp(transaction.timestamp).hour,
+                                      transaction.merchant_name, transaction.amount)
+        return result
+
+    def detect_fraud_batch(self, transactions: List[Transaction], rules: List[Rule]) -> List[FraudDetectionResult]:
+        """
+        Detect fraud for a batch of transactions in one vectorized pass.
+        The results are the same as calling detect_fraud on each transaction alone: rules that
+        implement apply_batch run once over the whole batch, any other rule, and any rule that
+        records the transactions it sees, is evaluated per transaction. Transactions with a
+        cached result are answered from the cache and not scored; when a rule caches results,
+        exact duplicates within the batch are answered with the result of the first, as if they
+        had been resubmitted one after the other. With
+        incremental profiles every transaction changes the profiles the next one is scored
+        against, so the batch is scored one transaction at a time instead.
+        Args:
+            transactions: List[Transaction]
+            rules: List[Rule]
+        Returns:
+            List[FraudDetectionResult]: one result per transaction, in input order
+        """
+        if self.service_config.incremental_profiles or not transactions:
+            return [self.detect_fraud(transaction, rules) for transaction in transactions]
+
+        results: List[Optional[FraudDetectionResult]] = [self._cached_result(transaction, rules)
+                                                         for transaction in transactions]
+        fresh = [i for i, result in enumerate(results) if result is None]
+        duplicates: Dict[int, int] = {}
+        if any(hasattr(rule, 'cached_result') for rule in rules):
+            first: Dict[Tuple[int, int, str, float], int] = {}
+            for i in fresh:
+                duplicates[i] = first.setdefault(self._fingerprint(transactions[i]), i)
+            duplicates = {i: j for i, j in duplicates.items() if i != j}
+            fresh = [i for i in fresh if i not in duplicates]
+        for i, result in zip(fresh, self._score_batch([transactions[i] for i in fresh], rules)):
+            results[i] = result
+            self._cache_result(transactions[i], rules, result)
+        for i, j in duplicates.items():
+            cached = self._cached_result(transactions[i], rules)
+            results[i] = results[j] if cached is None else cached
+        return results
+
+    @staticmethod
+    def _fingerprint(transaction: Transaction) -> Tuple[int, int, str, float]:
+        """Fields that make two transactions exact duplicates, as the replay cache compares them."""
+        return (transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)),
+                transaction.merchant_name, transaction.amount)
+
+    def _score_batch(self, transactions: List[Transaction], rules: List[Rule]) -> List[FraudDetectionResult]:
+        """
+        Run the rules on a batch of transactions, the uncached part of detect_fraud_batch.
+        Args:
+            transactions: List[Transaction]
+            rules: List[Rule]
+        Returns:
+            List[FraudDetectionResult]: one result per transaction, in input order
+        """
+        if not transactions:
+            return []
+
+        batch = pd.DataFrame({
+            'userId': np.array([transaction.user_id for transaction in transactions], dtype=np.int64),
+            # Wall-clock time, as the scalar rules read it, so naive and tz-aware timestamps can be mixed.
+            'timestamp': pd.to_datetime([parse_timestamp(transaction.timestamp).replace(tzinfo=None)
+                                         for transaction in transactions]),
+            'merchantName': [transaction.merchant_name for transaction in transactions],
+            'amount': np.array([transaction.amount for transaction in transactions], dtype=np.float64),
+            FLAGS_COLUMN: np.zeros(len(transactions), dtype=FLAGS_DTYPE)
+        })
+        features = self.user_profiles.join(batch)
+
+        hits: dict[str, np.ndarray] = {}
+        for rule in rules:
+            name = rule.__class__.__name__
+            flag = getattr(rule, 'flag', 0)
+            if flag and hasattr(rule, 'apply_batch') and not hasattr(rule, 'record'):
+                with RULE_DURATION.labels(name, "batch").time():
+                    rule.apply_batch(batch, features)
+                hits[name] = np.bitwise_and(batch[FLAGS_COLUMN].to_numpy(), flag) != 0
+                RULE_FLAGS.labels(name, "batch").inc(int((hits[name] & features['has_profile'].to_numpy()).sum()))
+            else:
+                hits[name] = np.array([self._score(transaction, [rule]).rule_stats.get(name, 0)
+                                       for transaction in transactions], dtype=bool)
+
+        results = []
+        for i, has_profile in enumerate(features['has_profile'].to_numpy()):
+            rule_stats = {name: int(hit[i]) for name, hit in hits.items()} if has_profile else {}
+            results.append(FraudDetectionResult(
+                is_fraud=any(rule_stats.values()),
+                rule_stats=rule_stats
+            ))
+        return results
+
+    def _transaction_frame(self, transaction: Transaction) -> pd.DataFrame:
+        """
+        Build the one-row frame used by rules that only implement the DataFrame path.
+        Args:
+            transaction: Transaction
+        Returns:
+            pd.DataFrame: pd.DataFrame
+        """
+        return pd.DataFrame({
+            'userId': [transaction.user_id],
+            'timestamp': [pd.to_datetime(transaction.timestamp)],
+            'merchantName': [transaction.merchant_name],
+            'amount': [transaction.amount],
+            FLAGS_COLUMN: np.zeros(1, dtype=FLAGS_DTYPE),
+            LEGACY_SUSPICIOUS_COLUMN: [False],
+            LEGACY_REASONS_COLUMN: [""]
+        })
@@ -0,0 +1,481 @@
+import ast
+import functools
+import json
+import operator
+import os
+import string
+import threading
+from typing import Any, Callable, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import RuleConfig, active_config
+from app.models.model import RuleSetSpec, RuleSpec, Transaction
+from app.protocol import Rule
+from app.sevices.profiles import UserProfile
+from app.sevices.rules.rules import FLAGS_DTYPE, _flag, hour_distance, parse_timestamp
+
+try:
+    import yaml
+except ImportError:  # Optional, installed with the "yaml" extra.
+    yaml = None
+
+# Bits of the flags column left free by the built-in rules.
+FIRST_DECLARATIVE_BIT = 6
+MAX_DECLARATIVE_RULES = np.iinfo(FLAGS_DTYPE).bits - FIRST_DECLARATIVE_BIT
+
+
+def _merchant_stats(transaction: Transaction, profile: UserProfile) -> Tuple[int, float, float]:
+    stats = profile.merchant(transaction.merchant_name)
+    return (0, np.nan, np.nan) if stats is None else stats
+
+
+def _zscore(amount, mean, std):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(std > 0, np.abs(amount - mean) / std, np.nan)
+
+
+# Field name -> (batch getter of transactions and features, scalar getter of transaction and profile).
+FIELDS: Dict[str, Tuple[Callable, Callable]] = {
+    'amount': (lambda t, f: t['amount'].to_numpy(np.float64),
+               lambda t, p: np.float64(t.amount)),
+    'hour': (lambda t, f: t['timestamp'].dt.hour.to_numpy(np.int64),
+             lambda t, p: np.int64(parse_timestamp(t.timestamp).hour)),
+    'merchant': (lambda t, f: t['merchantName'].to_numpy(),
+                 lambda t, p: t.merchant_name),
+    'user_id': (lambda t, f: t['userId'].to_numpy(np.int64),
+                lambda t, p: np.int64(t.user_id)),
+    'transaction_count': (lambda t, f: f['transaction_count'].fillna(0).to_numpy(np.int64),
+                          lambda t, p: np.int64(p.transaction_count)),
+    'amount_mean': (lambda t, f: f['amount_mean'].to_numpy(np.float64),
+                    lambda t, p: np.float64(p.amount_mean)),
+    'amount_std': (lambda t, f: f['amount_std'].to_numpy(np.float64),
+                   lambda t, p: np.float64(p.amount_std)),
+    'amount_zscore': (lambda t, f: _zscore(t['amount'].to_numpy(np.float64), f['amount_mean'].to_numpy(np.float64),
+                                           f['amount_std'].to_numpy(np.float64)),
+                      lambda t, p: np.float64(_zscore(t.amount, p.amount_mean, p.amount_std))),
+    'hour_distance': (lambda t, f: hour_distance(t['timestamp'].dt.hour.to_numpy(np.int64),
+                                                 f['hour_mask'].to_numpy(np.int64)),
+                      lambda t, p: hour_distance(np.array([parse_timestamp(t.timestamp).hour]),
+                                                 np.array([p.hour_mask], dtype=np.int64))[0]),
+    'merchant_count': (lambda t, f: f['merchant_count'].to_numpy(np.int64),
+                       lambda t, p: np.int64(_merchant_stats(t, p)[0])),
+    'merchant_amount_mean': (lambda t, f: f['merchant_amount_mean'].to_numpy(np.float64),
+                             lambda t, p: np.float64(_merchant_stats(t, p)[1])),
+    'merchant_amount_std': (lambda t, f: f['merchant_amount_std'].to_numpy(np.float64),
+                            lambda t, p: np.float64(_merchant_stats(t, p)[2])),
+}
+
+# Transaction fields a flag reason can be formatted with.
+REASON_FIELDS = ('amount', 'hour', 'merchant', 'user_id', 'timestamp')
+
+THRESHOLDS = tuple(RuleConfig.__annotations__)
+
+_COMPARISONS = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+                ast.Eq: operator.eq, ast.NotEq: operator.ne}
+_ARITHMETIC = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+               ast.Mod: operator.mod}
+_FUNCTIONS = {'abs': np.abs, 'min': np.minimum, 'max': np.maximum}
+
+# A compiled node: (batch evaluator, scalar evaluator), both taking the field values by name.
+_Node = Tuple[Callable[[Dict[str, Any]], Any], Callable[[Dict[str, Any]], Any]]
+
+
+class CompiledCondition:
+    """
+    A rule condition compiled into a vectorized and a scalar evaluator.
+    The batch evaluator combines whole columns with numpy, `and`, `or` and `not` becoming
+    elementwise operations; the scalar evaluator works on one transaction's values and short
+    circuits. Both compare missing (NaN) values as false, as the built-in rules do.
+    """
+
+    def __init__(self, expression: str, fields: FrozenSet[str], batch: Callable, scalar: Callable):
+        self.expression = expression
+        self.fields = fields
+        self.batch = batch
+        self.scalar = scalar
+
+    def evaluate_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> np.ndarray:
+        """
+        Args:
+            transactions: pd.DataFrame
+            features: pd.DataFrame of profile columns aligned with transactions
+        Returns:
+            np.ndarray: boolean array, True where the condition holds
+        """
+        values = {name: FIELDS[name][0](transactions, features) for name in self.fields}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = self.batch(values)
+        return np.broadcast_to(np.asarray(result, dtype=bool), (len(transactions),)).copy()
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+        Args:
+            transaction: Transaction
+            profile: UserProfile of the transaction's user
+        Returns:
+            bool: True if the condition holds
+        """
+        values = {name: FIELDS[name][1](transaction, profile) for name in self.fields}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return bool(self.scalar(values))
+
+
+class _Compiler:
+    """Turns the AST of a condition into evaluator closures, accepting only the DSL's syntax."""
+
+    def __init__(self, params: Dict[str, Any]):
+        self.params = params
+        self.fields = set()
+
+    def compile(self, node: ast.AST) -> _Node:
+        if isinstance(node, ast.Expression):
+            return self.compile(node.body)
+        if isinstance(node, ast.BoolOp):
+            parts = [self.compile(value) for value in node.values]
+            batches = [batch for batch, _ in parts]
+            scalars = [scalar for _, scalar in parts]
+            if isinstance(node.op, ast.And):
+                return (lambda env: functools.reduce(np.logical_and, [batch(env) for batch in batches]),
+                        lambda env: all(scalar(env) for scalar in scalars))
+            return (lambda env: functools.reduce(np.logical_or, [batch(env) for batch in batches]),
+                    lambda env: any(scalar(env) for scalar in scalars))
+        if isinstance(node, ast.UnaryOp):
+            batch, scalar = self.compile(node.operand)
+            if isinstance(node.op, ast.Not):
+                return lambda env: np.logical_not(batch(env)), lambda env: not scalar(env)
+            if isinstance(node.op, ast.USub):
+                return lambda env: -batch(env), lambda env: -scalar(env)
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            op = _ARITHMETIC[type(node.op)]
+            (left, left_scalar), (right, right_scalar) = self.compile(node.left), self.compile(node.right)
+            return (lambda env: op(left(env), right(env)),
+                    lambda env: op(left_scalar(env), right_scalar(env)))
+        if isinstance(node, ast.Compare):
+            return self._compare(node)
+        if isinstance(node, ast.Call):
+            if (not isinstance(node.func, ast.Name) or node.func.id not in _FUNCTIONS or node.keywords
+                    or not node.args):
+                raise ValueError(f"Unsupported call in condition, available functions: {sorted(_FUNCTIONS)}")
+            function = _FUNCTIONS[node.func.id]
+            args = [self.compile(arg) for arg in node.args]
+            combine = (lambda values: function(*values)) if len(args) <= 2 else (
+                lambda values: functools.reduce(function, values))
+            return (lambda env: combine([batch(env) for batch, _ in args]),
+                    lambda env: combine([scalar(env) for _, scalar in args]))
+        if isinstance(node, ast.Name):
+            return self._name(node.id)
+        if isinstance(node, ast.Constant) and isinstance(node.value, (bool, int, float, str)):
+            value = node.value
+            return lambda env: value, lambda env: value
+        raise ValueError(f"Unsupported syntax in condition: {type(node).__name__}")
+
+    def _name(self, name: str) -> _Node:
+        if name in FIELDS:
+            self.fields.add(name)
+            return lambda env: env[name], lambda env: env[name]
+        if name in self.params:
+            value = self.params[name]
+            return lambda env: value, lambda env: value
+        if name in THRESHOLDS:
+            # Read when evaluated, so a threshold reload applies to compiled conditions too.
+            return lambda env: getattr(active_config(), name), lambda env: getattr(active_config(), name)
+        raise ValueError(f"Unknown name in condition: {name!r}")
+
+    def _compare(self, node: ast.Compare) -> _Node:
+        operands = [self.compile(node.left)]
+        comparisons = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if isinstance(op, (ast.In, ast.NotIn)):
+                values = self._literal_values(comparator)
+                negate = isinstance(op, ast.NotIn)
+                comparisons.append((
+                    lambda left, right, values=values, negate=negate: np.isin(left, values, invert=negate),
+                    lambda left, right, values=frozenset(values), negate=negate: (left in values) != negate,
+                ))
+                operands.append((lambda env: None, lambda env: None))
+            elif type(op) in _COMPARISONS:
+                compare = _COMPARISONS[type(op)]
+                comparisons.append((compare, compare))
+                operands.append(self.compile(comparator))
+            else:
+                raise ValueError(f"Unsupported comparison in condition: {type(op).__name__}")
+
+        def batch(env):
+            values = [operand(env) for operand, _ in operands]
+            return functools.reduce(np.logical_and, [compare(values[i], values[i + 1])
+                                                     for i, (compare, _) in enumerate(comparisons)])
+
+        def scalar(env):
+            left = operands[0][1](env)
+            for (_, compare), (_, right) in zip(comparisons, operands[1:]):
+                right = right(env)
+                if not compare(left, right):
+                    return False
+                left = right
+            return True
+
+        return batch, scalar
+
+    def _literal_values(self, node: ast.AST) -> list:
+        if isinstance(node, ast.Name) and isinstance(self.params.get(node.id), (list, tuple)):
+            return list(self.params[node.id])
+        if isinstance(node, (ast.List, ast.Tuple, ast.Set)) and all(
+                isinstance(element, ast.Constant) for element in node.elts):
+            return [element.value for element in node.elts]
+        raise ValueError("`in` takes a list of constants or a list parameter")
+
+
+@functools.lru_cache(maxsize=256)
+def compile_condition(expression: str, params: Tuple[Tuple[str, Any], ...] = ()) -> CompiledCondition:
+    """
+    Compile a rule condition, or return the cached compilation of the same condition and params.
+    Conditions are Python expressions restricted to comparisons, `in` against a list, arithmetic,
+    `and`, `or`, `not`, abs, min and max, over the names in FIELDS, the params and the
+    RuleConfig thresholds.
+    Args:
+        expression: the condition, e.g. "merchant_count == 0 and amount > factor * amount_mean"
+        params: (name, value) pairs of the constants the condition refers to, list values as tuples
+    Returns:
+        CompiledCondition: CompiledCondition
+    Raises:
+        ValueError: if the condition is not valid in the DSL
+    """
+    try:
+        tree = ast.parse(expression, mode='eval')
+    except SyntaxError as e:
+        raise ValueError(f"Invalid condition {expression!r}: {e.msg}") from None
+    compiler = _Compiler(dict(params))
+    batch, scalar = compiler.compile(tree)
+    return CompiledCondition(expression, frozenset(compiler.fields), batch, scalar)
+
+
+class DeclarativeRule:
+    """
+    A rule compiled from a RuleSpec. Each spec gets its own subclass named after it, so its
+    statistics are keyed by the spec's name like those of the built-in rules.
+    """
+    flag = 0
+    label = ""
+
+    def __init__(self, spec: RuleSpec, flag: int):
+        """
+            Args:
+                spec: RuleSpec
+                flag: bit of the flags column the rule sets
+        """
+        self.spec = spec
+        self.flag = flag
+        self.label = spec.label or spec.name
+        params = tuple(sorted((name, tuple(value) if isinstance(value, list) else value)
+                              for name, value in spec.params.items()))
+        self.condition = compile_condition(spec.condition, params)
+        self.reason = spec.reason or self.label
+        unknown = {field for _, field, _, _ in string.Formatter().parse(self.reason) if field} - set(
+            REASON_FIELDS) - set(spec.params)
+        if unknown:
+            raise ValueError(f"Unknown fields in the reason of {spec.name}: {sorted(unknown)}")
+
+    def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                user_profiles: ProfileStore of the users
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        return self.apply_batch(transactions, user_profiles.join(transactions))
+
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                features: pd.DataFrame of profile columns aligned with transactions
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        flagged = features['has_profile'].to_numpy() & self.condition.evaluate_batch(transactions, features)
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        columns = {
+            'amount': transactions['amount'].to_numpy()[mask],
+            'hour': transactions['timestamp'].dt.hour.to_numpy()[mask],
+            'merchant': transactions['merchantName'].to_numpy()[mask],
+            'user_id': transactions['userId'].to_numpy()[mask],
+            'timestamp': transactions['timestamp'].to_numpy()[mask],
+        }
+        return [self.reason.format(**self.spec.params, **dict(zip(columns, row))) for row in zip(*columns.values())]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        return self.condition.evaluate(transaction, profile)
+
+    def __reduce__(self):
+        # The subclass only exists at runtime, so worker processes rebuild the rule from its spec.
+        return declarative_rule, (self.spec, self.flag)
+
+
+@functools.lru_cache(maxsize=None)
+def _rule_class(name: str) -> type:
+    return type(name, (DeclarativeRule,), {'__doc__': f"Declarative rule {name}."})
+
+
+def declarative_rule(spec: RuleSpec, flag: int) -> DeclarativeRule:
+    """
+    Args:
+        spec: RuleSpec
+        flag: bit of the flags column the rule sets
+    Returns:
+        DeclarativeRule: instance of the spec's own DeclarativeRule subclass
+    """
+    if not spec.name.isidentifier():
+        raise ValueError(f"Rule name {spec.name!r} is not an identifier")
+    return _rule_class(spec.name)(spec, flag)
+
+
+def compile_rules(specs: List[RuleSpec], reserved: Optional[List[str]] = None) -> List[DeclarativeRule]:
+    """
+    Args:
+        specs: RuleSpecs, given the free flag bits in order
+        reserved: names already taken, e.g. by the built-in rules
+    Returns:
+        List[DeclarativeRule]: one rule per spec
+    Raises:
+        ValueError: if a spec is invalid, names repeat, params shadow fields or there are more specs
+            than free flag bits
+    """
+    if len(specs) > MAX_DECLARATIVE_RULES:
+        raise ValueError(f"At most {MAX_DECLARATIVE_RULES} declarative rules fit in the flags column")
+    names = [spec.name for spec in specs] + list(reserved or [])
+    if len(set(names)) != len(names):
+        raise ValueError("Rule names must be unique")
+    for spec in specs:
+        # A param named like a field would hide it in the condition and clash with it in the reason.
+        shadowing = set(spec.params) & (set(FIELDS) | set(REASON_FIELDS))
+        if shadowing:
+            raise ValueError(f"Params of {spec.name} shadow transaction or profile fields: {sorted(shadowing)}")
+    return [declarative_rule(spec, 1 << (FIRST_DECLARATIVE_BIT + i)) for i, spec in enumerate(specs)]
+
+
+def parse_rule_set(body: bytes, content_type: str = "application/json") -> RuleSetSpec:
+    """
+    Args:
+        body: a JSON or YAML rule set
+        content_type: content type of the body, YAML if it contains "yaml"
+    Returns:
+        RuleSetSpec: RuleSetSpec
+    Raises:
+        pydantic.ValidationError: if the rule set does not match RuleSetSpec
+    """
+    if "yaml" in content_type:
+        if yaml is None:
+            raise ImportError("YAML rule sets need PyYAML, install it with `poetry install --extras yaml`")
+        try:
+            spec = yaml.safe_load(body)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid YAML rule set: {e}") from None
+        return RuleSetSpec.model_validate(spec or {})
+    return RuleSetSpec.model_validate(json.loads(body))
+
+
+def load_rule_set(path: str) -> RuleSetSpec:
+    """
+    Args:
+        path: .json, .yaml or .yml rule set file
+    Returns:
+        RuleSetSpec: RuleSetSpec
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        return parse_rule_set(f.read(), "application/yaml" if extension in ('.yaml', '.yml') else "application/json")
+
+
+class RuleSetRegistry:
+    """
+    The rules and thresholds currently scored with.
+
+    A reload compiles and validates the whole rule set before anything changes, so an invalid
+    rule set leaves the current one in place. The new thresholds are then written to the
+    RuleConfig in a single dict update and the rule lists replaced by single reference
+    assignments. Requests already scoring keep the rule list they started with and are not
+    interrupted. Results cached for resubmissions were scored with the old rules, so they are
+    dropped.
+    """
+
+    def __init__(self, batch_rules: List[Rule], runtime_rules: List[Rule], rule_config: RuleConfig):
+        """
+        Args:
+            batch_rules: built-in rules for analyze_data
+            runtime_rules: built-in rules for the online checks, with their online state
+            rule_config: the RuleConfig the rules read their thresholds from
+        """
+        self.builtin_batch = list(batch_rules)
+        self.builtin_runtime = list(runtime_rules)
+        self.rule_config = rule_config
+        self.base_thresholds = {name: getattr(rule_config, name) for name in THRESHOLDS}
+        self.batch = list(batch_rules)
+        self.runtime = list(runtime_rules)
+        self.spec = RuleSetSpec()
+        self.lock = threading.Lock()
+
+    def reload(self, spec: RuleSetSpec) -> None:
+        """
+        Replace the rule set.
+        Args:
+            spec: RuleSetSpec, thresholds it leaves out go back to their startup values
+        Raises:
+            ValueError: if the rule set is invalid
+        """
+        thresholds = dict(self.base_thresholds)
+        for name, value in spec.thresholds.items():
+            if name not in THRESHOLDS:
+                raise ValueError(f"Unknown threshold: {name}")
+            if RuleConfig.__annotations__[name] is int:
+                if not float(value).is_integer():
+                    raise ValueError(f"Threshold {name} must be an integer")
+                value = int(value)
+            thresholds[name] = value
+        builtin = [rule.__class__.__name__ for rule in self.builtin_batch]
+        unknown = set(spec.builtin or []) - set(builtin)
+        if unknown:
+            raise ValueError(f"Unknown built-in rules: {sorted(unknown)}")
+        declarative = compile_rules(spec.rules, reserved=builtin)
+        keep = set(builtin if spec.builtin is None else spec.builtin)
+        batch = [rule for rule in self.builtin_batch if rule.__class__.__name__ in keep] + declarative
+        runtime = [rule for rule in self.builtin_runtime if rule.__class__.__name__ in keep] + declarative
+        with self.lock:
+            self.rule_config.__dict__.update(thresholds)
+            self.batch = batch
+            self.runtime = runtime
+            self.spec = spec
+        for rule in self.builtin_runtime:
+            if hasattr(rule, 'clear_cached_results'):
+                rule.clear_cached_results()
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: the active thresholds, built-in rules and declarative rules
+        """
+        with self.lock:
+            return {
+                "thresholds": {name: getattr(self.rule_config, name) for name in THRESHOLDS},
+                "builtin": [rule.__class__.__name__ for rule in self.batch if not isinstance(rule, DeclarativeRule)],
+                "rules": [rule.spec.model_dump() for rule in self.batch if isinstance(rule, DeclarativeRule)],
+            }
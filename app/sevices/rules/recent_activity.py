@@ -0,0 +1,125 @@
+import numpy as np
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import List, Sequence
+
+_EMPTY = np.iinfo(np.int64).min
+_EPOCH = datetime(1970, 1, 1)
+
+
+def to_microseconds(timestamp: datetime) -> int:
+    """
+    Args:
+        timestamp: naive or timezone-aware datetime, naive ones are taken as UTC
+    Returns:
+        int: microseconds since the epoch
+    """
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - _EPOCH) // timedelta(microseconds=1)
+
+
+class RecentActivityIndex:
+    """
+    Timestamps of the most recent transactions of each user, for online velocity checks.
+
+    Every user gets a row of a preallocated array used as a ring buffer of the last `capacity`
+    timestamps, so a count touches at most `capacity` values. Users are kept in least recently
+    active order: users idle for longer than `ttl` are evicted as new events arrive, and the
+    least recently active user makes room once `max_users` is reached. Memory is therefore
+    bounded by max_users * capacity timestamps. Idleness is measured in event time, against
+    the newest timestamp recorded so far.
+
+    Counts are exact as long as capacity is at least the velocity threshold and events arrive
+    in time order.
+    """
+
+    def __init__(self, capacity: int = 32, ttl: timedelta = timedelta(hours=1), max_users: int = 100_000):
+        """
+        Args:
+            capacity: timestamps kept per user
+            ttl: idle time after which a user is evicted
+            max_users: maximum number of users tracked at once
+        """
+        self.capacity = capacity
+        self.ttl_us = ttl // timedelta(microseconds=1)
+        self.max_users = max_users
+        self.timestamps = np.full((min(max_users, 1024), capacity), _EMPTY, dtype=np.int64)
+        self.heads = np.zeros(len(self.timestamps), dtype=np.int64)
+        # userId -> row, least recently active first.
+        self.slots: "OrderedDict[int, int]" = OrderedDict()
+        self.last_seen = {}
+        self.free_slots: List[int] = list(range(len(self.timestamps) - 1, -1, -1))
+        self.latest = _EMPTY
+
+    def count(self, user_id: int, timestamp_us: int, windows_us: Sequence[int]) -> List[int]:
+        """
+        Count the recorded transactions of a user in [timestamp - window, timestamp] for each window.
+        Args:
+            user_id: user id
+            timestamp_us: timestamp in microseconds since the epoch
+            windows_us: window lengths in microseconds
+        Returns:
+            List[int]: count for each window, not including the transaction being checked
+        """
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return [0] * len(windows_us)
+        row = self.timestamps[slot]
+        before = row <= timestamp_us
+        return [int(np.count_nonzero(before & (row >= timestamp_us - window))) for window in windows_us]
+
+    def record(self, user_id: int, timestamp_us: int) -> None:
+        """
+        Add a transaction of a user, evicting idle users first.
+        Args:
+            user_id: user id
+            timestamp_us: timestamp in microseconds since the epoch
+        """
+        self.latest = max(self.latest, timestamp_us)
+        slot = self.slots.get(user_id)
+        if slot is None:
+            self._evict()
+            slot = self._allocate()
+            self.slots[user_id] = slot
+        else:
+            self.slots.move_to_end(user_id)
+        head = self.heads[slot]
+        self.timestamps[slot, head] = timestamp_us
+        self.heads[slot] = (head + 1) % self.capacity
+        self.last_seen[user_id] = max(self.last_seen.get(user_id, _EMPTY), timestamp_us)
+
+    def _evict(self) -> None:
+        """Drop idle users from the least recently active end, and one more user if still full."""
+        while self.slots:
+            user_id = next(iter(self.slots))
+            if len(self.slots) < self.max_users and self.last_seen[user_id] >= self.latest - self.ttl_us:
+                return
+            self._release(user_id)
+
+    def _release(self, user_id: int) -> None:
+        slot = self.slots.pop(user_id)
+        del self.last_seen[user_id]
+        self.timestamps[slot] = _EMPTY
+        self.heads[slot] = 0
+        self.free_slots.append(slot)
+
+    def _allocate(self) -> int:
+        if not self.free_slots:
+            size = len(self.timestamps)
+            grown = min(2 * size, self.max_users)
+            self.timestamps = np.vstack([self.timestamps,
+                                         np.full((grown - size, self.capacity), _EMPTY, dtype=np.int64)])
+            self.heads = np.concatenate([self.heads, np.zeros(grown - size, dtype=np.int64)])
+            self.free_slots = list(range(grown - 1, size - 1, -1))
+        return self.free_slots.pop()
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def nbytes(self) -> int:
+        """
+        Returns:
+            int: bytes held by the timestamp buffers
+        """
+        return self.timestamps.nbytes + self.heads.nbytes
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from app.models.model import FraudDetectionResult
+
+_EMPTY = -(1 << 63)
+
+
+class ReplayIndex:
+    """
+    Fingerprints of recently scored transactions, for online replay detection.
+
+    Two hash indexes are kept: one keyed by (user, timestamp, amount), to flag a transaction
+    replayed at any merchant, and one keyed by (user, timestamp, merchant, amount), holding the
+    result of an exact resubmission so it is answered without running the rules again. Both
+    are dicts keyed by the tuple of the fields, so lookups and inserts are O(1). Entries are
+    kept in insertion order and expire once their timestamp is more than `ttl` older than the
+    newest one recorded, or when `max_entries` is reached.
+    """
+
+    def __init__(self, ttl: timedelta = timedelta(hours=1), max_entries: int = 100_000):
+        """
+        Args:
+            ttl: how far back, in event time, replays are detected
+            max_entries: maximum number of fingerprints kept in each index
+        """
+        self.ttl_us = ttl // timedelta(microseconds=1)
+        self.max_entries = max_entries
+        # (user, timestamp, amount) -> timestamp
+        self.seen: "OrderedDict[Tuple[int, int, float], int]" = OrderedDict()
+        # (user, timestamp, merchant, amount) -> (timestamp, result)
+        self.results: "OrderedDict[Tuple[int, int, str, float], Tuple[int, FraudDetectionResult]]" = OrderedDict()
+        self.latest = _EMPTY
+        self.lock = threading.Lock()
+
+    def seen_before(self, user_id: int, timestamp_us: int, amount: float) -> bool:
+        """
+        Returns:
+            bool: True if a transaction of the user with this timestamp and amount was recorded
+        """
+        return (user_id, timestamp_us, amount) in self.seen
+
+    def record(self, user_id: int, timestamp_us: int, amount: float) -> None:
+        with self.lock:
+            self._advance(timestamp_us)
+            self.seen[(user_id, timestamp_us, amount)] = timestamp_us
+            self._expire(self.seen)
+
+    def result(self, user_id: int, timestamp_us: int, merchant: str, amount: float) -> Optional[FraudDetectionResult]:
+        """
+        Returns:
+            Optional[FraudDetectionResult]: result of an identical transaction scored before, if any
+        """
+        entry = self.results.get((user_id, timestamp_us, merchant, amount))
+        return None if entry is None else entry[1]
+
+    def store_result(self, user_id: int, timestamp_us: int, merchant: str, amount: float,
+                     result: FraudDetectionResult) -> None:
+        with self.lock:
+            self._advance(timestamp_us)
+            self.results[(user_id, timestamp_us, merchant, amount)] = (timestamp_us, result)
+            self._expire(self.results)
+
+    def clear_results(self) -> None:
+        """Forget the cached results, e.g. once the rules they were scored with change."""
+        with self.lock:
+            self.results.clear()
+
+    def clear(self) -> None:
+        """Forget every recorded transaction and cached result."""
+        with self.lock:
+            self.seen.clear()
+            self.results.clear()
+            self.latest = _EMPTY
+
+    def _advance(self, timestamp_us: int) -> None:
+        self.latest = max(self.latest, timestamp_us)
+
+    def _expire(self, index: OrderedDict) -> None:
+        """Drop the oldest entries while they are out of the window or the index is full."""
+        while index:
+            entry = next(iter(index.values()))
+            timestamp_us = entry[0] if isinstance(entry, tuple) else entry
+            if len(index) <= self.max_entries and timestamp_us >= self.latest - self.ttl_us:
+                return
+            index.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self.seen)
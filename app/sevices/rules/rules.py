@@ -1,11 +1,198 @@
+import numpy as np
 import pandas as pd
-from datetime import timedelta
-from app.config import config
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from app.config import active_config
+from app.models.model import FraudDetectionResult, Transaction
+from app.sevices.profiles import UserProfile
+from app.sevices.rules.recent_activity import RecentActivityIndex, to_microseconds
+from app.sevices.rules.replay import ReplayIndex
+from app.sevices.rules.velocity import window_counts
+
+
+FLAGS_COLUMN = 'flags'
+FLAGS_DTYPE = np.uint16
+VELOCITY_COUNT_PREFIX = 'velocity_count_'
+AMOUNT_ZSCORE_COLUMN = 'amount_zscore'
+REPLAY_OF_COLUMN = 'replay_of_merchant'
+# Written directly by rules without a flag bit, which predate the flags column.
+LEGACY_SUSPICIOUS_COLUMN = 'is_suspicious'
+LEGACY_REASONS_COLUMN = 'flag_reasons'
+
+
+def _flag(transactions: pd.DataFrame, mask: np.ndarray, flag: int) -> None:
+    """
+    Set the rule's bit in the flags column of the rows selected by a boolean mask.
+        Args:
+            transactions: pd.DataFrame
+            mask: boolean array aligned with the rows of transactions
+            flag: bit of the rule
+    """
+    if not mask.any():
+        return
+    transactions[FLAGS_COLUMN] = transactions[FLAGS_COLUMN].to_numpy() | np.where(mask, flag, 0).astype(FLAGS_DTYPE)
+
+
+def _flag_row(transactions: pd.DataFrame, index, flag: int) -> None:
+    """
+    Set the rule's bit in the flags column of a single row, for the per-row rule path.
+        Args:
+            transactions: pd.DataFrame
+            index: index label of the row
+            flag: bit of the rule
+    """
+    transactions.at[index, FLAGS_COLUMN] = transactions.at[index, FLAGS_COLUMN] | flag
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    """
+    Parse a transaction timestamp without going through pandas for ISO 8601 input.
+        Args:
+            timestamp: timestamp string
+        Returns:
+            datetime: parsed timestamp
+    """
+    try:
+        return datetime.fromisoformat(timestamp)
+    except ValueError:
+        return pd.to_datetime(timestamp).to_pydatetime()
+
+
+def suspicious_mask(transactions: pd.DataFrame) -> np.ndarray:
+    """
+    Args:
+        transactions: pd.DataFrame
+    Returns:
+        np.ndarray: boolean array, True for rows flagged by at least one rule
+    """
+    mask = transactions[FLAGS_COLUMN].to_numpy() != 0
+    if LEGACY_SUSPICIOUS_COLUMN in transactions.columns:
+        mask |= transactions[LEGACY_SUSPICIOUS_COLUMN].fillna(False).to_numpy(dtype=bool)
+    return mask
+
+
+def add_legacy_columns(transactions: pd.DataFrame) -> None:
+    """
+    Add the is_suspicious and flag_reasons columns that rules without a flag bit write to,
+    unless they are there already.
+        Args:
+            transactions: pd.DataFrame
+    """
+    if LEGACY_SUSPICIOUS_COLUMN not in transactions.columns:
+        transactions[LEGACY_SUSPICIOUS_COLUMN] = False
+    if LEGACY_REASONS_COLUMN not in transactions.columns:
+        transactions[LEGACY_REASONS_COLUMN] = ""
+
+
+def _legacy_reasons(transactions: pd.DataFrame) -> np.ndarray:
+    if LEGACY_REASONS_COLUMN not in transactions.columns:
+        return np.full(len(transactions), "", dtype=object)
+    return transactions[LEGACY_REASONS_COLUMN].fillna("").to_numpy(dtype=object)
+
+
+def flag_counts(transactions: pd.DataFrame, rules: list) -> Dict[str, int]:
+    """
+    Count the transactions flagged by each rule.
+    Rules appear in the order their first flagged transaction appears in transactions,
+    ties broken by rule order, which is the order their reasons are rendered in.
+        Args:
+            transactions: pd.DataFrame
+            rules: rules in the order they were applied
+        Returns:
+            Dict[str, int]: rule labels as keys and flagged counts as values
+    """
+    flags = transactions[FLAGS_COLUMN].to_numpy()
+    seen = []
+    for order, rule in enumerate(rules):
+        flag = getattr(rule, 'flag', 0)
+        if not flag:
+            continue
+        flagged = np.bitwise_and(flags, flag) != 0
+        count = int(flagged.sum())
+        if count:
+            seen.append((int(flagged.argmax()), order, rule.label, count))
+    # Reasons written by rules without a flag bit are counted by their "Label: ..." prefix.
+    legacy: Dict[str, list] = {}
+    for row, reason_str in enumerate(_legacy_reasons(transactions)):
+        if not reason_str:
+            continue
+        for reason in reason_str.split('; '):
+            label = reason.split(':')[0].strip()
+            first, count = legacy.get(label, (row, 0))
+            legacy[label] = [first, count + 1]
+    for order, (label, (first, count)) in enumerate(legacy.items(), start=len(rules)):
+        seen.append((first, order, label, count))
+    return {label: count for _, _, label, count in sorted(seen)}
+
+
+def render_flag_reasons(transactions: pd.DataFrame, rules: list) -> pd.Series:
+    """
+    Render the human-readable flag reasons from the flags and detail columns.
+        Args:
+            transactions: pd.DataFrame
+            rules: rules in the order they were applied
+        Returns:
+            pd.Series: "; " separated reasons per transaction, empty for unflagged ones
+    """
+    flags = transactions[FLAGS_COLUMN].to_numpy()
+    reasons = np.full(len(transactions), "", dtype=object)
+    for rule in rules:
+        flag = getattr(rule, 'flag', 0)
+        if not flag:
+            continue
+        flagged = np.bitwise_and(flags, flag) != 0
+        if not flagged.any():
+            continue
+        rendered = np.array(rule.describe(transactions, flagged), dtype=object)
+        existing = reasons[flagged]
+        reasons[flagged] = np.where(existing == "", rendered, existing + "; " + rendered)
+    legacy = _legacy_reasons(transactions)
+    written = legacy != ""
+    if written.any():
+        existing = reasons[written]
+        reasons[written] = np.where(existing == "", legacy[written], existing + "; " + legacy[written])
+    return pd.Series(reasons, index=transactions.index, dtype=object)
+
+
+def hour_distance(hours: np.ndarray, hour_masks: np.ndarray) -> np.ndarray:
+    """
+    Circular distance in hours from each hour to the closest bit set in its 24-bit mask.
+        Args:
+            hours: hour of day of each transaction
+            hour_masks: 24-bit mask of the user's active hours for each transaction
+        Returns:
+            np.ndarray: distance in [0, 12], or 24 where the mask is empty
+    """
+    distance = np.full(len(hours), 24, dtype=np.int64)
+    for offset in range(12, -1, -1):
+        later = (hour_masks >> ((hours + offset) % 24)) & 1
+        earlier = (hour_masks >> ((hours - offset) % 24)) & 1
+        distance[(later | earlier).astype(bool)] = offset
+    return distance
 
 class VelocityCheckRule:
     """
     Rule 1: Flag users with too many transactions in a short time period.
     """
+    flag = 1 << 0
+    label = "Velocity"
+
+    def __init__(self, windows: Optional[List[Tuple[int, int]]] = None,
+                 recent_activity: Optional[RecentActivityIndex] = None):
+        """
+            Args:
+                windows: (window_minutes, threshold_count) pairs evaluated in the same pass.
+                    Defaults to the single window from the config.
+                recent_activity: recent transactions of each user, needed by evaluate and record
+        """
+        self.windows = windows
+        self.recent_activity = recent_activity
+
+    def _windows(self) -> List[Tuple[int, int]]:
+        if self.windows:
+            return self.windows
+        rule_config = active_config()
+        return [(rule_config.velocity_window_minutes, rule_config.velocity_threshold_count)]
 
     def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
         """
@@ -15,33 +202,69 @@ class VelocityCheckRule:
             Returns:
                 int: Number of transactions flagged by this rule
         """
-        window = timedelta(minutes=config.velocity_window_minutes)
-        threshold = config.velocity_threshold_count
-        flagged_count = 0
-        for userId, user_data in transactions.groupby('userId'):
-            user_txns = user_data.sort_values('timestamp')    
-            for i, current_txn in user_txns.iterrows():
-                current_time = current_txn['timestamp']
-                
-                window_start = current_time - window
-                txns_in_window = user_txns[(user_txns['timestamp'] >= window_start) & 
-                                          (user_txns['timestamp'] <= current_time)]
-                count_in_window = len(txns_in_window)
-                
-                if count_in_window >= threshold:
-                    transactions.at[i, 'is_suspicious'] = True
-                    reason = f"Velocity: {count_in_window} txns in {config.velocity_window_minutes} mins"
-                    if transactions.at[i, 'flag_reasons']:
-                        transactions.at[i, 'flag_reasons'] += "; " + reason
-                    else:
-                        transactions.at[i, 'flag_reasons'] = reason
-                    flagged_count += 1
-        return flagged_count
+        windows = self._windows()
+        counts = window_counts(transactions['userId'].to_numpy(),
+                               transactions['timestamp'].to_numpy(),
+                               [timedelta(minutes=minutes) for minutes, _ in windows])
+        flagged = np.zeros(len(transactions), dtype=bool)
+        for (minutes, threshold), count_in_window in zip(windows, counts):
+            over_threshold = count_in_window >= threshold
+            transactions[f"{VELOCITY_COUNT_PREFIX}{minutes}m"] = np.where(over_threshold, count_in_window, 0).astype(np.int32)
+            flagged |= over_threshold
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        reasons = [[] for _ in range(int(mask.sum()))]
+        for column in transactions.columns:
+            if not str(column).startswith(VELOCITY_COUNT_PREFIX):
+                continue
+            minutes = column[len(VELOCITY_COUNT_PREFIX):-1]
+            for reason, count in zip(reasons, transactions[column].to_numpy()[mask]):
+                if count:
+                    reason.append(f"Velocity: {count} txns in {minutes} mins")
+        return ["; ".join(reason) for reason in reasons]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Count the user's recorded transactions in each window, plus this one.
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        if self.recent_activity is None:
+            raise ValueError("VelocityCheckRule needs a RecentActivityIndex to evaluate single transactions")
+        windows = self._windows()
+        counts = self.recent_activity.count(transaction.user_id,
+                                            to_microseconds(parse_timestamp(transaction.timestamp)),
+                                            [minutes * 60_000_000 for minutes, _ in windows])
+        return any(count + 1 >= threshold for count, (_, threshold) in zip(counts, windows))
+
+    def record(self, transaction: Transaction) -> None:
+        """
+            Remember a scored transaction for the velocity checks of the user's next transactions.
+            Args:
+                transaction: Transaction
+        """
+        if self.recent_activity is not None:
+            self.recent_activity.record(transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)))
 
 class TimeAnomalyRule:
     """
     Rule 2: Flag transactions occurring at unusual hours for the user.
     """
+    flag = 1 << 1
+    label = "Time anomaly"
+
     def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
         """
             Args:
@@ -63,7 +286,7 @@ class TimeAnomalyRule:
             
             if active_hours and txn_hour not in active_hours:
                 is_unusual = True
-                tolerance = config.time_anomaly_hour_tolerance
+                tolerance = active_config().time_anomaly_hour_tolerance
                 
                 for common_hour in active_hours.keys():
                     hour_diff = min(abs(txn_hour - common_hour), 
@@ -73,20 +296,61 @@ class TimeAnomalyRule:
                         break
                 
                 if is_unusual:
-                    transactions.at[i, 'is_suspicious'] = True
-                    reason = f"Time anomaly: Unusual hour {txn_hour}"
-                    if transactions.at[i, 'flag_reasons']:
-                        transactions.at[i, 'flag_reasons'] += "; " + reason
-                    else:
-                        transactions.at[i, 'flag_reasons'] = reason
+                    _flag_row(transactions, i, self.flag)
                     flagged_count += 1
         
         return flagged_count
 
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                features: pd.DataFrame of profile columns aligned with transactions
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        hours = transactions['timestamp'].dt.hour.to_numpy()
+        hour_mask = features['hour_mask'].to_numpy()
+        distance = hour_distance(hours, hour_mask)
+        flagged = (features['has_profile'].to_numpy() & (hour_mask != 0)
+                   & (distance > active_config().time_anomaly_hour_tolerance))
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        return [f"Time anomaly: Unusual hour {hour}" for hour in transactions.loc[mask, 'timestamp'].dt.hour]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        hour_mask = profile.hour_mask
+        if not hour_mask:
+            return False
+        hour = parse_timestamp(transaction.timestamp).hour
+        for offset in range(min(active_config().time_anomaly_hour_tolerance, 12) + 1):
+            if (hour_mask >> ((hour + offset) % 24)) & 1 or (hour_mask >> ((hour - offset) % 24)) & 1:
+                return False
+        return True
+
 class MerchantAnomalyRule:
     """
     Rule 3: Flag transactions with merchants the user hasn't used before.
     """
+    flag = 1 << 2
+    label = "Merchant anomaly"
+
     def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
         """
             Args:
@@ -109,22 +373,57 @@ class MerchantAnomalyRule:
             common_merchants = user_profile['common_merchants']
             
             if merchant not in common_merchants:
-                risk_score = config.merchant_anomaly_risk_threshold
+                risk_score = active_config().merchant_anomaly_risk_threshold
                 if risk_score > 0.3:
-                    transactions.at[i, 'is_suspicious'] = True
-                    reason = f"Merchant anomaly: New merchant {merchant}"
-                    if transactions.at[i, 'flag_reasons']:
-                        transactions.at[i, 'flag_reasons'] += "; " + reason
-                    else:
-                        transactions.at[i, 'flag_reasons'] = reason
+                    _flag_row(transactions, i, self.flag)
                     flagged_count += 1
         
         return flagged_count
 
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                features: pd.DataFrame of profile columns aligned with transactions
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        if active_config().merchant_anomaly_risk_threshold <= 0.3:
+            return 0
+        flagged = features['has_profile'].to_numpy() & (features['merchant_count'].to_numpy() < 2)
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        return [f"Merchant anomaly: New merchant {merchant}" for merchant in transactions['merchantName'].to_numpy()[mask]]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        if active_config().merchant_anomaly_risk_threshold <= 0.3:
+            return False
+        stats = profile.merchant(transaction.merchant_name)
+        return stats is None or stats[0] < 2
+
 class AmountDeviationRule:
     """
     Rule 4: Flag transactions with amount significantly deviating from user pattern.
     """
+    flag = 1 << 3
+    label = "Amount anomaly"
+
     def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
         """
             Args:
@@ -149,22 +448,64 @@ class AmountDeviationRule:
             
             if amount_std > 0:
                 z_score = abs(amount - amount_mean) / amount_std
-                if z_score > config.amount_deviation_std_threshold:
-                    transactions.at[i, 'is_suspicious'] = True
-                    reason = f"Amount anomaly: ${amount} (z-score: {z_score:.2f})"
-                    if transactions.at[i, 'flag_reasons']:
-                        transactions.at[i, 'flag_reasons'] += "; " + reason
-                    else:
-                        transactions.at[i, 'flag_reasons'] = reason
+                transactions.at[i, AMOUNT_ZSCORE_COLUMN] = z_score
+                if z_score > active_config().amount_deviation_std_threshold:
+                    _flag_row(transactions, i, self.flag)
                     flagged_count += 1
         
         return flagged_count
 
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                features: pd.DataFrame of profile columns aligned with transactions
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        amounts = transactions['amount'].to_numpy()
+        amount_std = features['amount_std'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_scores = np.abs(amounts - features['amount_mean'].to_numpy()) / amount_std
+        scored = features['has_profile'].to_numpy() & (amount_std > 0)
+        transactions[AMOUNT_ZSCORE_COLUMN] = np.where(scored, z_scores, np.nan)
+        flagged = scored & (z_scores > active_config().amount_deviation_std_threshold)
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        amounts = transactions['amount'].to_numpy()[mask]
+        z_scores = transactions[AMOUNT_ZSCORE_COLUMN].to_numpy()[mask]
+        return [f"Amount anomaly: ${amount} (z-score: {z_score:.2f})" for amount, z_score in zip(amounts, z_scores)]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        amount_std = profile.amount_std
+        if not amount_std > 0:
+            return False
+        return (abs(transaction.amount - profile.amount_mean) / amount_std
+                > active_config().amount_deviation_std_threshold)
 
 class UnusualMerchantActivityRule:
     """
     Rule 5: Flag transactions where a user has a sudden increase in spending at a specific merchant or category compared to their historical spending patterns.
     """
+    flag = 1 << 4
+    label = "Unusual merchant activity"
+
     def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
         """
             Args:
@@ -193,12 +534,170 @@ class UnusualMerchantActivityRule:
             historical_amount_mean = merchant_wise_amount_mean[merchant]
             historical_amount_std = merchant_wise_amount_std[merchant]
 
-            if amount > historical_amount_mean + config.unusual_merchant_activity_threshold * historical_amount_std:
-                transactions.at[i, 'is_suspicious'] = True
-                reason = f"Unusual merchant activity: ${amount} at {merchant}"
-                if transactions.at[i, 'flag_reasons']:
-                    transactions.at[i, 'flag_reasons'] += "; " + reason
-                else:
-                    transactions.at[i, 'flag_reasons'] = reason
+            threshold = active_config().unusual_merchant_activity_threshold
+            if amount > historical_amount_mean + threshold * historical_amount_std:
+                _flag_row(transactions, i, self.flag)
                 flagged_count += 1
         return flagged_count
+
+    def apply_batch(self, transactions: pd.DataFrame, features: pd.DataFrame) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                features: pd.DataFrame of profile columns aligned with transactions
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        amounts = transactions['amount'].to_numpy()
+        limit = (features['merchant_amount_mean'].to_numpy()
+                 + active_config().unusual_merchant_activity_threshold * features['merchant_amount_std'].to_numpy())
+        flagged = features['has_profile'].to_numpy() & (features['merchant_count'].to_numpy() > 0) & (amounts > limit)
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        amounts = transactions['amount'].to_numpy()[mask]
+        merchants = transactions['merchantName'].to_numpy()[mask]
+        return [f"Unusual merchant activity: ${amount} at {merchant}" for amount, merchant in zip(amounts, merchants)]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        stats = profile.merchant(transaction.merchant_name)
+        if stats is None:
+            return False
+        _, historical_amount_mean, historical_amount_std = stats
+        threshold = active_config().unusual_merchant_activity_threshold
+        return transaction.amount > historical_amount_mean + threshold * historical_amount_std
+
+class ReplayCheckRule:
+    """
+    Rule 6: Flag transactions that repeat the user, timestamp and amount of an earlier one,
+    at the same merchant (a resubmission) or at another (a replay).
+    """
+    flag = 1 << 5
+    label = "Replay"
+
+    def __init__(self, replays: Optional[ReplayIndex] = None):
+        """
+            Args:
+                replays: fingerprints of recently scored transactions, needed by evaluate, record
+                    and the cached results
+        """
+        self.replays = replays
+
+    def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
+        """
+            Args:
+                transactions: pd.DataFrame
+                user_profiles: dict
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        return self.apply_batch(transactions, None)
+
+    def apply_batch(self, transactions: pd.DataFrame, features: Optional[pd.DataFrame]) -> int:
+        """
+            Hash (userId, timestamp, amount) of every row and flag all but the earliest row,
+            in input order, of each group of equal fields. Rows sharing a hash are sorted by
+            their fields as well, so a hash collision between different fields is not flagged.
+            Args:
+                transactions: pd.DataFrame
+                features: not used, replays do not depend on the profiles
+            Returns:
+                int: Number of transactions flagged by this rule
+        """
+        n = len(transactions)
+        fields = [transactions[column].to_numpy() for column in ('userId', 'timestamp', 'amount')]
+        keys = pd.util.hash_pandas_object(transactions[['userId', 'timestamp', 'amount']], index=False).to_numpy()
+        order = np.lexsort((transactions.index.to_numpy(), *reversed(fields), keys))
+        first = np.zeros(n, dtype=bool)
+        first[:1] = True
+        for column in (keys, *fields):
+            sorted_column = column[order]
+            first[1:] |= sorted_column[1:] != sorted_column[:-1]
+        original = order[np.maximum.accumulate(np.where(first, np.arange(n), 0))]
+        flagged = np.zeros(n, dtype=bool)
+        flagged[order] = ~first
+        replay_of = np.full(n, None, dtype=object)
+        replay_of[order[~first]] = transactions['merchantName'].to_numpy()[original[~first]]
+        transactions[REPLAY_OF_COLUMN] = replay_of
+        _flag(transactions, flagged, self.flag)
+        return int(flagged.sum())
+
+    def describe(self, transactions: pd.DataFrame, mask: np.ndarray) -> List[str]:
+        """
+            Args:
+                transactions: pd.DataFrame
+                mask: boolean array selecting the rows flagged by this rule
+            Returns:
+                List[str]: reason for each selected row
+        """
+        merchants = transactions['merchantName'].to_numpy()[mask]
+        originals = transactions[REPLAY_OF_COLUMN].to_numpy()[mask]
+        return ["Replay: duplicate transaction" if original == merchant
+                else f"Replay: same time and amount as at {original}"
+                for merchant, original in zip(merchants, originals)]
+
+    def evaluate(self, transaction: Transaction, profile: UserProfile) -> bool:
+        """
+            Args:
+                transaction: Transaction
+                profile: UserProfile of the transaction's user
+            Returns:
+                bool: True if the transaction is flagged by this rule
+        """
+        if self.replays is None:
+            raise ValueError("ReplayCheckRule needs a ReplayIndex to evaluate single transactions")
+        return self.replays.seen_before(transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)),
+                                        transaction.amount)
+
+    def record(self, transaction: Transaction) -> None:
+        """
+            Remember a scored transaction to flag its replays.
+            Args:
+                transaction: Transaction
+        """
+        if self.replays is not None:
+            self.replays.record(transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)),
+                                transaction.amount)
+
+    def cached_result(self, transaction: Transaction) -> Optional[FraudDetectionResult]:
+        """
+            Args:
+                transaction: Transaction
+            Returns:
+                Optional[FraudDetectionResult]: result of an identical transaction scored before
+        """
+        if self.replays is None:
+            return None
+        return self.replays.result(transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)),
+                                   transaction.merchant_name, transaction.amount)
+
+    def cache_result(self, transaction: Transaction, result: FraudDetectionResult) -> None:
+        """
+            Keep the result of a scored transaction for identical resubmissions.
+            Args:
+                transaction: Transaction
+                result: FraudDetectionResult
+        """
+        if self.replays is not None:
+            self.replays.store_result(transaction.user_id, to_microseconds(parse_timestamp(transaction.timestamp)),
+                                      transaction.merchant_name, transaction.amount, result)
+
+    def clear_cached_results(self) -> None:
+        """Forget the cached results, which no longer hold once the rules or thresholds change."""
+        if self.replays is not None:
+            self.replays.clear_results()
@@ -0,0 +1,49 @@
+import numpy as np
+from datetime import timedelta
+from typing import List, Sequence
+
+_LOWER, _ROW, _UPPER = 0, 1, 2
+
+
+def window_counts(user_ids: np.ndarray, timestamps: np.ndarray, windows: Sequence[timedelta]) -> np.ndarray:
+    """
+    Count, for every transaction, the transactions of the same user in [timestamp - window, timestamp].
+
+    The rows are merged with one lower-bound query per window and one upper-bound query
+    into a single lexicographic sort on (userId, timestamp). The number of rows sorted before
+    a query is its insertion point, so every count is the difference of two insertion points.
+    That is O(n log n) for all windows at once instead of O(n²) per user.
+
+    Args:
+        user_ids: array of user ids, one per transaction
+        timestamps: array of datetime64 timestamps, one per transaction
+        windows: window lengths to count over
+    Returns:
+        np.ndarray: array of shape (len(windows), n) with the count for each window and transaction
+    """
+    users = np.asarray(user_ids)
+    ts = np.asarray(timestamps).astype('datetime64[ns]').view('int64')
+    n = len(ts)
+    windows_ns = [int(window / timedelta(microseconds=1)) * 1000 for window in windows]
+    if n == 0:
+        return np.zeros((len(windows_ns), 0), dtype=np.int64)
+
+    # Ties on (userId, timestamp) sort lower bounds before rows and upper bounds after them,
+    # which makes both ends of the window inclusive.
+    key_users = np.tile(users, len(windows_ns) + 2)
+    key_ts = np.concatenate([ts, ts] + [ts - window for window in windows_ns])
+    kind = np.concatenate([np.full(n, _ROW, dtype=np.int8), np.full(n, _UPPER, dtype=np.int8)]
+                          + [np.full(n, _LOWER, dtype=np.int8)] * len(windows_ns))
+    order = np.lexsort((kind, key_ts, key_users))
+
+    is_row = kind[order] == _ROW
+    rows_before = np.cumsum(is_row) - is_row
+    insertion_point = np.empty(len(order), dtype=np.int64)
+    insertion_point[order] = rows_before
+
+    upper = insertion_point[n:2 * n]
+    counts: List[np.ndarray] = []
+    for i in range(len(windows_ns)):
+        lower = insertion_point[(i + 2) * n:(i + 3) * n]
+        counts.append(upper - lower)
+    return np.vstack(counts)
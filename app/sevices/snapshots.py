@@ -0,0 +1,94 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from app.sevices.profiles import ProfileStore
+
+SNAPSHOT_MAGIC = b"TMSPROF\0"
+SNAPSHOT_VERSION = 1
+# Magic, format version and header length, followed by the JSON header and the array data.
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGNMENT = 64
+SNAPSHOT_ARRAYS = ProfileStore.USER_ARRAYS + ProfileStore.MERCHANT_ARRAYS + ('merchant_indptr',)
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def write_snapshot(store: ProfileStore, path: str) -> None:
+    """
+    Write the profiles to a binary snapshot file.
+    The users are written sorted by id, so a loaded snapshot finds them by binary search.
+    The file is written next to its destination and renamed over it, so readers only ever
+    see a complete snapshot.
+    Args:
+        store: ProfileStore
+        path: destination of the snapshot
+    """
+    store = store.sorted_by_user()
+    arrays = {name: np.ascontiguousarray(getattr(store, name)) for name in SNAPSHOT_ARRAYS}
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        'min_history': store.min_history,
+        'merchant_names': [str(name) for name in store.merchant_names],
+        'arrays': layout,
+    }).encode()
+    data_start = _align(_PREAMBLE.size + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)))
+            f.write(header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]['offset'])
+                f.write(array.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_snapshot(path: str) -> ProfileStore:
+    """
+    Memory-map a snapshot written by write_snapshot.
+    The arrays are copy-on-write views of the file: nothing is read until it is used, and
+    incremental updates stay private to this process.
+    Args:
+        path: path of the snapshot
+    Returns:
+        ProfileStore: ProfileStore backed by the mapped file
+    Raises:
+        ValueError: if the file is not a snapshot or has an unsupported version
+    """
+    with open(path, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, header_length = _PREAMBLE.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a profile snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported profile snapshot version {version}, expected {SNAPSHOT_VERSION}")
+    header = json.loads(bytes(buffer[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+    data_start = _align(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        count = int(np.prod(shape))
+        arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count,
+                                     offset=data_start + spec['offset']).reshape(shape)
+    return ProfileStore(merchant_names=np.array(header['merchant_names'], dtype=object),
+                        min_history=header['min_history'], **arrays)
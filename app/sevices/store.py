@@ -0,0 +1,230 @@
+from typing import Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table, cast, create_engine, delete, event,
+                        func, insert, select)
+from sqlalchemy.engine import Engine
+
+from app.models.model import Transaction
+from app.sevices.profiles import ProfileStore
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+metadata = MetaData()
+
+transactions_table = Table(
+    "transactions", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("userId", Integer, nullable=False),
+    # ISO 8601 text with a fixed width, so it sorts chronologically and the hour is characters 12-13.
+    Column("timestamp", String, nullable=False),
+    Column("merchantName", String, nullable=False),
+    Column("amount", Float, nullable=False),
+    Index("ix_transactions_user_timestamp", "userId", "timestamp"),
+)
+
+# Users with transactions that are not reflected in the aggregate tables yet.
+dirty_users_table = Table(
+    "dirty_users", metadata,
+    Column("userId", Integer, primary_key=True),
+)
+
+user_amounts_table = Table(
+    "user_amounts", metadata,
+    Column("userId", Integer, primary_key=True),
+    Column("count", Integer, nullable=False),
+    Column("total", Float, nullable=False),
+    Column("total_sq", Float, nullable=False),
+    Column("min_amount", Float, nullable=False),
+    Column("max_amount", Float, nullable=False),
+)
+
+user_hours_table = Table(
+    "user_hours", metadata,
+    Column("userId", Integer, primary_key=True),
+    Column("hour", Integer, primary_key=True),
+    Column("count", Integer, nullable=False),
+)
+
+user_merchants_table = Table(
+    "user_merchants", metadata,
+    Column("userId", Integer, primary_key=True),
+    Column("merchantName", String, primary_key=True),
+    Column("count", Integer, nullable=False),
+    Column("total", Float, nullable=False),
+    Column("total_sq", Float, nullable=False),
+)
+
+_INSERT_TRANSACTIONS = 'INSERT INTO transactions ("userId", "timestamp", "merchantName", amount) VALUES (?, ?, ?, ?)'
+_MARK_DIRTY = 'INSERT OR IGNORE INTO dirty_users ("userId") VALUES (?)'
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    # WAL lets report jobs read while transactions are being ingested.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+class TransactionStore:
+    """
+    Transactions persisted in a SQLite database, with profile aggregates maintained in SQL.
+
+    Ingestion marks the users it touches as dirty. refresh_profiles() recomputes the count, sum,
+    sum of squares, min and max of the amounts and the hour and merchant histograms of the dirty
+    users only, with grouped queries that use the (userId, timestamp) index, and load_profiles()
+    turns the aggregate tables into a ProfileStore without reading any transaction.
+    """
+
+    def __init__(self, url: str, pool_size: int = 5, batch_size: int = 50_000):
+        """
+        Args:
+            url: SQLAlchemy database URL, e.g. sqlite:///./app/data/transactions.db
+            pool_size: connections kept open in the pool
+            batch_size: rows per executemany call when ingesting
+        """
+        self.engine: Engine = create_engine(url, pool_size=pool_size, max_overflow=pool_size)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _set_sqlite_pragmas)
+        self.batch_size = batch_size
+        metadata.create_all(self.engine)
+
+    def ingest(self, transactions: Union[pd.DataFrame, Iterable[Transaction]]) -> int:
+        """
+        Insert transactions with bulk executemany calls and mark their users dirty.
+        Args:
+            transactions: pd.DataFrame with the CSV columns, or Transaction models
+        Returns:
+            int: number of rows inserted
+        """
+        rows = self._rows(transactions)
+        if not rows:
+            return 0
+        with self.engine.begin() as conn:
+            for start in range(0, len(rows), self.batch_size):
+                conn.exec_driver_sql(_INSERT_TRANSACTIONS, rows[start:start + self.batch_size])
+            conn.exec_driver_sql(_MARK_DIRTY, [(user_id,) for user_id in {row[0] for row in rows}])
+        return len(rows)
+
+    def ingest_csv(self, csv_path: str, chunksize: int = 1_000_000) -> int:
+        """
+        Args:
+            csv_path: Path to the CSV file containing transaction data
+            chunksize: rows read per chunk
+        Returns:
+            int: number of rows inserted
+        """
+        return sum(self.ingest(chunk) for chunk in pd.read_csv(csv_path, chunksize=chunksize))
+
+    @staticmethod
+    def _rows(transactions: Union[pd.DataFrame, Iterable[Transaction]]) -> List[Tuple[int, str, str, float]]:
+        if not isinstance(transactions, pd.DataFrame):
+            transactions = pd.DataFrame([(t.user_id, t.timestamp, t.merchant_name, t.amount) for t in transactions],
+                                        columns=['userId', 'timestamp', 'merchantName', 'amount'])
+        timestamps = pd.to_datetime(transactions['timestamp']).dt.strftime(TIMESTAMP_FORMAT)
+        return list(zip(transactions['userId'].astype(np.int64).tolist(), timestamps.tolist(),
+                        transactions['merchantName'].astype(str).tolist(),
+                        transactions['amount'].astype(np.float64).tolist()))
+
+    def refresh_profiles(self) -> int:
+        """
+        Recompute the aggregates of the users with new transactions.
+        Returns:
+            int: number of users recomputed
+        """
+        t = transactions_table
+        dirty = select(dirty_users_table.c.userId)
+        hour = cast(func.substr(t.c.timestamp, 12, 2), Integer)
+        with self.engine.begin() as conn:
+            users = conn.execute(select(func.count()).select_from(dirty_users_table)).scalar_one()
+            if not users:
+                return 0
+            for table in (user_amounts_table, user_hours_table, user_merchants_table):
+                conn.execute(delete(table).where(table.c.userId.in_(dirty)))
+            conn.execute(insert(user_amounts_table).from_select(
+                ['userId', 'count', 'total', 'total_sq', 'min_amount', 'max_amount'],
+                select(t.c.userId, func.count(), func.sum(t.c.amount), func.sum(t.c.amount * t.c.amount),
+                       func.min(t.c.amount), func.max(t.c.amount))
+                .where(t.c.userId.in_(dirty)).group_by(t.c.userId)))
+            conn.execute(insert(user_hours_table).from_select(
+                ['userId', 'hour', 'count'],
+                select(t.c.userId, hour, func.count()).where(t.c.userId.in_(dirty)).group_by(t.c.userId, hour)))
+            conn.execute(insert(user_merchants_table).from_select(
+                ['userId', 'merchantName', 'count', 'total', 'total_sq'],
+                select(t.c.userId, t.c.merchantName, func.count(), func.sum(t.c.amount),
+                       func.sum(t.c.amount * t.c.amount))
+                .where(t.c.userId.in_(dirty)).group_by(t.c.userId, t.c.merchantName)))
+            conn.execute(delete(dirty_users_table))
+        return users
+
+    def load_profiles(self, min_history: int = 1, user_ids: Optional[Sequence[int]] = None) -> ProfileStore:
+        """
+        Refresh the aggregates of dirty users and build the profiles from the aggregate tables.
+        Args:
+            min_history: minimum number of transactions for a user's profile to be visible
+            user_ids: users to load, every user in the store if not given
+        Returns:
+            ProfileStore: ProfileStore of the requested users that are in the store
+        """
+        self.refresh_profiles()
+        queries = [select(user_amounts_table).order_by(user_amounts_table.c.userId),
+                   select(user_hours_table), select(user_merchants_table)]
+        if user_ids is not None:
+            wanted = [int(user_id) for user_id in user_ids]
+            tables = (user_amounts_table, user_hours_table, user_merchants_table)
+            queries = [query.where(table.c.userId.in_(wanted)) for query, table in zip(queries, tables)]
+        with self.engine.connect() as conn:
+            users, hours, pairs = (pd.read_sql(query, conn) for query in queries)
+
+        user_ids = users['userId'].to_numpy(np.int64)
+        hour_counts = np.zeros((len(user_ids), 24), dtype=np.int32)
+        hour_counts[np.searchsorted(user_ids, hours['userId'].to_numpy(np.int64)),
+                    hours['hour'].to_numpy(np.int64)] = hours['count'].to_numpy(np.int32)
+        return ProfileStore.from_sums(
+            user_ids=user_ids,
+            count=users['count'].to_numpy(np.int64),
+            total=users['total'].to_numpy(np.float64),
+            total_sq=users['total_sq'].to_numpy(np.float64),
+            min_amount=users['min_amount'].to_numpy(np.float64),
+            max_amount=users['max_amount'].to_numpy(np.float64),
+            hour_counts=hour_counts,
+            pair_users=np.searchsorted(user_ids, pairs['userId'].to_numpy(np.int64)),
+            pair_merchants=pairs['merchantName'].to_numpy(object),
+            pair_count=pairs['count'].to_numpy(np.int64),
+            pair_total=pairs['total'].to_numpy(np.float64),
+            pair_total_sq=pairs['total_sq'].to_numpy(np.float64),
+            min_history=min_history,
+        )
+
+    def profile_count(self, min_history: int = 1, refresh: bool = True) -> int:
+        """
+        Args:
+            min_history: minimum number of transactions for a user's profile to be visible
+            refresh: refresh the aggregates of dirty users first, otherwise only read the
+                aggregate tables as of the last refresh
+        Returns:
+            int: number of users with a visible profile
+        """
+        if refresh:
+            self.refresh_profiles()
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(user_amounts_table)
+                                .where(user_amounts_table.c.count >= min_history)).scalar_one()
+
+    def read_transactions(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: every transaction in ingestion order, with parsed timestamps
+        """
+        t = transactions_table
+        with self.engine.connect() as conn:
+            transactions = pd.read_sql(select(t.c.userId, t.c.timestamp, t.c.merchantName, t.c.amount)
+                                       .order_by(t.c.id), conn)
+        transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+        return transactions
+
+    def __len__(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(select(func.count()).select_from(transactions_table)).scalar_one()
@@ -0,0 +1,165 @@
+import itertools
+from datetime import timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import RuleConfig
+from app.sevices.point_in_time import point_in_time_features
+from app.sevices.profiles import ProfileStore, ProfileTable
+from app.sevices.rules.rules import (AmountDeviationRule, MerchantAnomalyRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule, hour_distance)
+from app.sevices.rules.velocity import window_counts
+
+SWEEP_FIELDS = ('velocity_window_minutes', 'velocity_threshold_count', 'time_anomaly_hour_tolerance',
+                'merchant_anomaly_risk_threshold', 'unusual_merchant_activity_threshold',
+                'amount_deviation_std_threshold', 'min_user_history')
+
+SWEEP_RULES = (VelocityCheckRule, TimeAnomalyRule, MerchantAnomalyRule, AmountDeviationRule,
+               UnusualMerchantActivityRule)
+
+
+def config_grid(base: Optional[RuleConfig] = None, **values: Sequence[Any]) -> List[RuleConfig]:
+    """
+    Every combination of the given RuleConfig field values.
+    Args:
+        base: config the other fields are copied from, defaults to RuleConfig()
+        values: field name to the values to try, e.g. amount_deviation_std_threshold=[2, 2.5, 3]
+    Returns:
+        List[RuleConfig]: one config per combination
+    """
+    base = base or RuleConfig()
+    unknown = set(values) - set(SWEEP_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown RuleConfig fields: {sorted(unknown)}")
+    configs = []
+    for combination in itertools.product(*values.values()):
+        rule_config = RuleConfig()
+        for field in SWEEP_FIELDS:
+            setattr(rule_config, field, getattr(base, field))
+        for field, value in zip(values, combination):
+            setattr(rule_config, field, value)
+        configs.append(rule_config)
+    return configs
+
+
+class ThresholdSweep:
+    """
+    Flag counts of the batch rules for many RuleConfigs over the same transactions.
+
+    The expensive part of a run does not depend on the thresholds: the profiles, the
+    velocity window counts, the hour distances, the amount z-scores and the deviations from
+    the per-merchant means. They are computed once here; every config is then a handful of
+    vector comparisons against its thresholds, and masks shared between configs that agree
+    on a rule's parameters are reused.
+    """
+
+    def __init__(self, transactions: pd.DataFrame, point_in_time: bool = False):
+        """
+        Args:
+            transactions: pd.DataFrame with parsed timestamps
+            point_in_time: score against the user's strictly earlier transactions only,
+                as the "point_in_time" analysis mode does
+        """
+        self.transactions = transactions
+        if point_in_time:
+            features = point_in_time_features(transactions, min_history=1)
+        else:
+            profiles = ProfileStore.build(transactions, min_history=1)
+            features = ProfileTable.from_profiles(profiles).join(transactions)
+        amounts = transactions['amount'].to_numpy(np.float64)
+        self.user_codes, users = pd.factorize(transactions['userId'])
+        self.users = len(users)
+        # has_profile for a min_user_history of m is transaction_count >= m.
+        self.history = features['transaction_count'].fillna(0).to_numpy(np.int64)
+        self.merchant_count = features['merchant_count'].to_numpy()
+        hour_mask = features['hour_mask'].to_numpy()
+        self.hour_distance = np.where(hour_mask != 0,
+                                      hour_distance(transactions['timestamp'].dt.hour.to_numpy(), hour_mask), -1)
+        amount_std = features['amount_std'].to_numpy()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.amount_zscore = np.where(amount_std > 0,
+                                          np.abs(amounts - features['amount_mean'].to_numpy()) / amount_std, np.nan)
+            # amount > mean + k * std holds exactly when the deviation exceeds k. A zero std
+            # makes it independent of k, a missing one never true.
+            merchant_mean = features['merchant_amount_mean'].to_numpy()
+            merchant_std = features['merchant_amount_std'].to_numpy()
+            excess = amounts - merchant_mean
+            self.merchant_deviation = np.where(
+                merchant_std > 0, excess / merchant_std,
+                np.where(merchant_std == 0, np.where(excess > 0, np.inf, -np.inf), np.nan))
+        self.velocity_counts: Dict[int, np.ndarray] = {}
+        self.masks: Dict[Tuple, np.ndarray] = {}
+
+    def _velocity_counts(self, configs: Iterable[RuleConfig]) -> None:
+        windows = sorted({c.velocity_window_minutes for c in configs} - set(self.velocity_counts))
+        if not windows:
+            return
+        counts = window_counts(self.transactions['userId'].to_numpy(), self.transactions['timestamp'].to_numpy(),
+                               [timedelta(minutes=minutes) for minutes in windows])
+        self.velocity_counts.update(zip(windows, counts))
+
+    def _mask(self, key: Tuple, compute) -> np.ndarray:
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.masks[key] = compute()
+        return mask
+
+    def rule_masks(self, rule_config: RuleConfig) -> Dict[str, np.ndarray]:
+        """
+        Args:
+            rule_config: RuleConfig
+        Returns:
+            Dict[str, np.ndarray]: rule label to the boolean mask of the rows it flags under rule_config
+        """
+        c = rule_config
+        self._velocity_counts([c])
+        has_profile = self._mask(('profile', c.min_user_history), lambda: self.history >= c.min_user_history)
+        return {
+            VelocityCheckRule.label: self._mask(
+                ('velocity', c.velocity_window_minutes, c.velocity_threshold_count),
+                lambda: self.velocity_counts[c.velocity_window_minutes] >= c.velocity_threshold_count),
+            TimeAnomalyRule.label: self._mask(
+                ('time', c.min_user_history, c.time_anomaly_hour_tolerance),
+                lambda: has_profile & (self.hour_distance > c.time_anomaly_hour_tolerance)),
+            MerchantAnomalyRule.label: self._mask(
+                ('merchant', c.min_user_history, c.merchant_anomaly_risk_threshold > 0.3),
+                lambda: has_profile & (self.merchant_count < 2) & (c.merchant_anomaly_risk_threshold > 0.3)),
+            AmountDeviationRule.label: self._mask(
+                ('amount', c.min_user_history, c.amount_deviation_std_threshold),
+                lambda: has_profile & (self.amount_zscore > c.amount_deviation_std_threshold)),
+            UnusualMerchantActivityRule.label: self._mask(
+                ('unusual_merchant', c.min_user_history, c.unusual_merchant_activity_threshold),
+                lambda: has_profile & (self.merchant_count > 0)
+                & (self.merchant_deviation > c.unusual_merchant_activity_threshold)),
+        }
+
+    def run(self, configs: Sequence[RuleConfig], labels: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """
+        Args:
+            configs: RuleConfigs to evaluate, e.g. from config_grid
+            labels: labels of the rules that count towards suspicious, defaults to every swept rule
+        Returns:
+            pd.DataFrame: one row per config with its field values, the transactions flagged by
+                each rule, the suspicious transactions, the users with a suspicious transaction
+                and their share of all users
+        """
+        labels = list(labels or [rule.label for rule in SWEEP_RULES])
+        self._velocity_counts(configs)
+        rows = []
+        for rule_config in configs:
+            masks = self.rule_masks(rule_config)
+            suspicious = np.zeros(len(self.transactions), dtype=bool)
+            for label in labels:
+                suspicious |= masks[label]
+            users = np.count_nonzero(np.bincount(self.user_codes[suspicious], minlength=self.users))
+            rows.append({
+                **{field: getattr(rule_config, field) for field in SWEEP_FIELDS},
+                **{label: int(masks[label].sum()) for label in labels},
+                'suspicious': int(suspicious.sum()),
+                'suspicious_users': users,
+                'user_coverage': users / self.users if self.users else 0.0,
+            })
+        return pd.DataFrame(rows, columns=list(SWEEP_FIELDS) + labels
+                            + ['suspicious', 'suspicious_users', 'user_coverage'])
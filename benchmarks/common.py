@@ -0,0 +1,90 @@
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+
+ROOT = Path(__file__).resolve().parents[1]
+# The services import their siblings as top-level modules, like app/main.py does.
+sys.path.insert(0, str(ROOT / 'app'))
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Returns:
+        Dict[str, Any]: commit and versions the results were measured with
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def max_rss_bytes() -> int:
+    """Peak resident set size of this process so far."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextmanager
+def measure(results: Dict[str, Any], trace_memory: bool = True) -> Iterator[None]:
+    """
+    Time the block and, with trace_memory, record the peak of memory allocated on top of what
+    was allocated when it started. numpy reports its buffers to tracemalloc, so the peak covers
+    DataFrame columns too. Tracing slows down allocation-heavy Python code.
+    Args:
+        results: dict that receives seconds and peak_bytes
+        trace_memory: whether to trace allocations
+    """
+    if trace_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        results['seconds'] = time.perf_counter() - start
+        if trace_memory:
+            results['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+
+
+def percentiles(samples_s: np.ndarray) -> Dict[str, float]:
+    samples = np.asarray(samples_s) * 1e6
+    if len(samples) == 0:
+        return {}
+    return {
+        'p50_us': float(np.percentile(samples, 50)),
+        'p90_us': float(np.percentile(samples, 90)),
+        'p99_us': float(np.percentile(samples, 99)),
+        'max_us': float(samples.max()),
+        'mean_us': float(samples.mean()),
+    }
+
+
+def write_results(results: Dict[str, Any], output: Optional[str]) -> None:
+    """Write results as JSON to a file, or to stdout without one."""
+    text = json.dumps(results, indent=4)
+    if output:
+        Path(output).write_text(text + '\n')
+    else:
+        print(text)
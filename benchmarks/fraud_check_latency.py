@@ -0,0 +1,76 @@
+"""
+Latency of a single /fraud-check evaluation, scalar rule path against the DataFrame path.
+
+    python -m benchmarks.fraud_check_latency --samples 5000 --output latency.json
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.common import environment, percentiles, write_results
+from app.getters import get_fraud_detection_service, get_runtime_rules, replays
+from app.models.model import Transaction
+
+
+def dataframe_path(service, transaction: Transaction, rules) -> dict:
+    """Per-request work of detect_fraud before the scalar path: a one-row frame and apply() per rule."""
+    transactions = service._transaction_frame(transaction)
+    if transaction.user_id not in service.user_profiles:
+        return {}
+    return {rule.__class__.__name__: rule.apply(transactions, service.user_profiles) for rule in rules}
+
+
+def scalar_path(service, transaction: Transaction, rules) -> dict:
+    return service.detect_fraud(transaction, rules).rule_stats
+
+
+def measure(path, service, transactions, rules) -> dict:
+    for transaction in transactions[:100]:
+        path(service, transaction, rules)
+    timings = []
+    for transaction in transactions:
+        # Sampled rows repeat, and a repeat would be answered from the replay cache instead of
+        # running the rules, so every call starts from an empty replay index.
+        replays.clear()
+        start = time.perf_counter()
+        path(service, transaction, rules)
+        timings.append(time.perf_counter() - start)
+    return percentiles(np.array(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--csv', default='./app/data/user_transactions.csv')
+    parser.add_argument('--samples', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='JSON file to write, stdout by default')
+    args = parser.parse_args()
+
+    service = get_fraud_detection_service()
+    service.load_data(args.csv)
+    service.build_user_profiles()
+    rules = get_runtime_rules()
+
+    rows = pd.read_csv(args.csv).sample(args.samples, replace=True, random_state=args.seed)
+    transactions = [Transaction(user_id=row.userId, timestamp=row.timestamp, merchant_name=row.merchantName,
+                                amount=row.amount) for row in rows.itertuples()]
+
+    for transaction in transactions:
+        replays.clear()
+        assert dataframe_path(service, transaction, rules) == scalar_path(service, transaction, rules)
+
+    write_results({
+        'benchmark': 'fraud_check_latency',
+        'environment': environment(),
+        'csv': args.csv,
+        'samples': args.samples,
+        'seed': args.seed,
+        'dataframe_path': measure(dataframe_path, service, transactions, rules),
+        'scalar_path': measure(scalar_path, service, transactions, rules),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
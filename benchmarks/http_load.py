@@ -0,0 +1,151 @@
+"""
+Throughput and latency of the HTTP endpoints under concurrent load, on synthetic data.
+
+    python -m benchmarks.http_load --rows 100000 --users 10000 --concurrency 1 8 32 --output http.json
+
+Without --url a server is started in a subprocess with profiles built from the synthetic rows.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.common import ROOT, environment, percentiles, write_results
+from benchmarks.synthetic import TIMESTAMP_FORMAT, add_arguments, from_arguments
+
+
+def serve(csv_path: str, port: int) -> None:
+    """Build the profiles from csv_path and serve the app, in the server subprocess."""
+    import uvicorn
+    from app.getters import get_fraud_detection_service
+    from main import app
+
+    service = get_fraud_detection_service()
+    service.load_data(csv_path)
+    service.build_user_profiles()
+    uvicorn.run(app, host='127.0.0.1', port=port, log_level='warning')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(url: str, server: Optional[subprocess.Popen], timeout: float = 600) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            httpx.get(url + '/', timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise TimeoutError(f"Server at {url} did not come up")
+
+
+async def run_load(url: str, endpoint: str, bodies: List[Any], concurrency: int) -> Dict[str, Any]:
+    """
+    Send every body once from `concurrency` clients that each wait for a response before sending again.
+    Returns:
+        Dict[str, Any]: requests, errors, requests per second and latency percentiles
+    """
+    latencies = np.zeros(len(bodies))
+    errors = 0
+    next_body = iter(range(len(bodies)))
+
+    async def client(http: httpx.AsyncClient) -> None:
+        nonlocal errors
+        for i in next_body:
+            start = time.perf_counter()
+            response = await http.post(endpoint, json=bodies[i])
+            latencies[i] = time.perf_counter() - start
+            errors += response.status_code != 200
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as http:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(http) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        'requests': len(bodies),
+        'errors': errors,
+        'seconds': elapsed,
+        'requests_per_second': len(bodies) / elapsed,
+        'latency': percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--rows', type=int, default=100_000, help='rows the server profiles are built from')
+    parser.add_argument('--url', help='benchmark a running server instead of starting one')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint and concurrency level')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--batch-size', type=int, default=100, help='transactions per /fraud-check/batch request')
+    parser.add_argument('--output', help='JSON file to write, stdout by default')
+    parser.add_argument('--serve', nargs=2, metavar=('CSV', 'PORT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve[0], int(args.serve[1]))
+        return
+
+    generator = from_arguments(args)
+    # Requests come from a random stream of their own, with the same per-user habits as the history.
+    sample = generator.chunk(10_000, args.requests * args.batch_size)
+    transactions = [{'user_id': int(user_id), 'timestamp': timestamp.strftime(TIMESTAMP_FORMAT),
+                     'merchant_name': merchant_name, 'amount': float(amount)}
+                    for user_id, timestamp, merchant_name, amount in sample.itertuples(index=False)]
+    workloads = {
+        '/fraud-check': transactions[:args.requests],
+        '/fraud-check/batch': [transactions[i:i + args.batch_size]
+                               for i in range(0, args.requests * args.batch_size, args.batch_size)],
+    }
+
+    server: Optional[subprocess.Popen] = None
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.url
+        if url is None:
+            csv_path = os.path.join(tmp, 'transactions.csv')
+            generator.write_csv(csv_path, args.rows, args.chunk_rows)
+            port = free_port()
+            url = f'http://127.0.0.1:{port}'
+            server = subprocess.Popen([sys.executable, '-m', 'benchmarks.http_load', '--serve', csv_path, str(port)],
+                                      cwd=ROOT, stdout=subprocess.DEVNULL)
+        try:
+            wait_until_up(url, server)
+            results = []
+            for endpoint, bodies in workloads.items():
+                for concurrency in args.concurrency:
+                    result = asyncio.run(run_load(url, endpoint, bodies, concurrency))
+                    if endpoint == '/fraud-check/batch':
+                        result['transactions_per_second'] = result['requests_per_second'] * args.batch_size
+                    results.append({'endpoint': endpoint, 'concurrency': concurrency, **result})
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    write_results({
+        'benchmark': 'http_load',
+        'environment': environment(),
+        'generator': {'rows': args.rows, 'users': args.users, 'merchants': args.merchants, 'skew': args.skew,
+                      'seed': args.seed},
+        'batch_size': args.batch_size,
+        'runs': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Time and peak memory of each stage of the report pipeline and of each rule, on synthetic data.
+
+    python -m benchmarks.pipeline --rows 10000 100000 1000000 --users 10000 --output pipeline.json
+"""
+import argparse
+import os
+import tempfile
+from typing import Any, Dict, List
+
+from benchmarks.common import environment, max_rss_bytes, measure, write_results
+from benchmarks.synthetic import SyntheticTransactions, add_arguments, from_arguments
+
+from app.config import ServiceConfig, config
+from app.getters import get_all_rules
+from app.sevices.profiles import ProfileTable
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+
+
+def run_stages(csv_path: str, out_dir: str, trace_memory: bool) -> List[Dict[str, Any]]:
+    """
+    Run the in-memory pipeline one stage at a time, the way run_all_rules does.
+    Returns:
+        List[Dict[str, Any]]: name, seconds, peak_bytes and, for rules, flagged of each stage
+    """
+    service = RuleBasedFraudMonitoringService(config=config, rules=get_all_rules(), service_config=ServiceConfig())
+    stages = []
+
+    def stage(name: str) -> Dict[str, Any]:
+        stages.append({'name': name})
+        return stages[-1]
+
+    with measure(stage('load_data'), trace_memory):
+        service.load_data(csv_path)
+    if service.transactions is None:
+        raise ValueError(f"Could not load {csv_path}")
+    with measure(stage('build_user_profiles'), trace_memory):
+        service.build_user_profiles()
+    with measure(stage('join_features'), trace_memory):
+        features = ProfileTable.from_profiles(service.user_profiles).join(service.transactions)
+
+    service.applied_rules = list(service.rules)
+    for rule in service.applied_rules:
+        results = stage(f"rule:{rule.__class__.__name__}")
+        with measure(results, trace_memory):
+            if hasattr(rule, 'apply_batch'):
+                results['flagged'] = rule.apply_batch(service.transactions, features)
+            else:
+                results['flagged'] = rule.apply(service.transactions, service.user_profiles)
+
+    with measure(stage('export_results'), trace_memory):
+        service.export_results(os.path.join(out_dir, 'output.csv'))
+    with measure(stage('export_summary_report'), trace_memory):
+        service.export_summary_report(os.path.join(out_dir, 'report.json'))
+    return stages
+
+
+def run_modes(csv_path: str, out_dir: str, modes: List[str]) -> List[Dict[str, Any]]:
+    """
+    Time analyze_data end to end in each analysis mode, without memory tracing.
+    Returns:
+        List[Dict[str, Any]]: mode and seconds of each run
+    """
+    runs = []
+    for mode in modes:
+        service = RuleBasedFraudMonitoringService(config=config, rules=get_all_rules(), service_config=ServiceConfig())
+        runs.append({'mode': mode})
+        with measure(runs[-1], trace_memory=False):
+            service.analyze_data(csv_path, os.path.join(out_dir, f'output-{mode}.csv'),
+                                 os.path.join(out_dir, f'report-{mode}.json'), mode=mode)
+    return runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--modes', nargs='*', default=[], choices=['memory', 'streaming', 'parallel'],
+                        help='also time analyze_data end to end in these analysis modes')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows down some stages')
+    parser.add_argument('--output', help='JSON file to write, stdout by default')
+    args = parser.parse_args()
+
+    generator: SyntheticTransactions = from_arguments(args)
+    runs = []
+    for rows in args.rows:
+        with tempfile.TemporaryDirectory() as out_dir:
+            csv_path = os.path.join(out_dir, 'transactions.csv')
+            generator.write_csv(csv_path, rows, args.chunk_rows)
+            runs.append({
+                'rows': rows,
+                'csv_bytes': os.path.getsize(csv_path),
+                'stages': run_stages(csv_path, out_dir, not args.no_memory),
+                'modes': run_modes(csv_path, out_dir, args.modes),
+                'max_rss_bytes': max_rss_bytes(),
+            })
+
+    write_results({
+        'benchmark': 'pipeline',
+        'environment': environment(),
+        'generator': {'users': args.users, 'merchants': args.merchants, 'skew': args.skew, 'seed': args.seed},
+        'runs': runs,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
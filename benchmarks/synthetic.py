@@ -0,0 +1,149 @@
+"""
+Seeded synthetic transactions with the schema of app/data/user_transactions.csv.
+
+    python -m benchmarks.synthetic --rows 1000000 --users 10000 --output /tmp/transactions.csv
+"""
+import argparse
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+UNKNOWN_MERCHANT = 'UnknownMerchantXYZ'
+
+
+class SyntheticTransactions:
+    """
+    Generator of transactions with per-user habits the rules can pick up on.
+
+    User activity follows a Zipf-like law: the user of rank r is picked with weight 1 / r**skew,
+    so skew=0 spreads rows evenly and larger values concentrate them on a few heavy users.
+    Every user has a usual hour of day, a typical amount and favourite merchants, and a small
+    share of rows breaks those habits or arrives in bursts, so every rule has something to flag.
+    Rows are produced in chunks, each seeded from (seed, chunk number), so the same seed and
+    chunk size always give the same rows and any chunk can be regenerated on its own.
+    """
+
+    def __init__(self, users: int = 100, merchants: int = 12, skew: float = 0.0, seed: int = 0,
+                 start: str = '2025-02-01', days: int = 30, anomaly_rate: float = 0.01,
+                 burst_rate: float = 0.005):
+        """
+        Args:
+            users: number of distinct users
+            merchants: number of distinct merchants
+            skew: exponent of the user activity law, 0 for uniform activity
+            seed: random seed
+            start: first day of the generated period
+            days: length of the generated period
+            anomaly_rate: share of rows at an odd hour, an unknown merchant or an outlying amount
+            burst_rate: share of rows placed minutes after the previous row of the same chunk
+        """
+        self.users = users
+        self.merchants = merchants
+        self.seed = seed
+        self.start = np.datetime64(pd.Timestamp(start).to_datetime64(), 'us')
+        self.days = days
+        self.anomaly_rate = anomaly_rate
+        self.burst_rate = burst_rate
+
+        rng = np.random.default_rng([seed, 0])
+        weights = 1.0 / np.arange(1, users + 1) ** skew
+        self.user_cdf = np.cumsum(rng.permutation(weights))
+        self.user_cdf /= self.user_cdf[-1]
+        self.user_hour = rng.integers(0, 24, users)
+        self.user_amount = rng.lognormal(5.0, 0.6, users)
+        self.user_merchant_offset = rng.integers(0, merchants, users)
+        self.merchant_names = np.array([f"Merchant{i:0{len(str(merchants))}d}" for i in range(merchants)]
+                                       + [UNKNOWN_MERCHANT], dtype=object)
+
+    def chunk(self, number: int, rows: int) -> pd.DataFrame:
+        """
+        Args:
+            number: chunk number, selects the random stream
+            rows: rows in the chunk
+        Returns:
+            pd.DataFrame: userId, timestamp, merchantName and amount columns
+        """
+        rng = np.random.default_rng([self.seed, number + 1])
+        users = np.minimum(np.searchsorted(self.user_cdf, rng.random(rows)), self.users - 1)
+
+        day = rng.integers(0, self.days, rows)
+        hour = (self.user_hour[users] + np.rint(rng.normal(0, 1.5, rows)).astype(np.int64)) % 24
+        odd_hour = rng.random(rows) < self.anomaly_rate
+        hour[odd_hour] = (self.user_hour[users[odd_hour]] + 12) % 24
+        offset_us = ((day * 24 + hour) * 3600 + rng.integers(0, 3600, rows)) * 1_000_000 + rng.integers(0, 1_000_000, rows)
+        timestamps = self.start + offset_us.astype('timedelta64[us]')
+
+        bursts = np.flatnonzero(rng.random(rows) < self.burst_rate)
+        bursts = bursts[bursts > 0]
+        users[bursts] = users[bursts - 1]
+        timestamps[bursts] = timestamps[bursts - 1] + rng.integers(1, 600, len(bursts)).astype('timedelta64[s]')
+
+        # Zipf-distributed rank among the user's own ordering of merchants, so favourites differ per user.
+        rank = np.minimum(rng.zipf(1.6, rows) - 1, self.merchants - 1)
+        merchant = (self.user_merchant_offset[users] + rank) % self.merchants
+        merchant[rng.random(rows) < self.anomaly_rate] = self.merchants
+
+        amount = self.user_amount[users] * rng.lognormal(0.0, 0.4, rows)
+        outlier = rng.random(rows) < self.anomaly_rate
+        amount[outlier] *= rng.uniform(4, 10, int(outlier.sum()))
+
+        return pd.DataFrame({
+            'userId': users + 1,
+            'timestamp': timestamps.astype('datetime64[ns]'),
+            'merchantName': self.merchant_names[merchant],
+            'amount': np.round(amount, 2),
+        })
+
+    def chunks(self, rows: int, chunk_rows: int = 1_000_000) -> Iterator[pd.DataFrame]:
+        """
+        Args:
+            rows: total rows
+            chunk_rows: rows per chunk
+        Yields:
+            pd.DataFrame: consecutive chunks adding up to rows
+        """
+        for number, first in enumerate(range(0, rows, chunk_rows)):
+            yield self.chunk(number, min(chunk_rows, rows - first))
+
+    def frame(self, rows: int, chunk_rows: int = 1_000_000) -> pd.DataFrame:
+        return pd.concat(self.chunks(rows, chunk_rows), ignore_index=True)
+
+    def write_csv(self, path: str, rows: int, chunk_rows: int = 1_000_000) -> None:
+        """
+        Write rows to a CSV one chunk at a time, so memory stays bounded by the chunk size.
+        Args:
+            path: destination CSV
+            rows: total rows
+            chunk_rows: rows per chunk
+        """
+        for number, chunk in enumerate(self.chunks(rows, chunk_rows)):
+            chunk.to_csv(path, mode='a' if number else 'w', header=not number, index=False,
+                         date_format=TIMESTAMP_FORMAT)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the generator options shared by the benchmarks."""
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--merchants', type=int, default=12)
+    parser.add_argument('--skew', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000)
+
+
+def from_arguments(args: argparse.Namespace) -> SyntheticTransactions:
+    return SyntheticTransactions(users=args.users, merchants=args.merchants, skew=args.skew, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--rows', type=int, default=10_000)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+    from_arguments(args).write_csv(args.output, args.rows, args.chunk_rows)
+
+
+if __name__ == '__main__':
+    main()
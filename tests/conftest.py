@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+# The services import their siblings as top-level modules, like app/main.py does.
+sys.path.insert(0, str(ROOT / 'app'))
+sys.path.insert(0, str(ROOT))
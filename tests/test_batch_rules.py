@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+from app.config import ServiceConfig
+from app.sevices.profiles import ProfileStore
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import (FLAGS_COLUMN, AmountDeviationRule, MerchantAnomalyRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule)
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+def _rules():
+    return [VelocityCheckRule(), TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(),
+            UnusualMerchantActivityRule()]
+
+
+def _row_path(rule):
+    """The same rule without apply_batch, so run_all_rules runs its per-row apply on the profile dicts."""
+    row_rule = type(rule.__class__.__name__, (), {
+        'flag': rule.flag,
+        'label': rule.label,
+        'apply': lambda self, transactions, user_profiles=None: rule.apply(transactions, user_profiles),
+        'describe': lambda self, transactions, mask: rule.describe(transactions, mask),
+    })
+    return row_rule()
+
+
+def _analyze(rules, tmp_path, name):
+    service = RuleBasedFraudMonitoringService(rules=rules, service_config=ServiceConfig())
+    output_file, report_file = tmp_path / f"output-{name}.csv", tmp_path / f"report-{name}.json"
+    service.analyze_data(CSV_PATH, str(output_file), str(report_file), mode="memory")
+    return service, output_file.read_bytes()
+
+
+def test_batch_rules_match_the_row_path(tmp_path):
+    batch, batch_output = _analyze(_rules(), tmp_path, "batch")
+    rows, rows_output = _analyze([_row_path(rule) for rule in _rules()], tmp_path, "rows")
+
+    assert batch.rule_stats == rows.rule_stats
+    np.testing.assert_array_equal(batch.transactions[FLAGS_COLUMN].to_numpy(),
+                                  rows.transactions[FLAGS_COLUMN].to_numpy())
+    assert batch._report_counts() == rows._report_counts()
+    assert batch_output == rows_output
+
+
+def test_batch_rules_match_the_row_path_on_other_profiles(tmp_path):
+    transactions = pd.read_csv(CSV_PATH)
+    transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    # Profiles from daytime history only, so night transactions are at unusual hours and some
+    # users, merchants and amounts are new to the profiles.
+    history = transactions[transactions['timestamp'].dt.hour.between(8, 20) & (transactions['userId'] % 7 != 0)]
+    services = []
+    for rules in (_rules(), [_row_path(rule) for rule in _rules()]):
+        service = RuleBasedFraudMonitoringService(rules=rules, service_config=ServiceConfig())
+        service.set_transactions(transactions)
+        service.rule_stats = service.run_all_rules(profiles=ProfileStore.build(history, 3))
+        service.export_results(str(tmp_path / f"output-{len(services)}.csv"))
+        services.append(service)
+    batch, rows = services
+
+    assert batch.rule_stats == rows.rule_stats
+    assert all(batch.rule_stats.values())
+    np.testing.assert_array_equal(batch.transactions[FLAGS_COLUMN].to_numpy(),
+                                  rows.transactions[FLAGS_COLUMN].to_numpy())
+    assert (tmp_path / "output-0.csv").read_bytes() == (tmp_path / "output-1.csv").read_bytes()
+
+
+def test_batch_rules_skip_users_without_a_profile(tmp_path):
+    transactions = pd.read_csv(CSV_PATH)
+    # Users below min_user_history have no profile and are never flagged by the profile rules.
+    sparse = transactions.groupby('userId').head(2)
+    sparse.to_csv(tmp_path / "sparse.csv", index=False)
+    service = RuleBasedFraudMonitoringService(rules=_rules()[1:], service_config=ServiceConfig())
+    service.analyze_data(str(tmp_path / "sparse.csv"), str(tmp_path / "output.csv"), str(tmp_path / "report.json"),
+                         mode="memory")
+    assert len(service.user_profiles) == 0
+    assert service.rule_stats == {rule.__class__.__name__: 0 for rule in _rules()[1:]}
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import ServiceConfig
+from app.models.model import Transaction
+from app.routers.routes import router
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.recent_activity import RecentActivityIndex
+from app.sevices.rules.replay import ReplayIndex
+from app.sevices.rules.rules import (FLAGS_COLUMN, FLAGS_DTYPE, REPLAY_OF_COLUMN, AmountDeviationRule,
+                                     MerchantAnomalyRule, ReplayCheckRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule)
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+MIXED_TIMESTAMPS = [
+    Transaction(user_id=1, timestamp="2025-02-09T21:01:28", merchant_name="Starbucks", amount=1375.2),
+    Transaction(user_id=1, timestamp="2025-02-09T03:15:00+05:30", merchant_name="Starbucks", amount=12.5),
+    Transaction(user_id=2, timestamp="2025-02-26 12:34:45Z", merchant_name="Walmart", amount=2502.1),
+    Transaction(user_id=2, timestamp="2025-02-26T04:00:00-08:00", merchant_name="HOLA", amount=40.0),
+    Transaction(user_id=4, timestamp="2025-02-04 18:36:29", merchant_name="Costco", amount=1707.2),
+]
+
+
+def _service() -> RuleBasedFraudMonitoringService:
+    service = RuleBasedFraudMonitoringService(service_config=ServiceConfig())
+    service.load_data(CSV_PATH)
+    service.build_user_profiles()
+    return service
+
+
+def _runtime_rules() -> list:
+    return [VelocityCheckRule(recent_activity=RecentActivityIndex()), TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(),
+            UnusualMerchantActivityRule(), ReplayCheckRule(replays=ReplayIndex())]
+
+
+@pytest.fixture(scope="module")
+def service():
+    return _service()
+
+
+def test_batch_with_mixed_timezones_matches_single_scoring(service):
+    rules = [TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(), UnusualMerchantActivityRule()]
+    batch = service.detect_fraud_batch(MIXED_TIMESTAMPS, rules)
+    single = [service.detect_fraud(transaction, rules) for transaction in MIXED_TIMESTAMPS]
+    assert [result.model_dump() for result in batch] == [result.model_dump() for result in single]
+    assert any(result.is_fraud for result in batch)
+
+
+def test_batch_endpoint_accepts_mixed_timezones():
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).post("/fraud-check/batch",
+                                    json=[transaction.model_dump() for transaction in MIXED_TIMESTAMPS])
+    assert response.status_code == 200
+    assert len(response.json()) == len(MIXED_TIMESTAMPS)
+
+
+def test_duplicates_within_a_batch_get_the_result_of_the_first():
+    original = Transaction(user_id=1, timestamp="2025-02-09T21:01:28", merchant_name="Starbucks", amount=1375.2)
+    transactions = [
+        original,
+        Transaction(user_id=1, timestamp="2025-02-09 21:01:28", merchant_name="Starbucks", amount=1375.2),
+        Transaction(user_id=1, timestamp="2025-02-09T21:01:28", merchant_name="Walmart", amount=1375.2),
+        Transaction(user_id=2, timestamp="2025-02-26 12:34:45", merchant_name="Walmart", amount=2502.1),
+        original,
+    ]
+    batch = _service().detect_fraud_batch(transactions, _runtime_rules())
+    single_service, single_rules = _service(), _runtime_rules()
+    single = [single_service.detect_fraud(transaction, single_rules) for transaction in transactions]
+    assert [result.model_dump() for result in batch] == [result.model_dump() for result in single]
+    assert batch[1] == batch[4] == batch[0]
+    assert batch[0].rule_stats["ReplayCheckRule"] == 0
+    assert batch[2].rule_stats["ReplayCheckRule"] == 1
+
+
+def test_swapping_profiles_drops_cached_results():
+    transaction = Transaction(user_id=1, timestamp="2025-02-09T21:01:28", merchant_name="Starbucks", amount=1375.2)
+    rules = _runtime_rules()
+    service = RuleBasedFraudMonitoringService(service_config=ServiceConfig())
+    service.result_caches = [rules[-1]]
+    # Scored before any profiles are loaded, so the user has none and nothing is flagged.
+    assert service.detect_fraud(transaction, rules).rule_stats == {}
+    service.swap_profiles(_service().user_profiles)
+    assert rules[-1].replays.result(1, 1739134888000000, "Starbucks", 1375.2) is None
+    assert "ReplayCheckRule" in service.detect_fraud(transaction, rules).rule_stats
+
+
+def test_batch_replays_ignore_hash_collisions(monkeypatch):
+    transactions = pd.DataFrame({
+        'userId': [1, 1, 2, 1],
+        'timestamp': pd.to_datetime(["2025-02-09 21:01:28", "2025-02-09 21:01:28", "2025-02-09 21:01:28",
+                                     "2025-02-09 21:01:29"]),
+        'merchantName': ["Starbucks", "Walmart", "Starbucks", "Starbucks"],
+        'amount': [10.0, 10.0, 10.0, 10.0],
+        FLAGS_COLUMN: np.zeros(4, dtype=FLAGS_DTYPE),
+    })
+    # Every row hashes alike, only the field comparison tells the replay from the rest.
+    monkeypatch.setattr(pd.util, "hash_pandas_object",
+                        lambda frame, index=False: pd.Series(np.zeros(len(frame), dtype=np.uint64)))
+    assert ReplayCheckRule().apply_batch(transactions, None) == 1
+    assert transactions[FLAGS_COLUMN].astype(bool).tolist() == [False, True, False, False]
+    assert transactions[REPLAY_OF_COLUMN].tolist() == [None, "Starbucks", None, None]
@@ -0,0 +1,161 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.config import active_config, config, pinned_config, snapshot_config
+from app.models.model import FraudDetectionResult, RuleSetSpec, RuleSpec, Transaction
+from app.routers.routes import router
+from app.sevices.profiles import ProfileStore
+from app.sevices.rules import declarative
+from app.sevices.rules.declarative import RuleSetRegistry, compile_condition, compile_rules
+from app.sevices.rules.replay import ReplayIndex
+from app.sevices.rules.rules import FLAGS_COLUMN, FLAGS_DTYPE, AmountDeviationRule, ReplayCheckRule, TimeAnomalyRule
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+CONDITIONS = [
+    "amount > factor * merchant_amount_mean",
+    "not (merchant_amount_std > 0)",
+    "not (merchant_amount_mean == merchant_amount_mean)",
+    "amount_zscore > amount_deviation_std_threshold or hour in [0, 1, 2, 3]",
+    "hour_distance >= 1 and merchant not in ['Amazon', 'Costco']",
+    "abs(amount - amount_mean) > max(amount_std, 10, amount_mean / 4) * 2",
+    "0 < merchant_count < 3 and transaction_count >= 5",
+    "amount % 7 == 0 or -amount < -2000",
+]
+
+
+@pytest.mark.parametrize("expression", [
+    "open('rules.json')",
+    "__import__('os').system('true')",
+    "amount.real > 0",
+    "merchant[0] == 'A'",
+    "(lambda: 1)()",
+    "[x for x in [1]]",
+    "amount if hour else 0",
+    "abs(amount, key=1) > 0",
+    "amount is None",
+    "unknown_field > 1",
+    "amount >",
+])
+def test_rejects_syntax_outside_the_dsl(expression):
+    with pytest.raises(ValueError):
+        compile_condition(expression)
+
+
+@pytest.fixture(scope="module")
+def transactions() -> pd.DataFrame:
+    transactions = pd.read_csv(CSV_PATH)
+    transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    # Merchants and users without a profile give NaN merchant and user statistics.
+    extra = transactions.head(20).copy()
+    extra['merchantName'] = 'NewMerchant'
+    unknown = transactions.head(5).copy()
+    unknown['userId'] = 10 ** 6
+    return pd.concat([transactions, extra, unknown], ignore_index=True)
+
+
+def test_batch_and_scalar_evaluation_agree(transactions):
+    # Profiles from daytime history only, so night transactions are outside the users' hours.
+    store = ProfileStore.build(transactions[transactions['timestamp'].dt.hour.between(6, 21)], min_history=3)
+    rules = compile_rules([RuleSpec(name=f"rule_{i}", condition=condition, params={"factor": 2.5})
+                           for i, condition in enumerate(CONDITIONS)])
+    batch = transactions.assign(**{FLAGS_COLUMN: np.zeros(len(transactions), dtype=FLAGS_DTYPE)})
+    features = store.join(batch)
+    for rule in rules:
+        rule.apply_batch(batch, features)
+    flags = batch[FLAGS_COLUMN].to_numpy()
+
+    for row, row_flags in zip(transactions.itertuples(), flags):
+        transaction = Transaction(user_id=row.userId, timestamp=str(row.timestamp), merchant_name=row.merchantName,
+                                  amount=row.amount)
+        profile = store.profile(row.userId)
+        for rule in rules:
+            scalar = profile is not None and rule.evaluate(transaction, profile)
+            assert bool(row_flags & rule.flag) == scalar, (rule.spec.condition, row)
+    assert all((flags & rule.flag).any() for rule in rules)
+
+
+def test_params_may_not_shadow_fields():
+    for name in ("hour", "amount", "merchant_count", "timestamp"):
+        with pytest.raises(ValueError, match="shadow"):
+            compile_rules([RuleSpec(name="shadowed", condition=f"amount > {name}", params={name: 3})])
+
+
+def test_reason_is_formatted_with_fields_and_params(transactions):
+    rule, = compile_rules([RuleSpec(name="big", condition="amount > limit", params={"limit": 1000},
+                                    reason="{amount} at {merchant} is over {limit}")])
+    batch = transactions.head(3)
+    reasons = rule.describe(batch, np.ones(len(batch), dtype=bool))
+    assert reasons[0] == f"{batch['amount'].iloc[0]} at {batch['merchantName'].iloc[0]} is over 1000"
+
+
+@pytest.fixture
+def registry():
+    replays = ReplayIndex()
+    registry = RuleSetRegistry(batch_rules=[TimeAnomalyRule(), AmountDeviationRule()],
+                               runtime_rules=[TimeAnomalyRule(), AmountDeviationRule(), ReplayCheckRule(replays=replays)],
+                               rule_config=config)
+    registry.replays = replays
+    yield registry
+    registry.reload(RuleSetSpec())
+
+
+def test_failed_reload_keeps_the_previous_rule_set(registry):
+    registry.reload(RuleSetSpec(thresholds={"amount_deviation_std_threshold": 4.0}, builtin=["TimeAnomalyRule"],
+                                rules=[RuleSpec(name="big", condition="amount > 5000")]))
+    before = registry.describe()
+    batch, runtime = registry.batch, registry.runtime
+    invalid = [
+        RuleSetSpec(thresholds={"amount_deviation_std_threshold": 1.0, "no_such_threshold": 1}),
+        RuleSetSpec(thresholds={"amount_deviation_std_threshold": 1.0}, builtin=["NoSuchRule"]),
+        RuleSetSpec(rules=[RuleSpec(name="bad", condition="amount.real > 0")]),
+        RuleSetSpec(rules=[RuleSpec(name="shadowed", condition="amount > hour", params={"hour": 3})]),
+        RuleSetSpec(rules=[RuleSpec(name="TimeAnomalyRule", condition="amount > 1")]),
+    ]
+    for spec in invalid:
+        with pytest.raises(ValueError):
+            registry.reload(spec)
+        assert registry.describe() == before
+        assert registry.batch is batch and registry.runtime is runtime
+        assert config.amount_deviation_std_threshold == 4.0
+
+
+def test_reload_drops_cached_results(registry):
+    registry.replays.store_result(1, 0, "Starbucks", 10.0, FraudDetectionResult(is_fraud=False, rule_stats={}))
+    registry.reload(RuleSetSpec(thresholds={"amount_deviation_std_threshold": 4.0}))
+    assert registry.replays.result(1, 0, "Starbucks", 10.0) is None
+
+
+def test_pinned_snapshot_is_not_changed_by_a_reload(registry):
+    seen = {}
+    started, reloaded = threading.Event(), threading.Event()
+
+    def job():
+        with pinned_config(snapshot_config(config)):
+            started.set()
+            reloaded.wait(5)
+            seen["job"] = active_config().amount_deviation_std_threshold
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    started.wait(5)
+    registry.reload(RuleSetSpec(thresholds={"amount_deviation_std_threshold": 4.0}))
+    seen["request"] = active_config().amount_deviation_std_threshold
+    reloaded.set()
+    thread.join(5)
+    assert seen == {"job": 2.5, "request": 4.0}
+    assert active_config() is config
+
+
+def test_yaml_reload_without_pyyaml_is_unsupported(monkeypatch):
+    monkeypatch.setattr(declarative, "yaml", None)
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).post("/rules/reload", content=b"rules: []\n",
+                                    headers={"content-type": "application/yaml"})
+    assert response.status_code == 415
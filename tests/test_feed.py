@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+from app.models.model import Transaction
+from app.sevices.feed import TransactionFeedProcessor
+
+
+class FailingService:
+    """Scores every batch except those holding a transaction of user 13."""
+
+    def detect_fraud_batch(self, transactions, rules):
+        if any(transaction.user_id == 13 for transaction in transactions):
+            raise RuntimeError("scoring failed")
+        return [FraudResult() for _ in transactions]
+
+
+class FraudResult:
+    is_fraud = False
+
+    def model_dump(self):
+        return {"is_fraud": False, "reasons": []}
+
+
+def _line(user_id: int) -> bytes:
+    return json.dumps(Transaction(user_id=user_id, timestamp="2025-02-09T21:01:28", merchant_name="Starbucks",
+                                  amount=12.5).model_dump()).encode() + b"\n"
+
+
+def test_failed_batch_emits_error_lines_and_the_feed_goes_on():
+    lines = [_line(1), _line(13), b"not json\n", _line(2), _line(3)]
+    processor = TransactionFeedProcessor(FailingService(), [], max_batch_size=3, max_batch_latency_ms=1000)
+    written = []
+
+    async def feed():
+        for line in lines:
+            yield line
+
+    async def write(chunk: bytes) -> None:
+        written.append(chunk)
+
+    try:
+        stats = asyncio.run(processor.process(feed(), write))
+    finally:
+        processor.close()
+    out = [json.loads(line) for line in b"".join(written).splitlines()]
+    assert len(out) == len(lines)
+    assert [line["error"] for line in out[:2]] == ["RuntimeError: scoring failed"] * 2
+    assert out[1]["user_id"] == 13
+    assert "line" in out[2]
+    assert [line["is_fraud"] for line in out[3:]] == [False, False]
+    assert stats == {"transactions": 2, "errors": 3, "flagged": 0, "batches": 2}
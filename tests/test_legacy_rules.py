@@ -0,0 +1,56 @@
+import pandas as pd
+
+from app.config import ServiceConfig
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import AmountDeviationRule
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+class LargeAmountRule:
+    """A custom rule in the original style: no flag bit, writes is_suspicious and flag_reasons."""
+
+    def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
+        flagged_count = 0
+        for i, txn in transactions.iterrows():
+            if txn['amount'] > 1000:
+                transactions.at[i, 'is_suspicious'] = True
+                reason = f"Large amount: {txn['amount']}"
+                if transactions.at[i, 'flag_reasons']:
+                    transactions.at[i, 'flag_reasons'] += "; " + reason
+                else:
+                    transactions.at[i, 'flag_reasons'] = reason
+                flagged_count += 1
+        return flagged_count
+
+
+def _analyze(rules, tmp_path):
+    service = RuleBasedFraudMonitoringService(rules=rules, service_config=ServiceConfig())
+    service.analyze_data(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"), mode="memory")
+    return service, pd.read_csv(tmp_path / "output.csv", keep_default_na=False)
+
+
+def test_rule_without_flag_marks_suspicious_transactions(tmp_path):
+    transactions = pd.read_csv(CSV_PATH)
+    expected = int((transactions['amount'] > 1000).sum())
+
+    service, output = _analyze([LargeAmountRule()], tmp_path)
+
+    assert expected > 0
+    assert service.rule_stats["LargeAmountRule"] == expected
+    assert int(output['is_suspicious'].sum()) == expected
+    assert (output['flag_reasons'][output['is_suspicious']].str.startswith("Large amount: ")).all()
+    report = service._report_counts()
+    assert report["suspicious_transactions"] == expected
+    assert report["rule_breakdown"] == {"Large amount": expected}
+
+
+def test_rule_without_flag_combines_with_flagged_rules(tmp_path):
+    service, output = _analyze([AmountDeviationRule(), LargeAmountRule()], tmp_path)
+
+    both = output['flag_reasons'].str.contains("Amount anomaly") & output['flag_reasons'].str.contains("Large amount")
+    assert both.any()
+    assert output['flag_reasons'][both].str.startswith("Amount anomaly").all()
+    breakdown = service._report_counts()["rule_breakdown"]
+    assert breakdown["Amount anomaly"] == service.rule_stats["AmountDeviationRule"]
+    assert breakdown["Large amount"] == service.rule_stats["LargeAmountRule"]
@@ -0,0 +1,45 @@
+import numpy as np
+
+from app.config import ServiceConfig
+from app.sevices.parallel import shard_bounds
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import (AmountDeviationRule, MerchantAnomalyRule, ReplayCheckRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule)
+
+from tests.test_profiles import _assert_same_profiles
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+def _analyze(mode, tmp_path):
+    service_config = ServiceConfig()
+    service_config.workers = 3
+    service = RuleBasedFraudMonitoringService(rules=[
+        VelocityCheckRule(), TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(),
+        UnusualMerchantActivityRule(), ReplayCheckRule()
+    ], service_config=service_config)
+    output_file = tmp_path / f"output-{mode}.csv"
+    service.analyze_data(CSV_PATH, str(output_file), str(tmp_path / f"report-{mode}.json"), mode=mode)
+    return service, output_file.read_bytes()
+
+
+def test_parallel_matches_memory(tmp_path):
+    memory, memory_output = _analyze("memory", tmp_path)
+    parallel, parallel_output = _analyze("parallel", tmp_path)
+
+    assert parallel.rule_stats == memory.rule_stats
+    assert list(parallel.rule_stats) == list(memory.rule_stats)
+    assert parallel._report_counts() == memory._report_counts()
+    assert parallel_output == memory_output
+    _assert_same_profiles(parallel.user_profiles, memory.user_profiles)
+
+
+def test_shard_bounds_cut_between_users_only():
+    user_ids = np.sort(np.random.default_rng(0).integers(0, 40, 1000))
+    bounds = shard_bounds(user_ids, 7)
+    assert bounds[0][0] == 0 and bounds[-1][1] == len(user_ids)
+    assert all(stop == start for (_, stop), (start, _) in zip(bounds, bounds[1:]))
+    for start, _ in bounds[1:]:
+        assert user_ids[start] != user_ids[start - 1]
+    assert shard_bounds(np.zeros(0, dtype=np.int64), 4) == []
+    assert shard_bounds(np.ones(10, dtype=np.int64), 4) == [(0, 10)]
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.sevices.point_in_time import point_in_time_features
+from app.sevices.profiles import ProfileStore
+
+from tests.test_profiles import _transactions
+
+
+def _naive_features(transactions: pd.DataFrame, min_history: int) -> pd.DataFrame:
+    """Join every transaction against profiles rebuilt from its user's strictly earlier transactions."""
+    rows = []
+    for index in transactions.index:
+        row = transactions.loc[[index]]
+        earlier = transactions[(transactions['userId'] == row['userId'].iloc[0])
+                               & (transactions['timestamp'] < row['timestamp'].iloc[0])]
+        store = ProfileStore.build(earlier, min_history) if len(earlier) else ProfileStore.empty(min_history)
+        rows.append(store.to_table().join(row))
+    return pd.concat(rows)
+
+
+@pytest.mark.parametrize('min_history', [1, 3])
+def test_features_match_profiles_of_earlier_transactions(min_history):
+    transactions = _transactions(14, 300, range(0, 2))
+    # Whole hours, so some transactions of a user share a timestamp and must not see each other.
+    transactions['timestamp'] = transactions['timestamp'].dt.floor('h')
+    assert transactions.duplicated(['userId', 'timestamp']).any()
+
+    features = point_in_time_features(transactions, min_history)
+    expected = _naive_features(transactions, min_history)
+
+    assert list(features.index) == list(transactions.index)
+    assert sorted(features.columns) == sorted(expected.columns)
+    np.testing.assert_array_equal(features['has_profile'], expected['has_profile'])
+    for name in ('hour_mask', 'merchant_count'):
+        np.testing.assert_array_equal(features[name].to_numpy(np.int64), expected[name].to_numpy(np.int64), name)
+    for name in ('transaction_count', 'amount_mean', 'amount_std', 'merchant_amount_mean', 'merchant_amount_std'):
+        np.testing.assert_allclose(features[name].to_numpy(np.float64), expected[name].to_numpy(np.float64),
+                                   rtol=1e-9, atol=1e-9, err_msg=name)
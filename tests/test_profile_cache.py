@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from app.config import ServiceConfig
+from app.models.model import Transaction
+from app.sevices.profile_cache import ProfileCache, SnapshotProfileSource, TransactionStoreProfileSource
+from app.sevices.profiles import ProfileStore
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.store import TransactionStore
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+@pytest.fixture(scope="module")
+def transactions() -> pd.DataFrame:
+    transactions = pd.read_csv(CSV_PATH)
+    transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    return transactions
+
+
+class KnownUserRule:
+    """A rule in the original style, reading the profiles by userId."""
+    flag = 1 << 15
+    label = "Known user"
+
+    def apply(self, transactions: pd.DataFrame, user_profiles: dict = None) -> int:
+        known = transactions['userId'].map(lambda userId: user_profiles.get(userId) is not None)
+        transactions.loc[known, 'flags'] |= self.flag
+        return int(known.sum())
+
+
+def test_cache_reads_like_the_store(transactions):
+    store = ProfileStore.build(transactions)
+    cache = ProfileCache(SnapshotProfileSource(store), max_bytes=1 << 20)
+    userId = int(transactions['userId'].iloc[0])
+    assert userId in cache and 10 ** 9 not in cache and "user" not in cache
+    assert cache[userId]['transaction_count'] == store[userId]['transaction_count']
+    assert cache.get(userId)['active_hours'] == store[userId]['active_hours']
+    assert cache.get(10 ** 9) is None and cache.get(10 ** 9, {}) == {}
+    with pytest.raises(KeyError):
+        cache[10 ** 9]
+
+
+def _service_config(tmp_path, **values) -> ServiceConfig:
+    service_config = ServiceConfig()
+    service_config.profile_snapshot_path = str(tmp_path / "profiles.snapshot")
+    for name, value in values.items():
+        setattr(service_config, name, value)
+    return service_config
+
+
+def test_service_scores_rules_without_evaluate_and_saves_through_cache(transactions, tmp_path):
+    service = RuleBasedFraudMonitoringService(rules=[KnownUserRule()],
+                                              service_config=_service_config(tmp_path, profile_cache_max_bytes=1 << 20))
+    service.swap_profiles(ProfileStore.build(transactions))
+    assert isinstance(service.user_profiles, ProfileCache)
+    row = transactions.iloc[0]
+    transaction = Transaction(user_id=int(row['userId']), timestamp=str(row['timestamp']),
+                              merchant_name=row['merchantName'], amount=float(row['amount']))
+    assert service.detect_fraud(transaction, [KnownUserRule()]).is_fraud
+    assert service.save_profile_snapshot()
+    assert service.load_profile_snapshot()
+
+
+def test_store_source_counts_without_refreshing_and_cache_invalidates(transactions, tmp_path):
+    store = TransactionStore(f"sqlite:///{tmp_path / 'transactions.db'}")
+    store.ingest(transactions)
+    cache = ProfileCache(TransactionStoreProfileSource(store), max_bytes=1 << 20)
+    users = transactions['userId'].nunique()
+    # Nothing is refreshed yet, so reading the size does not see the ingested users.
+    assert len(cache) == 0
+    userId = int(transactions['userId'].iloc[0])
+    before = cache.profile(userId).transaction_count
+    assert len(cache) == users
+
+    store.ingest([Transaction(user_id=userId, timestamp="2025-03-01 10:00:00", merchant_name="Costco", amount=10.0)])
+    assert len(cache) == users
+    assert cache.profile(userId).transaction_count == before
+    cache.invalidate([userId])
+    assert cache.profile(userId).transaction_count == before + 1
+
+    service = RuleBasedFraudMonitoringService(service_config=_service_config(tmp_path))
+    service.swap_profiles(cache)
+    assert not service.save_profile_snapshot()
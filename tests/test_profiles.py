@@ -0,0 +1,177 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.sevices.profiles import ProfileStore
+from app.sevices.snapshots import load_snapshot, write_snapshot
+from app.sevices.rules.velocity import window_counts
+
+MERCHANTS = ['Amazon', 'Costco', 'HOLA', 'Starbucks', 'Walmart']
+
+
+def _transactions(seed: int, n: int, users: range, merchants=MERCHANTS) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    start = np.datetime64('2025-02-01T00:00:00')
+    return pd.DataFrame({
+        'userId': rng.choice(list(users), n),
+        'timestamp': pd.to_datetime(start + rng.integers(0, 28 * 24 * 3600, n).astype('timedelta64[s]')),
+        'merchantName': rng.choice(merchants, n),
+        'amount': rng.gamma(2.0, 50.0, n).round(2),
+    })
+
+
+def _assert_same_profiles(actual: ProfileStore, expected: ProfileStore) -> None:
+    assert sorted(actual) == sorted(expected)
+    for userId in expected:
+        got, want = actual[userId], expected[userId]
+        assert got['transaction_count'] == want['transaction_count']
+        assert got['active_hours'] == want['active_hours']
+        assert got['common_merchants'] == want['common_merchants']
+        for key in ('amount_mean', 'amount_std', 'min_amount', 'max_amount'):
+            assert got[key] == pytest.approx(want[key], rel=1e-9, nan_ok=True), (userId, key)
+        for key in ('merchant_wise_amount_mean', 'merchant_wise_amount_std'):
+            assert got[key].keys() == want[key].keys()
+            for merchant, value in want[key].items():
+                assert got[key][merchant] == pytest.approx(value, rel=1e-9, nan_ok=True), (userId, key, merchant)
+        assert actual.profile(userId).hour_mask == expected.profile(userId).hour_mask
+
+
+def _naive_profiles(transactions: pd.DataFrame, min_history: int) -> dict:
+    """Profile dicts built one user at a time, as build_user_profiles did before ProfileStore."""
+    profiles = {}
+    for userId, user_txns in transactions.groupby('userId'):
+        if len(user_txns) < min_history:
+            continue
+        amount_mean = user_txns['amount'].mean()
+        profiles[userId] = {
+            'active_hours': user_txns['timestamp'].dt.hour.value_counts().to_dict(),
+            'common_merchants': {k: v for k, v in user_txns['merchantName'].value_counts().to_dict().items() if v >= 2},
+            'merchant_wise_amount_mean': user_txns.groupby('merchantName')['amount'].mean().to_dict(),
+            'merchant_wise_amount_std': user_txns.groupby('merchantName')['amount'].std().to_dict(),
+            'amount_mean': amount_mean,
+            'amount_std': user_txns['amount'].std() if len(user_txns) > 1 else amount_mean / 2,
+            'min_amount': user_txns['amount'].min(),
+            'max_amount': user_txns['amount'].max(),
+            'transaction_count': len(user_txns),
+        }
+    return profiles
+
+
+@pytest.mark.parametrize('min_history', [1, 3])
+def test_build_matches_per_user_profiles(min_history):
+    # Few transactions per user, so single-transaction users and merchants are common.
+    transactions = _transactions(11, 300, range(0, 80))
+    store = ProfileStore.build(transactions, min_history)
+    expected = _naive_profiles(transactions, min_history)
+    assert sorted(store) == sorted(expected)
+    assert len(store) == len(expected) > 0
+    for userId, want in expected.items():
+        got = store[userId]
+        assert got.keys() == want.keys()
+        assert got['transaction_count'] == want['transaction_count']
+        assert got['active_hours'] == want['active_hours']
+        assert got['common_merchants'] == want['common_merchants']
+        for key in ('amount_mean', 'amount_std', 'min_amount', 'max_amount'):
+            assert got[key] == pytest.approx(want[key], rel=1e-9), (userId, key)
+        for key in ('merchant_wise_amount_mean', 'merchant_wise_amount_std'):
+            assert got[key].keys() == want[key].keys()
+            for merchant, value in want[key].items():
+                assert got[key][merchant] == pytest.approx(value, rel=1e-9, nan_ok=True), (userId, key, merchant)
+    for userId in set(transactions['userId']) - set(expected):
+        assert userId not in store and store.profile(userId) is None
+
+
+@pytest.mark.parametrize('min_history', [1, 3])
+def test_merge_matches_build_on_concatenated_data(min_history):
+    # Overlapping users, users only on one side, and a merchant only in the second batch.
+    first = _transactions(1, 400, range(0, 30))
+    second = _transactions(2, 300, range(20, 45), MERCHANTS + ['Target'])
+    store = ProfileStore.build(first, min_history)
+    store.merge(ProfileStore.build(second, min_history))
+    _assert_same_profiles(store, ProfileStore.build(pd.concat([first, second]), min_history))
+
+
+def test_update_matches_build_on_concatenated_data():
+    first = _transactions(3, 400, range(0, 30))
+    second = _transactions(4, 200, range(20, 45), MERCHANTS + ['Target'])
+    store = ProfileStore.build(first)
+    for txn in second.itertuples():
+        store.update(txn.userId, txn.timestamp.hour, txn.merchantName, txn.amount)
+    _assert_same_profiles(store, ProfileStore.build(pd.concat([first, second])))
+    # Pending merchant pairs give the same answers once compacted into the CSR arrays.
+    store.compact()
+    _assert_same_profiles(store, ProfileStore.build(pd.concat([first, second])))
+
+
+def test_update_then_merge_matches_build():
+    batches = [_transactions(seed, 150, range(0, 25)) for seed in (5, 6, 7)]
+    store = ProfileStore.build(batches[0])
+    for txn in batches[1].itertuples():
+        store.update(txn.userId, txn.timestamp.hour, txn.merchantName, txn.amount)
+    store.merge(ProfileStore.build(batches[2]))
+    _assert_same_profiles(store, ProfileStore.build(pd.concat(batches)))
+
+
+def test_snapshot_of_updated_store_is_sorted_and_matches_build(tmp_path):
+    first = _transactions(8, 300, range(20, 40))
+    second = _transactions(9, 200, range(0, 50), MERCHANTS + ['Target'])
+    store = ProfileStore.build(first)
+    # New users arrive out of order, on both sides of the existing ids.
+    for txn in second.itertuples():
+        store.update(txn.userId, txn.timestamp.hour, txn.merchantName, txn.amount)
+    write_snapshot(store, tmp_path / 'profiles.snapshot')
+    loaded = load_snapshot(tmp_path / 'profiles.snapshot')
+    assert np.all(np.diff(loaded.user_ids) > 0)
+    expected = ProfileStore.build(pd.concat([first, second]))
+    _assert_same_profiles(loaded, expected)
+    assert 1000 not in loaded and loaded.profile(1000) is None
+    # The loaded store keeps taking updates, including users beyond and between its ids.
+    third = _transactions(10, 100, range(0, 60))
+    for txn in third.itertuples():
+        loaded.update(txn.userId, txn.timestamp.hour, txn.merchantName, txn.amount)
+    _assert_same_profiles(loaded, ProfileStore.build(pd.concat([first, second, third])))
+
+
+def test_table_of_some_users_matches_whole_table():
+    transactions = _transactions(15, 400, range(0, 40))
+    store = ProfileStore.build(transactions, min_history=3)
+    # Updated users go through pending merchant pairs, unknown and unprofiled users are skipped.
+    for txn in _transactions(16, 50, range(0, 10), MERCHANTS + ['Target']).itertuples():
+        store.update(txn.userId, txn.timestamp.hour, txn.merchantName, txn.amount)
+    wanted = [39, 3, 1000, 3, 17, 0]
+    whole, some = store.to_table(), store.to_table(np.array(wanted))
+    expected_users = whole.users[whole.users.index.isin(wanted)]
+    pd.testing.assert_frame_equal(some.users, expected_users)
+    pd.testing.assert_frame_equal(some.merchants.reset_index(drop=True),
+                                  whole.merchants[whole.merchants['userId'].isin(wanted)].reset_index(drop=True))
+    sample = transactions[transactions['userId'].isin(wanted)]
+    pd.testing.assert_frame_equal(some.join(sample), whole.join(sample))
+
+
+def _naive_window_counts(user_ids, timestamps, window):
+    ts = pd.to_datetime(timestamps)
+    return np.array([((user_ids == user) & (ts >= t - window) & (ts <= t)).sum()
+                     for user, t in zip(user_ids, ts)])
+
+
+def test_window_counts_are_inclusive_at_ties():
+    user_ids = np.array([1, 1, 1, 1, 2, 2, 1])
+    timestamps = np.array(['2025-01-01T10:00', '2025-01-01T10:00', '2025-01-01T10:30', '2025-01-01T10:30',
+                           '2025-01-01T10:00', '2025-01-01T10:30', '2025-01-01T10:31'], dtype='datetime64[ns]')
+    counts = window_counts(user_ids, timestamps, [timedelta(minutes=30), timedelta(0)])
+    # Both ends of the window are inclusive and rows at the same timestamp count each other.
+    assert counts[0].tolist() == [2, 2, 4, 4, 1, 2, 3]
+    assert counts[1].tolist() == [2, 2, 2, 2, 1, 1, 1]
+
+
+def test_window_counts_match_naive_count():
+    transactions = _transactions(8, 500, range(0, 5))
+    # Round to the hour so many rows share a timestamp or sit exactly on a window boundary.
+    timestamps = transactions['timestamp'].dt.floor('h').to_numpy()
+    user_ids = transactions['userId'].to_numpy()
+    windows = [timedelta(hours=1), timedelta(hours=6)]
+    counts = window_counts(user_ids, timestamps, windows)
+    for window, count in zip(windows, counts):
+        np.testing.assert_array_equal(count, _naive_window_counts(user_ids, timestamps, window))
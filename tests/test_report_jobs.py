@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from app.config import ServiceConfig
+from app.getters import get_all_rules
+from app.models.model import Transaction
+from app.sevices.jobs import ReportJobManager
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+def _wait(jobs, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not all(job.finished for job in jobs):
+        assert time.monotonic() < deadline, "report jobs did not finish"
+        time.sleep(0.05)
+
+
+def test_concurrent_jobs_write_their_own_files(tmp_path):
+    service = RuleBasedFraudMonitoringService(rules=get_all_rules(), service_config=ServiceConfig())
+    manager = ReportJobManager(service, workers=2)
+    jobs = [manager.submit(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json")) for _ in range(2)]
+    _wait(jobs)
+    assert [job.status for job in jobs] == ["completed", "completed"]
+    assert len({job.output_file for job in jobs} | {job.report_file for job in jobs}) == 4
+    for job in jobs:
+        assert job.job_id in job.report_file
+        with open(job.report_file) as f:
+            assert json.load(f) == job.report
+
+
+def test_forgotten_jobs_remove_their_files(tmp_path):
+    service = RuleBasedFraudMonitoringService(rules=get_all_rules(), service_config=ServiceConfig())
+    manager = ReportJobManager(service, max_jobs=1)
+    first = manager.submit(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    _wait([first])
+    second = manager.submit(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    _wait([second])
+    assert manager.get(first.job_id) is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        [f"output-{second.job_id}.csv", f"report-{second.job_id}.json"])
+
+
+def test_failed_job_writes_nothing_and_keeps_the_profiles(tmp_path):
+    service_config = ServiceConfig()
+    service_config.profile_snapshot_path = str(tmp_path / "profiles.snapshot")
+    service = RuleBasedFraudMonitoringService(rules=get_all_rules(), service_config=service_config)
+    manager = ReportJobManager(service)
+    first = manager.submit(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    _wait([first])
+    profiles = service.user_profiles
+    snapshot = (tmp_path / "profiles.snapshot").read_bytes()
+
+    failed = manager.submit(str(tmp_path / "missing.csv"), str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    _wait([failed])
+    assert failed.status == "failed" and "missing.csv" in failed.error
+    assert not os.path.exists(failed.output_file) and not os.path.exists(failed.report_file)
+    assert (tmp_path / "profiles.snapshot").read_bytes() == snapshot
+    assert service.user_profiles is profiles and len(profiles) > 0
+
+
+def test_job_keeps_incremental_profiles(tmp_path):
+    service_config = ServiceConfig()
+    service_config.incremental_profiles = True
+    service_config.profile_snapshot_path = str(tmp_path / "profiles.snapshot")
+    service = RuleBasedFraudMonitoringService(rules=get_all_rules(), service_config=service_config)
+    service.load_data(CSV_PATH)
+    service.build_user_profiles()
+    count = service.user_profiles[1]['transaction_count']
+    for minute in range(5):
+        service.detect_fraud(Transaction(user_id=1, timestamp=f"2025-03-01T10:0{minute}:00", merchant_name="NewShop",
+                                         amount=25.0), [])
+    profiles = service.user_profiles
+
+    job = ReportJobManager(service).submit(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    _wait([job])
+    assert job.status == "completed"
+    # Scoring keeps folding into the same profiles, with what it learned online.
+    assert service.user_profiles is profiles
+    assert profiles[1]['transaction_count'] == count + 5
+    assert profiles[1]['merchant_wise_amount_mean']['NewShop'] == 25.0
+    assert not (tmp_path / "profiles.snapshot").exists()
@@ -0,0 +1,57 @@
+import struct
+
+import pytest
+
+from app.config import ServiceConfig
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import AmountDeviationRule, TimeAnomalyRule
+from app.sevices.snapshots import SNAPSHOT_MAGIC, load_snapshot
+from app.sevices.store import TransactionStore
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+def _service(tmp_path, mode="memory") -> RuleBasedFraudMonitoringService:
+    service_config = ServiceConfig()
+    service_config.analysis_mode = mode
+    service_config.profile_snapshot_path = str(tmp_path / "profiles.snapshot")
+    return RuleBasedFraudMonitoringService(rules=[TimeAnomalyRule(), AmountDeviationRule()],
+                                           service_config=service_config)
+
+
+@pytest.mark.parametrize('mode', ["memory", "streaming"])
+def test_failed_run_leaves_the_snapshot_alone(tmp_path, mode):
+    snapshot = tmp_path / "profiles.snapshot"
+    _service(tmp_path).analyze_data(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    written = snapshot.read_bytes()
+    users = len(load_snapshot(str(snapshot)))
+    assert users > 0
+
+    (tmp_path / "header.csv").write_text("userId,timestamp,merchantName,amount\n")
+    (tmp_path / "garbage.csv").write_text("not,a\ntransaction,file\n")
+    store = TransactionStore(f"sqlite:///{tmp_path / 'transactions.db'}")
+    for source in (str(tmp_path / "missing.csv"), str(tmp_path / "header.csv"), str(tmp_path / "garbage.csv"), store):
+        service = _service(tmp_path, mode)
+        with pytest.raises(Exception):
+            service.analyze_data(source, str(tmp_path / "failed-output.csv"), str(tmp_path / "failed-report.json"))
+        assert snapshot.read_bytes() == written
+        assert not (tmp_path / "failed-output.csv").exists()
+        assert not (tmp_path / "failed-report.json").exists()
+
+    service = _service(tmp_path)
+    assert service.load_profile_snapshot()
+    assert len(service.user_profiles) == users
+
+
+def test_load_rejects_other_files_and_versions(tmp_path):
+    service = _service(tmp_path)
+    service.analyze_data(CSV_PATH, str(tmp_path / "output.csv"), str(tmp_path / "report.json"))
+    snapshot = tmp_path / "profiles.snapshot"
+    data = bytearray(snapshot.read_bytes())
+    struct.pack_into("<I", data, len(SNAPSHOT_MAGIC), 2)
+    (tmp_path / "other-version.snapshot").write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="version 2"):
+        load_snapshot(str(tmp_path / "other-version.snapshot"))
+    (tmp_path / "other.snapshot").write_bytes(b"x" * 64)
+    with pytest.raises(ValueError, match="not a profile snapshot"):
+        load_snapshot(str(tmp_path / "other.snapshot"))
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from app.config import ServiceConfig
+from app.sevices.profiles import ProfileStore
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import (AmountDeviationRule, MerchantAnomalyRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule)
+from app.sevices.store import TransactionStore
+
+from tests.test_profiles import MERCHANTS, _assert_same_profiles, _transactions
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+@pytest.fixture
+def store(tmp_path) -> TransactionStore:
+    return TransactionStore(f"sqlite:///{tmp_path / 'transactions.db'}")
+
+
+@pytest.mark.parametrize('min_history', [1, 3])
+def test_store_profiles_match_build(store, min_history):
+    first = _transactions(12, 400, range(0, 60))
+    store.ingest(first)
+    _assert_same_profiles(store.load_profiles(min_history), ProfileStore.build(first, min_history))
+
+    # Only the users of the second batch are recomputed, the others keep their aggregates.
+    second = _transactions(13, 200, range(40, 90), MERCHANTS + ['Target'])
+    store.ingest(second)
+    assert store.refresh_profiles() == second['userId'].nunique()
+    both = pd.concat([first, second])
+    _assert_same_profiles(store.load_profiles(min_history), ProfileStore.build(both, min_history))
+    assert store.profile_count(min_history) == len(ProfileStore.build(both, min_history))
+
+    some = sorted(second['userId'].unique())[:5]
+    _assert_same_profiles(store.load_profiles(min_history, user_ids=some),
+                          ProfileStore.build(both[both['userId'].isin(some)], min_history))
+
+
+def test_store_report_matches_csv_report(store, tmp_path):
+    store.ingest_csv(CSV_PATH, chunksize=3000)
+    outputs = []
+    for source in (CSV_PATH, store):
+        service = RuleBasedFraudMonitoringService(rules=[
+            VelocityCheckRule(), TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(),
+            UnusualMerchantActivityRule()
+        ], service_config=ServiceConfig())
+        output_file = tmp_path / f"output-{len(outputs)}.csv"
+        service.analyze_data(source, str(output_file), str(tmp_path / f"report-{len(outputs)}.json"))
+        outputs.append((service.rule_stats, service._report_counts(), output_file.read_bytes()))
+    assert outputs[0] == outputs[1]
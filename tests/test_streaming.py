@@ -0,0 +1,38 @@
+import pandas as pd
+
+from app.config import ServiceConfig
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import (AmountDeviationRule, MerchantAnomalyRule, TimeAnomalyRule,
+                                     UnusualMerchantActivityRule, VelocityCheckRule)
+
+from tests.test_profiles import _assert_same_profiles
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+def _analyze(mode, tmp_path, incremental_profiles=False):
+    service_config = ServiceConfig()
+    service_config.stream_partitions = 4
+    service_config.stream_chunksize = 2500
+    service_config.incremental_profiles = incremental_profiles
+    service = RuleBasedFraudMonitoringService(rules=[
+        VelocityCheckRule(), TimeAnomalyRule(), MerchantAnomalyRule(), AmountDeviationRule(),
+        UnusualMerchantActivityRule()
+    ], service_config=service_config)
+    name = f"{mode}-{incremental_profiles}"
+    service.analyze_data(CSV_PATH, str(tmp_path / f"output-{name}.csv"), str(tmp_path / f"report-{name}.json"),
+                         mode=mode)
+    return service, pd.read_csv(tmp_path / f"output-{name}.csv")
+
+
+def test_streaming_matches_memory(tmp_path):
+    memory, memory_output = _analyze("memory", tmp_path)
+    key = ['userId', 'timestamp', 'merchantName', 'amount']
+    for incremental_profiles in (False, True):
+        streaming, streaming_output = _analyze("streaming", tmp_path, incremental_profiles)
+        assert streaming.rule_stats == memory.rule_stats
+        assert streaming.transactions.empty
+        # Rows are grouped by partition, compare them in one order.
+        pd.testing.assert_frame_equal(streaming_output.sort_values(key, kind='stable').reset_index(drop=True),
+                                      memory_output.sort_values(key, kind='stable').reset_index(drop=True))
+        _assert_same_profiles(streaming.user_profiles, memory.user_profiles)
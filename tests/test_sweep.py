@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.config import ServiceConfig, config
+from app.sevices.rule_based_detection import RuleBasedFraudMonitoringService
+from app.sevices.rules.rules import FLAGS_COLUMN
+from app.sevices.sweep import SWEEP_FIELDS, SWEEP_RULES, config_grid
+
+CSV_PATH = "app/data/user_transactions.csv"
+
+
+@pytest.fixture(scope="module")
+def transactions() -> pd.DataFrame:
+    transactions = pd.read_csv(CSV_PATH)
+    transactions['timestamp'] = pd.to_datetime(transactions['timestamp'])
+    return transactions
+
+
+@pytest.mark.parametrize('point_in_time', [False, True])
+def test_sweep_matches_full_runs(transactions, monkeypatch, point_in_time):
+    configs = config_grid(velocity_window_minutes=[10, 60], velocity_threshold_count=[2, 3],
+                          time_anomaly_hour_tolerance=[0, 2], merchant_anomaly_risk_threshold=[0.2, 0.5],
+                          amount_deviation_std_threshold=[1.5, 2.5], unusual_merchant_activity_threshold=[1.0],
+                          min_user_history=[1, 5])
+    service = RuleBasedFraudMonitoringService(rules=[rule() for rule in SWEEP_RULES], service_config=ServiceConfig())
+    service.set_transactions(transactions)
+    sweep = service.sweep_rule_configs(configs, point_in_time=point_in_time)
+    assert len(sweep) == len(configs)
+
+    for rule_config, (_, row) in zip(configs, sweep.iterrows()):
+        # The rules read their thresholds from the module-level config.
+        for field in SWEEP_FIELDS:
+            monkeypatch.setattr(config, field, getattr(rule_config, field))
+        run = RuleBasedFraudMonitoringService(config=rule_config, rules=[rule() for rule in SWEEP_RULES],
+                                              service_config=ServiceConfig())
+        run.set_transactions(transactions)
+        rule_stats = run.run_all_rules(point_in_time=point_in_time)
+        suspicious = run.transactions[FLAGS_COLUMN].to_numpy() != 0
+
+        assert row[list(SWEEP_FIELDS)].tolist() == [getattr(rule_config, field) for field in SWEEP_FIELDS]
+        assert {rule.label: row[rule.label] for rule in SWEEP_RULES} == \
+            {rule.label: rule_stats[rule.__name__] for rule in SWEEP_RULES}
+        assert row['suspicious'] == int(suspicious.sum())
+        assert row['suspicious_users'] == run.transactions['userId'][suspicious].nunique()
+    assert sweep['suspicious'].nunique() > 1
+
+
+def test_sweep_counts_only_the_service_rules(transactions):
+    rules = [rule() for rule in SWEEP_RULES[1:3]]
+    service = RuleBasedFraudMonitoringService(rules=rules, service_config=ServiceConfig())
+    service.set_transactions(transactions)
+    sweep = service.sweep_rule_configs(config_grid(time_anomaly_hour_tolerance=[0, 3]))
+    labels = [rule.label for rule in rules]
+    assert list(sweep.columns) == list(SWEEP_FIELDS) + labels + ['suspicious', 'suspicious_users', 'user_coverage']
+    assert np.all(sweep['suspicious'] <= sweep[labels].sum(axis=1))
+
+
+def test_config_grid_rejects_unknown_fields():
+    with pytest.raises(ValueError):
+        config_grid(no_such_threshold=[1])